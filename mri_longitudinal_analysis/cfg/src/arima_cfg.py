@@ -6,6 +6,9 @@ COHORT = "BCH"  # "BCH" or "CBTN"
 TIME_SERIES_DIR_CBTN = Path("/mnt/93E8-0534/JuanCarlos/mri-classification-sequences/cbtn_longitudinal_dataset/pre_event/accepted/pre_treatment/output/time_series/moving_average")
 TIME_SERIES_DIR_BCH = Path("/mnt/93E8-0534/JuanCarlos/mri-classification-sequences/bch_longitudinal_dataset/final/pre_treatment/output/time_series/moving_average")
 TIME_SERIES_DIR_COHORT = TIME_SERIES_DIR_CBTN if COHORT == "CBTN" else TIME_SERIES_DIR_BCH
+# Only used if the directory above is the Parquet dataset (output/time_series/time_series.parquet)
+TIME_SERIES_METHOD = "moving_average"
+TIME_SERIES_COLUMNS = None  # e.g. ["Age", "Volume"], None loads all columns
 
 OUTPUT_DIR = Path(
     f"/home/jc053/GIT/mri_longitudinal_analysis/data/output/arima_plots_{COHORT.lower()}"
@@ -7,6 +7,8 @@ INPUT_PATH = Path(
     "/mnt/93E8-0534/JuanCarlos/mri-classification-sequences/cbtn_longitudinal_dataset/pre_event/output/time_series_csv_kernel_smoothed"
 )
 
+# Smoothing method loaded if INPUT_PATH is the Parquet time series dataset
+TIME_SERIES_METHOD = "kernel"
 
 OUTPUT_PATH = Path("/home/jc053/GIT/mri_longitudinal_analysis/data/output/")
 PLOTS_OUTPUT_PATH = OUTPUT_PATH / "clustering_plots"
@@ -23,6 +23,12 @@ CLINICAL_CSV_PATHS = {
     "cbtn": CLINICAL_CSV_CBTN
 }
 
+# The volume paths can also point to the Parquet dataset of the volume estimation
+# (output/time_series/time_series.parquet), in which case this method is loaded
+VOLUMES_METHOD = "moving_average"
+# Threads reading the per-patient CSV files of a volume path
+LOADER_WORKERS = 8
+
 VOLUMES_DATA_PATHS = {
     "df_bch": VOLUMES_BCH,
     "cbtn": VOLUMES_CBTN,
@@ -30,6 +36,7 @@ VOLUMES_DATA_PATHS = {
 }
 OUTPUT_DIR = Path("/home/jc053/GIT/mri_longitudinal_analysis/data/output/01_cohort_data")
 OUTPUT_STATS_FILE = OUTPUT_DIR / f"{COHORT.lower()}_cohort_stats.txt"
+OUTPUT_STATS_TABLE_FILE = OUTPUT_DIR / f"{COHORT.lower()}_cohort_stats.csv" # table of all statistics, .csv or .txt
 COHORT_TABLE_FILE = OUTPUT_DIR / f"{COHORT.lower()}_cohort_table.csv" # can be a .csv or .txt
 
 # DICTIONARIES: Symptoms, Locations, Glioma Types
@@ -24,6 +24,50 @@ TEMP_IMG = TEMP_DIR / "temp_head.nii.gz"
 REGISTRATION = True
 EXTRACTION = True
 BF_CORRECTION = False  # beware,there is a predefined BF in the registration process already
+APPLY_TRANSFORMS = False  # resample with the transforms saved in REG_DIR, no registration
+
+# Registration engine: scans are registered in a pool of REGISTRATION_WORKERS processes
+# (None: number of CPUs // REGISTRATION_THREADS) with REGISTRATION_THREADS SimpleITK
+# threads each. The ledger records status, duration and error of every scan.
+REGISTRATION_WORKERS = None
+REGISTRATION_THREADS = 2
+REGISTRATION_LEDGER = REG_DIR / "registration_ledger.sqlite"
+RESUME = True  # skip scans that are already registered
+RETRY_FAILED = False  # with RESUME, also run the scans that failed before
+# The template resampled to 1 mm and its pyramid levels are prepared once and cached here
+TEMPLATE_CACHE_DIR = OUPUT_DIR / "template_cache"
+
+# N4 bias field correction (registration and BF_CORRECTION). The fast mode estimates the
+# field on the image shrunk by N4_SHRINK_FACTOR with N4_ITERATIONS per fitting level and
+# applies it at full resolution, otherwise N4 runs on the full image with its defaults.
+N4_FAST = False  # opt in: the fast field differs from the full-resolution N4 results
+N4_SHRINK_FACTOR = 4
+N4_ITERATIONS = [50, 50, 30, 20]
+N4_CONVERGENCE = 0.001
+# Saved log bias fields are reused by later passes over the same (unregistered) scans
+SAVE_BIAS_FIELDS = False
+BIAS_FIELD_DIR = OUPUT_DIR / "bias_fields"
+
+# Apply transforms: images '<id>*.nii.gz' (labels included) of the input directory are
+# resampled onto the template grid with '<id>_T2.tfm', labels with the nearest neighbor
+APPLY_TRANSFORMS_INPUT_DIR = INPUT_DIR
+APPLY_TRANSFORMS_OUTPUT_DIR = OUPUT_DIR / "T2W_transformed"
+APPLY_TRANSFORMS_INTERP = "linear"  # 'linear', 'bspline' or 'nearest_neighbor'
+
+# Fused pipeline: REGISTRATION, EXTRACTION and BF_CORRECTION run per scan in memory,
+# connected by queues of PIPELINE_QUEUE_SIZE scans, only the final images are written
+FUSED_PIPELINE = False
+PIPELINE_OUTPUT_DIR = OUPUT_DIR / "T2W_preprocessed"
+PIPELINE_QUEUE_SIZE = 2
+# stages after which the images are also saved for debugging, out of
+# "registration", "brain_extraction" and "bias_correction"
+PIPELINE_CHECKPOINTS = []
+PIPELINE_CHECKPOINT_DIR = OUPUT_DIR / "pipeline_checkpoints"
+
+# Wall time, CPU time, peak RSS and optimizer values per scan and stage (JSON lines) of
+# the registration and the fused pipeline, None to disable. Summarized by
+# utils/preprocess_profile.py.
+PROFILE_FILE = OUPUT_DIR / "preprocess_profile.jsonl"
 
 
 LIMIT_LOADING = 2000
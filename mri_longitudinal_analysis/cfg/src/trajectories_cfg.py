@@ -2,7 +2,7 @@
 from pathlib import Path
 COHORT = "JOINT"    # DF_BCH or CBTN or JOINT
 SAMPLE_SIZE = 99    # DF_BCH: 56, CBTN: 43, JOINT: 99
-COHORT_DATAFRAME = Path(f"/home/jc053/GIT/mri_longitudinal_analysis/data/output/01_cohort_data/{COHORT.lower()}_cohort_data_features.csv")
+COHORT_DATAFRAME = Path(f"/home/jc053/GIT/mri_longitudinal_analysis/data/output/01_cohort_data/{COHORT.lower()}_cohort_data_features.parquet")
 
 OUTPUT_DIR = Path("/home/jc053/GIT/mri_longitudinal_analysis/data/output/02_trajectories")
 CURVE_VARS = [
@@ -19,6 +19,13 @@ PROGRESSION_THRESHOLD = 1.25    # +25% volume change threshold that defines prog
 REGRESSION_THRESHOLD = 0.75     # -25% volume change threshold that defines regression on normalized volume
 CHANGE_THRESHOLD = 1.10         # +10% volume change threshold for stability index / time gap
 
+# Sensitivity of the classification to the thresholds: evaluates all combinations of
+# the thresholds below instead of the classification analysis and its plots
+THRESHOLD_SWEEP = False
+SWEEP_PROGRESSION_THRESHOLDS = [round(1.05 + 0.05 * i, 2) for i in range(10)]    # +5% to +50%
+SWEEP_REGRESSION_THRESHOLDS = [round(0.95 - 0.05 * i, 2) for i in range(10)]     # -5% to -50%
+SWEEP_CHANGE_THRESHOLDS = [CHANGE_THRESHOLD]
+
 TIME_PERIOD_MAPPING  = {
         "0-1 years": 1,
         "1-3 years": 3,
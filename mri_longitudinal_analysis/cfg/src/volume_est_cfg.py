@@ -26,6 +26,34 @@ FEW_SCANS_FILE = OUTPUT_DIR / "few_scans_patients.txt"
 HIGH_VOLUME_FILE = OUTPUT_DIR / "high_volume_segmentations.txt"
 VOLUME_THRESHOLD = 14000 
 
+# Size of the buffer used to stream the voxel data of each mask (bytes per worker)
+STREAM_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Volume cache: only new or modified masks (size / mtime) are re-read on re-runs
+VOLUME_CACHE = True
+VOLUME_CACHE_FILE = OUTPUT_DIR / "volume_cache.sqlite"
+VOLUME_CACHE_HASH = False  # also accept touched files whose content hash is unchanged
+
+# Lesion statistics computed in the same read as the volume and added as extra columns
+# to the time series ("label_volumes", "components", "bounding_box", "surface_area").
+# Opt-in: any non-empty list reads each mask in full (no chunked streaming, so the memory
+# per worker grows with the image size) and changes the volume cache entries. The empty
+# list only streams the foreground volume of every mask.
+LESION_METRICS = []
+LESION_LABELS = [1]
+LESION_CONNECTIVITY = 3  # 1: faces, 2: edges, 3: corners
+
+# Time series outputs: per-patient CSV files and/or one Parquet dataset partitioned by method
+TIME_SERIES_CSV = True
+TIME_SERIES_STORE = True
+TIME_SERIES_STORE_DIR = CSV_DIR / "time_series.parquet"
+
+# Incremental mode: only the patients with new, modified or removed masks since the last
+# run (see the manifest) get their series, csv's and plots rebuilt. Do a full run after
+# changing any of the processing options.
+INCREMENTAL = False
+INCREMENTAL_MANIFEST = OUTPUT_DIR / "incremental_manifest.json"
+
 # Clinical data files
 CLINICAL_DATA_FILE_CBTN = Path(
     "/home/jc053/GIT/mri_longitudinal_analysis/data/input/clinical/cbtn_filtered_pruned_treatment_513.csv"
@@ -42,5 +70,22 @@ WINDOW_SMOOTHING = True
 MOVING_AVERAGE = True
 PLOT_COMPARISON = True
 
+# Plotting: "all", "sampled" (only PLOT_SAMPLE_SIZE random patients) or "off"
+PLOT_MODE = "all"
+PLOT_WORKERS = 8  # processes rendering the figures, 0 or 1 renders in the main process
+PLOT_SAMPLE_SIZE = 10
+PLOT_SAMPLE_SEED = 42
+
+# Change point detection on the normalized volume curves, run once for all patients and
+# reused by the plots and the "Change Point(s)" columns of the time series.
+CHANGE_POINTS = True
+CHANGE_POINT_ALGORITHM = "pelt"  # "pelt", "binseg" or "window"
+CHANGE_POINT_MODEL = "rbf"
+CHANGE_POINT_PENALTY = 10
+CHANGE_POINT_WIDTH = 4  # window width of the "window" search
+CHANGE_POINT_WORKERS = 8
+CHANGE_POINT_CACHE = True
+CHANGE_POINT_CACHE_FILE = OUTPUT_DIR / "change_point_cache.sqlite"
+
 # Other options
 CONFIDENCE_INTERVAL = True
\ No newline at end of file
@@ -0,0 +1,24 @@
+"""Config file for the script benchmark_volume_estimation.py"""
+
+from pathlib import Path
+
+# Synthetic cohorts (one sub-directory per scale) and outputs of the benchmarked runs
+WORK_DIR = Path("/home/jc053/GIT/mri_longitudinal_analysis/data/benchmark/volume_estimation")
+RESULTS_FILE = WORK_DIR / "benchmark_results.csv"
+
+# Number of patients of the benchmarked cohorts
+SCALES = [100, 1000, 10000]
+REUSE_COHORTS = True  # keep the generated masks between benchmark runs
+
+# Synthetic masks, see synthetic_cohort_cfg for the meaning of the options
+SCANS_PER_PATIENT = (3, 8)
+SHAPE = (64, 64, 64)
+SPACING = (1.0, 1.0, 1.0)
+SEED = 42
+GENERATOR_WORKERS = 8
+
+# Options of the benchmarked volume estimation, caches are disabled to time cold runs
+VOLUME_CACHE = False
+CHANGE_POINT_CACHE = False
+PLOT_MODE = "sampled"  # rendering all plots of 10k patients takes hours
+PLOT_SAMPLE_SIZE = 50
@@ -0,0 +1,25 @@
+"""Config file for the script preprocess_profile.py"""
+
+from pathlib import Path
+
+# JSON lines written by the preprocessing (PROFILE_FILE of preprocess_cfg)
+PROFILE_FILE = Path(
+    "/mnt/93E8-0534/JuanCarlos/mri-classification-sequences/bch_longitudinal_dataset/new_review"
+    "/pp_retry/output/preprocess_profile.jsonl"
+)
+STAGE_REPORT_FILE = PROFILE_FILE.parent / "preprocess_profile_stages.csv"
+SCAN_REPORT_FILE = PROFILE_FILE.parent / "preprocess_profile_scans.csv"
+
+# Stages summed to the total time of a scan, nested stages would be counted twice
+TOTAL_STAGES = [
+    "read",
+    "n4",
+    "optimizer",
+    "resample",
+    "write",
+    "label",
+    "brain_extraction",
+    "bias_correction",
+]
+TOP_SCANS = 20  # slowest scans in the report
+OUTLIER_FACTOR = 10  # scans taking at least this times the median time are listed
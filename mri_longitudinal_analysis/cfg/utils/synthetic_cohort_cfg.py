@@ -0,0 +1,32 @@
+"""Config file for the script synthetic_cohort.py"""
+
+from pathlib import Path
+
+# Output directory of the masks (imageXYZ_patientID_scanID_mask.nii.gz, scan ID = age in days)
+OUTPUT_DIR = Path("/home/jc053/GIT/mri_longitudinal_analysis/data/synthetic/masks")
+# Ground truth of the cohort: patient, age, growth curve, target and voxelized volume
+COHORT_FILE = OUTPUT_DIR.parent / "synthetic_cohort.csv"
+
+NUM_PATIENTS = 100
+SCANS_PER_PATIENT = (3, 8)  # inclusive range, drawn per patient
+FIRST_AGE_DAYS = (365, 5475)  # age at the first scan
+SCAN_INTERVAL_DAYS = (90, 540)  # time between two scans
+
+# Mask geometry: array shape (x, y, z) in voxels and voxel spacing in mm
+SHAPE = (64, 64, 64)
+SPACING = (1.0, 1.0, 1.0)
+BASELINE_VOLUME_MM3 = (500, 15000)  # volume at the first scan
+NOISE_PCT = 5  # multiplicative noise of the volumes (standard deviation in %)
+ZERO_VOLUME_PCT = 1  # masks without any foreground (failed segmentations)
+
+# Growth curves and their share in the cohort
+GROWTH_CURVES = {
+    "stable": 0.4,
+    "linear": 0.2,
+    "exponential": 0.1,
+    "logistic": 0.1,
+    "regression": 0.2,
+}
+
+SEED = 42
+WORKERS = 8
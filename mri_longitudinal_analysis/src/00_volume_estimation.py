@@ -8,25 +8,48 @@ exports the results to specified directories.
 import glob
 import os
 from collections import defaultdict
-from datetime import datetime
+from functools import partial
 from multiprocessing import Pool, cpu_count
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import SimpleITK as sitk
 
 from cfg.src import volume_est_cfg
+from utils.nifti_stream import mask_volume
+from utils.lesion_statistics import LesionStatistics
+from utils.volume_cache import VolumeCache
+from utils.time_series_store import update_time_series_store, write_time_series_store
+from utils.incremental_update import (
+    changed_patients,
+    load_manifest,
+    mask_signatures,
+    remove_files,
+    save_manifest,
+)
+from utils.plot_jobs import PlotQueue
+from utils.change_points import ChangePointDetector, normalize_volumes
+from utils.time_series_features import derive_features, series_bounds, stack_series
+from utils.smoothing_engine import (
+    PackedSeries,
+    kernel_smoothing,
+    moving_average,
+    polynomial_smoothing,
+    weighted_median_smoothing,
+)
 from utils.helper_functions import (
-    weighted_median,
     prefix_zeros_to_six_digit_ids,
     compute_95_ci,
 )
-from scipy.stats import linregress
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import auc
-import ruptures as rpt
+
+CSV_METHODS = ("polynomial", "kernel", "window", "moving_average", "filtered")
+# data source of the series written for each method
+METHOD_SOURCES = {
+    "polynomial": "poly_smoothing",
+    "kernel": "kernel_smoothing",
+    "window": "window_smoothing",
+    "moving_average": "moving_average",
+    "filtered": "filtered",
+}
 
 
 class VolumeEstimator:
@@ -42,7 +65,12 @@ class VolumeEstimator:
     Attributes:
         path (str): Path to the directory containing segmentation files.
         dob_df (pd.DataFrame): DataFrame containing Date of Birth information, if available.
+        dob_index (pd.Series): Date of Birth indexed by patient ID (BCH and joint data).
         volumes (dict): Dictionary storing volume data for each patient.
+        updated_patients (set): Patients whose outputs are rebuilt in incremental mode,
+            None if all outputs are rebuilt.
+        outdated_patients (set): Patients whose previous outputs are deleted in
+            incremental mode (updated patients and patients without outputs anymore).
     """
 
     def __init__(self, segmentations_path):
@@ -61,6 +89,23 @@ class VolumeEstimator:
         self.volume_change_rate = defaultdict(list)
         self.volume_change_pattern = defaultdict(list)
         self.volume_change_type = defaultdict(list)
+        self.dob_index = None
+        self.mask_statistics = {}
+        self.lesion_statistics = None
+        self.mask_signatures = {}
+        self.change_points = {}
+        self.updated_patients = None
+        self.outdated_patients = set()
+        self.window_size = None
+        self.lesion_engine = (
+            LesionStatistics(
+                volume_est_cfg.LESION_METRICS,
+                volume_est_cfg.LESION_LABELS,
+                volume_est_cfg.LESION_CONNECTIVITY,
+            )
+            if volume_est_cfg.LESION_METRICS
+            else None
+        )
 
         os.makedirs(volume_est_cfg.OUTPUT_DIR, exist_ok=True)
         os.makedirs(volume_est_cfg.PLOTS_DIR, exist_ok=True)
@@ -216,29 +261,154 @@ class VolumeEstimator:
                 )
                 self.clinical_data = final_clinical_data
 
+            # Patient_ID -> DoB index, used to compute the age at every scan
+            if volume_est_cfg.BCH_DATA:
+                self.dob_index = self.build_dob_index(self.clinical_data, "BCH MRN")
+            elif volume_est_cfg.JOINT_DATA:
+                self.dob_index = self.build_dob_index(self.clinical_data, "Patient_ID")
+
+    @staticmethod
+    def build_dob_index(clinical_data, id_column):
+        """
+        Build a Series mapping patient ID -> Date of Birth, parsing all dates at once.
+        For duplicated IDs the first entry is kept.
+
+        Args:
+            clinical_data (pd.DataFrame): Clinical data with a 'Date of Birth' column.
+            id_column (str): Column with the patient IDs.
+
+        Returns:
+            pd.Series: Dates of birth (datetime64) indexed by the patient ID as string.
+        """
+        dob_index = pd.Series(
+            pd.to_datetime(
+                clinical_data["Date of Birth"], format="%d/%m/%Y"
+            ).to_numpy(),
+            index=clinical_data[id_column].astype(str).to_numpy(),
+        )
+        return dob_index[~dob_index.index.duplicated(keep="first")]
+
+    def calculate_ages(self, patient_ids, scan_ids):
+        """
+        Calculate the age in days at the date of each scan (scan ID in '%Y%m%d' format)
+        with one vectorized subtraction against the indexed dates of birth.
+
+        Args:
+            patient_ids (list): Patient ID of every scan.
+            scan_ids (list): Scan ID of every scan.
+
+        Returns:
+            tuple: (list of scan dates as datetime objects, list of ages in days).
+        """
+        dates = pd.to_datetime(pd.Series(scan_ids, dtype=str), format="%Y%m%d")
+        dobs = self.dob_index.reindex([str(patient_id) for patient_id in patient_ids])
+        missing = sorted(set(dobs.index[dobs.isna().to_numpy()]))
+        if missing:
+            raise KeyError(f"No Date of Birth found for patient(s): {missing}")
+        ages = pd.Series(dates.to_numpy() - dobs.to_numpy()).dt.days
+        return list(dates.dt.to_pydatetime()), ages.tolist()
+
     @staticmethod
     def estimate_volume(segmentation_path):
         """
         Estimate the volume of the given segmentation file.
 
+        The mask is streamed from disk in chunks of `STREAM_CHUNK_BYTES` and only
+        the foreground voxels are counted, the full array is never materialized.
+
         Args:
             segmentation_path (str): Path to the segmentation file.
 
         Returns:
             float: Total volume of the segmentation.
         """
-        total_volume = 0
+        measurement = VolumeEstimator.measure_mask(segmentation_path)
+        total_volume = measurement[0] if measurement is not None else 0
+
+        return total_volume
+
+    @staticmethod
+    def measure_mask(segmentation_path, lesion_engine=None):
+        """
+        Measure the foreground of the given segmentation file.
+
+        Args:
+            segmentation_path (str): Path to the segmentation file.
+            lesion_engine (LesionStatistics, optional): If given, the mask is read once
+                and the lesion statistics are computed together with the volume.
+
+        Returns:
+            tuple: (total volume, number of foreground voxels, voxel spacing), plus
+            the lesion statistics dict if an engine is given, or None if the file
+            could not be read.
+        """
         try:
-            segmentation = sitk.ReadImage(segmentation_path)
-            voxel_spacing = segmentation.GetSpacing()
-            voxel_volume = voxel_spacing[0] * voxel_spacing[1] * voxel_spacing[2]
-            segmentation_array = sitk.GetArrayFromImage(segmentation)
-            num_voxels = (segmentation_array > 0).sum()
-            total_volume = num_voxels * voxel_volume
-        except ExceptionGroup as error:
+            if lesion_engine is not None:
+                return lesion_engine.measure(segmentation_path)
+            # header-aware chunked counting keeps the memory per worker bounded
+            return mask_volume(
+                segmentation_path, chunk_bytes=volume_est_cfg.STREAM_CHUNK_BYTES
+            )
+        except (OSError, EOFError, RuntimeError, ValueError) as error:
             print(f"Error estimating volume for {segmentation_path}: {error}")
+            return None
 
-        return total_volume
+    def estimate_volumes(self, file_paths):
+        """
+        Estimate the volumes of all given segmentation files.
+
+        If the volume cache is enabled, only masks that are new or changed since
+        the last run are read, all other volumes are taken from the cache. With lesion
+        metrics configured, their values are stored per file in `self.mask_statistics`.
+
+        Args:
+            file_paths (list): Paths to the segmentation files.
+
+        Returns:
+            list: Total volume per file, in the order of `file_paths`.
+        """
+        cache = None
+        measurements = {}
+        to_compute = file_paths
+        signature = self.lesion_engine.signature if self.lesion_engine else None
+        if volume_est_cfg.VOLUME_CACHE:
+            cache = VolumeCache(
+                volume_est_cfg.VOLUME_CACHE_FILE,
+                use_content_hash=volume_est_cfg.VOLUME_CACHE_HASH,
+            )
+            measurements, misses = cache.lookup(file_paths, signature)
+            to_compute = list(misses)
+            print(
+                f"\tReusing {len(measurements)} cached volumes, computing {len(to_compute)}."
+            )
+
+        if to_compute:
+            with Pool(cpu_count()) as pool:
+                computed = pool.map(
+                    partial(self.measure_mask, lesion_engine=self.lesion_engine),
+                    to_compute,
+                )
+            computed = {
+                file_path: measurement
+                for file_path, measurement in zip(to_compute, computed)
+                if measurement is not None
+            }
+            measurements.update(computed)
+            if cache is not None:
+                cache.update(computed, signature, misses)
+        if cache is not None:
+            cache.prune(file_paths)
+
+        if self.lesion_engine is not None:
+            self.mask_statistics = {
+                file_path: measurement[3]
+                for file_path, measurement in measurements.items()
+            }
+
+        return [
+            measurements[file_path][0] if file_path in measurements else 0
+            for file_path in file_paths
+        ]
 
     @staticmethod
     def calculate_volume_change(previous, current):
@@ -283,8 +453,7 @@ class VolumeEstimator:
         """
         file_paths = glob.glob(os.path.join(self.segmentations_path, "*_mask.nii.gz"))
 
-        with Pool(cpu_count()) as pool:
-            volumes = pool.map(self.estimate_volume, file_paths)
+        volumes = self.estimate_volumes(file_paths)
 
         all_scans = defaultdict(list)
         zero_volume_scans = defaultdict(list)
@@ -296,6 +465,9 @@ class VolumeEstimator:
             all_scans[patient_id].append((file_path, volume, scan_id))
             if volume == 0:
                 zero_volume_scans[patient_id].append(scan_id)
+        self.mask_signatures = mask_signatures(
+            {patient_id: [scan[0] for scan in scans] for patient_id, scans in all_scans.items()}
+        )
 
         # store raw data
         self.raw_data = self.process_scans(dict(all_scans))
@@ -306,6 +478,11 @@ class VolumeEstimator:
             self.filtered_data = self.process_scans(filtered_data)
             self.data_sources["filtered"] = self.filtered_data
             print("\tAdded filtered data!")
+            if self.mask_statistics:
+                self.lesion_statistics = self.build_lesion_table(
+                    filtered_data, self.filtered_data
+                )
+                print("\tAdded lesion statistics!")
 
             if max_patients is not None and max_patients < len(self.filtered_data):
                 self.filtered_data = dict(
@@ -324,21 +501,34 @@ class VolumeEstimator:
             )
             print("\tMedian scan number per patient:", median_scans)
 
+        if self.filtered_data:
+            # the window a full run derives from the first patient of the cohort, kept
+            # for the updated patients and recorded in the manifest
+            self.window_size = max(3, len(next(iter(self.filtered_data.values()))) // 2)
+        window_size = self.window_size
+        if volume_est_cfg.INCREMENTAL:
+            self.select_updated_patients(
+                load_manifest(volume_est_cfg.INCREMENTAL_MANIFEST), window_size
+            )
+        smoothing_scans = self.select_updated(self.filtered_data)
+
         # Additional logic to process and store other states of data
         # (poly-smoothed, kernel-smoothed, window-smoothed)
         if volume_est_cfg.POLY_SMOOTHING:
-            self.poly_smoothing_data = self.apply_polysmoothing()
+            self.poly_smoothing_data = self.apply_polysmoothing(scans=smoothing_scans)
             self.data_sources["poly_smoothing"] = self.poly_smoothing_data
             print("\tAdded polynomial smoothing data!")
         if volume_est_cfg.KERNEL_SMOOTHING:
-            self.kernel_smoothing_data = self.apply_kernel_smoothing()
+            self.kernel_smoothing_data = self.apply_kernel_smoothing(scans=smoothing_scans)
             self.data_sources["kernel_smoothing"] = self.kernel_smoothing_data
             print("\tAdded kernel smoothing data!")
         if volume_est_cfg.WINDOW_SMOOTHING:
             (
                 self.window_smoothing_data,
                 self.moving_average_data,
-            ) = self.apply_sliding_window_interpolation()
+            ) = self.apply_sliding_window_interpolation(
+                window_size=window_size, scans=smoothing_scans
+            )
             self.data_sources["window_smoothing"] = self.window_smoothing_data
             self.data_sources["moving_average"] = self.moving_average_data
             print("\tAdded sliding window smoothing and moving average data!")
@@ -347,6 +537,49 @@ class VolumeEstimator:
         self.volume_change_rate = self.calculate_volume_change_rate(self.filtered_data)
         print("\tAdded volume rate data!")
 
+    def select_updated_patients(self, manifest, window_size=None):
+        """
+        Determine the patients whose outputs have to be rebuilt, from the mask
+        signatures of the previous run. Without a manifest, or if the smoothing window
+        changed since the previous run, all outputs are rebuilt.
+
+        Args:
+            manifest (dict): Manifest of the previous run (see utils.incremental_update).
+            window_size (int): Smoothing window of the current run.
+        """
+        if manifest is None:
+            print("\tNo manifest of a previous run found, rebuilding all outputs.")
+            return
+        if manifest.get("window_size") != window_size:
+            print(
+                f"\tSmoothing window changed from {manifest.get('window_size')} to"
+                f" {window_size}, rebuilding all outputs."
+            )
+            return
+        output_patients = set(self.filtered_data)
+        previous_outputs = set(manifest["outputs"])
+        self.updated_patients = changed_patients(
+            manifest["masks"], self.mask_signatures
+        ) | (output_patients - previous_outputs)
+        self.outdated_patients = self.updated_patients | (previous_outputs - output_patients)
+        print(
+            f"\tIncremental update: {len(self.updated_patients)} patients with new, modified"
+            f" or removed masks, {len(previous_outputs - output_patients)} patients"
+            " without outputs anymore."
+        )
+
+    def select_updated(self, data):
+        """
+        Restrict per-patient data to the patients whose outputs are rebuilt.
+        """
+        if self.updated_patients is None:
+            return data
+        return {
+            patient_id: scans
+            for patient_id, scans in data.items()
+            if patient_id in self.updated_patients
+        }
+
     def process_scans(self, all_scans):
         """
         Processes scan information to calculate volumes and optionally age.
@@ -359,57 +592,79 @@ class VolumeEstimator:
             volume, and optionally age.
         """
         scan_dict = defaultdict(list)
-        for patient_id, scans in all_scans.items():
-            # print(patient_id)
-            # print(scans)
 
-            if volume_est_cfg.BCH_DATA:
-                # Handling for BCH data
-                patient_id = prefix_zeros_to_six_digit_ids(patient_id)
-                for _, volume, scan_id in scans:
-                    date = datetime.strptime(scan_id, "%Y%m%d")
-                    dob = self.clinical_data.loc[
-                        self.clinical_data["BCH MRN"] == patient_id, "Date of Birth"
-                    ].iloc[0]
-                    dob = datetime.strptime(
-                        dob, "%d/%m/%Y"
-                    )  # Adjust format if necessary
-                    age = (date - dob).days
-                    scan_dict[patient_id].append((date, volume, age))
+        if volume_est_cfg.BCH_DATA:
+            # Handling for BCH data
+            scans = [
+                (prefix_zeros_to_six_digit_ids(patient_id), volume, scan_id)
+                for patient_id, patient_scans in all_scans.items()
+                for _, volume, scan_id in patient_scans
+            ]
+            dates, ages = self.calculate_ages(
+                [scan[0] for scan in scans], [scan[2] for scan in scans]
+            )
+            for (patient_id, volume, _), date, age in zip(scans, dates, ages):
+                scan_dict[patient_id].append((date, volume, age))
 
-            elif volume_est_cfg.CBTN_DATA:
-                # Handling for CBTN data
+        elif volume_est_cfg.CBTN_DATA:
+            # Handling for CBTN data
+            for patient_id, scans in all_scans.items():
                 for _, volume, scan_id in scans:
                     age = int(scan_id)
                     scan_dict[patient_id].append((volume, age))
 
-            elif volume_est_cfg.JOINT_DATA:
-                for _, volume, scan_id in scans:
-                    # print(patient_id)
-                    # print(scan_id)
-                    if len(scan_id) == 8:
-                        date = datetime.strptime(scan_id, "%Y%m%d")
-                        # print(date)
-                        # print(self.clinical_data.loc[self.clinical_data["Patient_ID"] == patient_id].head(10))
-                        dob = self.clinical_data.loc[
-                            self.clinical_data["Patient_ID"] == patient_id,
-                            "Date of Birth",
-                        ].iloc[0]
-                        # print(dob)
-                        dob = datetime.strptime(dob, "%d/%m/%Y")
-                        age = (date - dob).days
-                        scan_dict[patient_id].append((volume, age))
-                    else:
-                        age = int(scan_id)
-                        scan_dict[patient_id].append((volume, age))
+        elif volume_est_cfg.JOINT_DATA:
+            # Scans with an 8 digit ID are dated, the others already carry the age
+            scans = [
+                (patient_id, volume, scan_id)
+                for patient_id, patient_scans in all_scans.items()
+                for _, volume, scan_id in patient_scans
+            ]
+            dated = [scan for scan in scans if len(scan[2]) == 8]
+            _, dated_ages = self.calculate_ages(
+                [scan[0] for scan in dated], [scan[2] for scan in dated]
+            )
+            dated_ages = iter(dated_ages)
+            for patient_id, volume, scan_id in scans:
+                age = next(dated_ages) if len(scan_id) == 8 else int(scan_id)
+                scan_dict[patient_id].append((volume, age))
 
-            else:
-                # Default handling for other data formats
+        else:
+            # Default handling for other data formats
+            for patient_id, scans in all_scans.items():
                 for scan in scans:
                     scan_dict[patient_id].append(scan)
 
         return scan_dict
 
+    def build_lesion_table(self, scans, processed_scans):
+        """
+        Key the lesion statistics of every scan by patient and age.
+
+        Args:
+            scans (dict): Scans as (file_path, volume, scan_id) per patient.
+            processed_scans (dict): The same scans after process_scans, in the same order.
+
+        Returns:
+            pd.DataFrame: 'Patient_ID', 'Age' and one column per lesion metric.
+        """
+        rows = []
+        for patient_id, patient_scans in scans.items():
+            if volume_est_cfg.BCH_DATA:
+                patient_id = prefix_zeros_to_six_digit_ids(patient_id)
+            for (file_path, _, _), scan in zip(
+                patient_scans, processed_scans.get(patient_id, [])
+            ):
+                if file_path in self.mask_statistics:
+                    rows.append(
+                        {
+                            "Patient_ID": patient_id,
+                            "Age": scan[-1],
+                            **self.mask_statistics[file_path],
+                        }
+                    )
+        return pd.DataFrame(rows)
+
     def apply_filtering(self, all_scans, zero_volume_scans, minimum_days=365):
         """
         Applies filtering to exclude scans with less than a certain number of points.
@@ -494,93 +749,45 @@ class VolumeEstimator:
     def apply_polysmoothing(
         self,
         max_poly_degree=7,
+        scans=None,
     ):
         """
         Applies polynomial smoothing to the volume data, dynamically selecting
         polynomial degree based on the number of scans for each patient.
 
+        Args:
+            max_poly_degree (int, optional): Highest polynomial degree. Defaults to 7.
+            scans (dict, optional): Scans to smooth. Defaults to the filtered data.
+
         Returns:
             defaultdict(list): Data after polynomial smoothing.
         """
+        num_points = 25  # Number of points for interpolation
+        packed = PackedSeries.from_scans(self.filtered_data if scans is None else scans)
+        smoothed_volumes, lengths = polynomial_smoothing(
+            packed, max_poly_degree=max_poly_degree, num_points=num_points
+        )
+        # the fitted curve is sampled on an age grid, but the values are paired
+        # with the scan ages (at most num_points of them), as in earlier outputs
+        return packed.unpack(smoothed_volumes, lengths)
 
-        polysmoothed_data = defaultdict(list)
-        for patient_id, scans in self.filtered_data.items():
-            n_scans = len(scans)
-            poly_degree = min(max(1, n_scans - 1), max_poly_degree)
-            num_points = 25  # Number of points for interpolation
-            scans.sort(key=lambda x: x[-1])  # Sort by age
-
-            if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                volumes, ages = zip(*scans)
-            else:
-                dates, volumes, ages = zip(*scans)
-
-            age_numbers = [float(age) for age in ages]
-            poly_coeff = np.polyfit(age_numbers, volumes, poly_degree)
-            poly_interp = np.poly1d(poly_coeff)
-
-            start = min(age_numbers)
-            end = max(age_numbers)
-            interpolated_ages = np.linspace(start, end, num_points)
-            smoothed_volumes = poly_interp(interpolated_ages)
-            smoothed_volumes = np.maximum(smoothed_volumes, 0)
-
-            if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                polysmoothed_data[patient_id] = list(zip(smoothed_volumes, ages))
-            else:
-                polysmoothed_data[patient_id] = list(zip(dates, smoothed_volumes, ages))
-
-        return polysmoothed_data
-
-    def apply_kernel_smoothing(self, bandwidth_factor=0.1):
+    def apply_kernel_smoothing(self, bandwidth_factor=0.1, scans=None):
         """
         Applies kernel smoothing to the volume data.
 
         Args:
-            bandwidth (int, optional): The bandwidth for the Gaussian kernel. Defaults to 30.
+            bandwidth_factor (float, optional): Fraction of the volume IQR used as
+            bandwidth of the Gaussian kernel (at least 1). Defaults to 0.1.
+            scans (dict, optional): Scans to smooth. Defaults to the filtered data.
 
         Returns:
             defaultdict(list): Data after kernel smoothing.
         """
-        kernelsmoothed_data = defaultdict(list)
+        packed = PackedSeries.from_scans(self.filtered_data if scans is None else scans)
+        smoothed_volumes = kernel_smoothing(packed, bandwidth_factor=bandwidth_factor)
+        return packed.unpack(smoothed_volumes)
 
-        for patient_id, scans in self.filtered_data.items():
-            scans.sort(key=lambda x: x[-1])  # Sort by age
-            if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                volumes, ages = zip(*scans)
-            else:
-                dates, volumes, ages = zip(*scans)
-
-            age_numbers = np.array([float(age) for age in ages])
-            smoothed_volumes = np.zeros(len(volumes))
-            volume_array = np.array(volumes)
-            volume_iqr = np.subtract(*np.percentile(volume_array, [75, 25]))
-            bandwidth = max(volume_iqr * bandwidth_factor, 1)
-
-            # Apply kernel smoothing to volumes based on age
-            for i, age in enumerate(age_numbers):
-                age_diff = age_numbers - age
-                weights = np.exp(-0.5 * (age_diff / bandwidth) ** 2)
-                weighted_sum = np.sum(weights * volume_array)
-                weight_total = np.sum(weights)
-
-                smoothed_volume = (
-                    weighted_sum / weight_total
-                    if weight_total != 0
-                    else volume_array[i]
-                )
-                smoothed_volumes[i] = smoothed_volume
-
-            if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                kernelsmoothed_data[patient_id] = list(zip(smoothed_volumes, ages))
-            else:
-                kernelsmoothed_data[patient_id] = list(
-                    zip(dates, smoothed_volumes, ages)
-                )
-
-        return kernelsmoothed_data
-
-    def apply_sliding_window_interpolation(self, window_size=None):
+    def apply_sliding_window_interpolation(self, window_size=None, scans=None):
         """
         Apply sliding window interpolation to smooth volumetric data of patients.
 
@@ -592,54 +799,69 @@ class VolumeEstimator:
             window_size (int): Size of the window used to calculate the weighted
                             median. Should be an odd number for balanced
                             calculation. Default is None.
+            scans (dict): Scans to smooth. Defaults to the filtered data.
 
         Returns:
             dict: A dictionary containing the interpolated scan data for each
                 patient, sorted by scan date.
         """
-        weighted_median_data = defaultdict(list)
-        moving_average_data = defaultdict(list)
+        packed = PackedSeries.from_scans(self.filtered_data if scans is None else scans)
+        if not window_size and packed.patient_ids:
+            # the window derived from the first patient is used for the whole
+            # cohort, which keeps the outputs identical to earlier runs
+            window_size = max(3, int(packed.lengths[0]) // 2)
+
+        weighted_median_data = packed.unpack(
+            weighted_median_smoothing(packed, window_size=window_size)
+        )
+        moving_average_data = packed.unpack(
+            moving_average(packed, window_size=window_size)
+        )
+        return weighted_median_data, moving_average_data
 
-        for patient_id, scans in self.filtered_data.items():
-            scans.sort(key=lambda x: x[-1])  # Sort by age
+    def detect_volume_change_points(self):
+        """
+        Detect the change points of the normalized volume curves of all data sources in
+        one batch (see utils.change_points). The scans are sorted by age and the change
+        points are stored as indices into them, per data source and patient.
+        """
+        detector = ChangePointDetector(
+            algorithm=volume_est_cfg.CHANGE_POINT_ALGORITHM,
+            model=volume_est_cfg.CHANGE_POINT_MODEL,
+            penalty=volume_est_cfg.CHANGE_POINT_PENALTY,
+            width=volume_est_cfg.CHANGE_POINT_WIDTH,
+            workers=volume_est_cfg.CHANGE_POINT_WORKERS,
+            cache_file=volume_est_cfg.CHANGE_POINT_CACHE_FILE
+            if volume_est_cfg.CHANGE_POINT_CACHE
+            else None,
+        )
+        curves = {}
+        for data_type, data in self.data_sources.items():
+            for patient_id, scans in self.select_updated(data).items():
+                if not scans:
+                    continue
+                scans.sort(key=lambda x: x[-1])  # sort by age
+                curves[(data_type, patient_id)] = normalize_volumes(
+                    [scan[-2] for scan in scans]
+                )
 
-            if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                volumes, ages = zip(*scans)
-            else:
-                # BCH data: (date, volume, age)
-                dates, volumes, ages = zip(*scans)
-
-            num_scans = len(volumes)
-            window_size = window_size if window_size else max(3, num_scans // 2)
-            volumes_series = pd.Series(volumes)
-            smoothed_volumes = volumes_series.rolling(
-                window=window_size, min_periods=1, center=True
-            ).mean()
-
-            for i in range(len(volumes)):
-                # Define the window boundaries
-                left = max(0, i - window_size // 2)
-                right = min(num_scans, i + window_size // 2 + 1)
-                window_volumes = volumes[left:right]
-
-                distances = np.abs(np.arange(left, right) - i)
-                weights = 1 / (1 + distances)
-                weighted_vol = weighted_median(window_volumes, weights)
-
-                if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                    weighted_median_data[patient_id].append((weighted_vol, ages[i]))
-                    moving_average_data[patient_id].append(
-                        (smoothed_volumes[i], ages[i])
-                    )
-                else:
-                    weighted_median_data[patient_id].append(
-                        (dates[i], weighted_vol, ages[i])
-                    )
-                    moving_average_data[patient_id].append(
-                        (dates[i], smoothed_volumes[i], ages[i])
-                    )
+        self.change_points = defaultdict(dict)
+        for (data_type, patient_id), change_points in detector.detect(curves).items():
+            self.change_points[data_type][patient_id] = change_points
+        print(f"\tDetected change points with {detector.signature}.")
 
-        return weighted_median_data, moving_average_data
+    def build_change_point_table(self):
+        """
+        Table of the detected change points with the columns 'method', 'Patient_ID' and
+        '_position' (index of the scan in the age-sorted series).
+        """
+        records = [
+            (method, patient_id, position)
+            for method, data_type in METHOD_SOURCES.items()
+            for patient_id, change_points in self.change_points.get(data_type, {}).items()
+            for position in change_points
+        ]
+        return pd.DataFrame(records, columns=["method", "Patient_ID", "_position"])
 
     #############################
     # Output related functions  #
@@ -734,393 +956,241 @@ class VolumeEstimator:
     def generate_csv(self, output_folder):
         """
         Generate a CSV file for each patient containing their time series volume data using pandas.
+        The features of all patients and methods are derived at once (see
+        utils.time_series_features). If enabled, all patients and methods are additionally
+        written to a single Parquet dataset partitioned by method (see utils.time_series_store).
+        In incremental mode only the updated patients are written and merged into the
+        existing dataset.
 
         Args:
             output_folder (str): Path to the directory where CSV files should be saved.
         """
 
         os.makedirs(output_folder, exist_ok=True)
-        ts_poly = os.path.join(output_folder, "polynomial")
-        ts_kernel = os.path.join(output_folder, "kernel")
-        ts_window = os.path.join(output_folder, "window")
-        ts_moving_average = os.path.join(output_folder, "moving_average")
-        ts_filtered = os.path.join(output_folder, "filtered")
-        os.makedirs(ts_poly, exist_ok=True)
-        os.makedirs(ts_kernel, exist_ok=True)
-        os.makedirs(ts_window, exist_ok=True)
-        os.makedirs(ts_moving_average, exist_ok=True)
-        os.makedirs(ts_filtered, exist_ok=True)
-
         mapping = {
-            "polynomial": (self.poly_smoothing_data, ts_poly),
-            "kernel": (self.kernel_smoothing_data, ts_kernel),
-            "window": (self.window_smoothing_data, ts_window),
-            "moving_average": (self.moving_average_data, ts_moving_average),
-            "filtered": (self.filtered_data, ts_filtered),
+            "polynomial": self.select_updated(self.poly_smoothing_data),
+            "kernel": self.select_updated(self.kernel_smoothing_data),
+            "window": self.select_updated(self.window_smoothing_data),
+            "moving_average": self.select_updated(self.moving_average_data),
+            "filtered": self.select_updated(self.filtered_data),
         }
-        for method, (data, folder) in mapping.items():
-            for patient_id, volume_data in data.items():
-                csv_file_path = os.path.join(folder, f"{patient_id}_{method}.csv")
-
-                # Creating DataFrame from volume data
-                df_columns = (
-                    ["Volume", "Age"]
-                    if (volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA)
-                    else ["Date", "Volume", "Age"]
-                )
-                df = pd.DataFrame(volume_data, columns=df_columns)
-
-                # Calculate baseline volume
-                initial_volume = df["Volume"].iloc[0] if not df.empty else None
-                df["Baseline Volume"] = initial_volume
-
-                # Sorting by Age or Date
-                sort_column = "Age" if not volume_est_cfg.TEST_DATA else "Date"
-                df.sort_values(by=sort_column)
-
-                # calculate age stats
-                df["Age Median"] = df["Age"].median()
-                df["Age Avg"] = df["Age"].mean()
-                df["Age Std"] = df["Age"].std() 
-
-                # Calculate volume stats
-                df["Volume Median"] = df["Volume"].median()
-                df["Volume Avg"] = df["Volume"].mean()
-                df["Volume Std"] = df["Volume"].std()
-
-                # Calculate normalized volume
-                df["Normalized Volume"] = (
-                    df["Volume"] / initial_volume if initial_volume else 0
-                )
-                df["Normalized Volume Median"] = df["Normalized Volume"].median()
-                df["Normalized Volume Avg"] = df["Normalized Volume"].mean()
-                df["Normalized Volume Std"] = df["Normalized Volume"].std()
-
-                # Calculate volume change
-                df["Volume Change"] = df["Volume"].diff()
-                df["Volume Change Median"] = df["Volume Change"].median()
-                df["Volume Change Avg"] = df["Volume Change"].mean()
-                df["Volume Change Std"] = df["Volume Change"].std()
-                df['Volume Change Pct'] = df['Volume'].pct_change() * 100
-                df['Volume Change Pct Median'] = df['Volume Change Pct'].median()
-                df['Volume Change Pct Avg'] = df['Volume Change Pct'].mean()
-                df['Volume Change Pct Std'] = df['Volume Change Pct'].std() 
-
-                # Add volume change rate
-                df["Volume Change Rate"] = df["Age"].map(
-                    lambda age, pid=patient_id: next(
-                        (x[1] for x in self.volume_change_rate[pid] if x[0] == age),
-                        None,
-                    )
-                )
-                df["Volume Change Rate Median"] = df["Volume Change Rate"].median()
-                df["Volume Change Rate Avg"] = df["Volume Change Rate"].mean()
-                df["Volume Change Rate Std"] = df["Volume Change Rate"].std()
-                df["Volume Change Rate Pct"] = df["Volume Change Rate"].pct_change() * 100
-                df["Volume Change Rate Pct Median"] = df["Volume Change Rate Pct"].median()
-                df["Volume Change Rate Pct Avg"] = df["Volume Change Rate Pct"].mean()
-                df["Volume Change Rate Pct Std"] = df["Volume Change Rate Pct"].std()
-
-                # Analyze change variables
-                df["Change Speed"] = self.calculate_change_speed(df)
-                df["Change Type"] = self.calculate_change_type(df)
-                df["Change Trend"] = self.calculate_change_trend(df)
-                df["Change Acceleration"] = self.calculate_change_acceleration(df)
-                
-                # Other variables
-                df["Relative Volume Change Pct"] = self.calculate_relative_volume_change_pct(df)
-                df["Cumulative Volume Change Pct"] = self.calculate_cumulative_relative_volume_change_pct(df)
-                df["AUC"] = self.calculate_auc(df)
-                df["Coefficient of Variation"] = self.calculate_volume_coefficient_of_variation(df)
-                df["Rolling Volume Change Average"] = self.calculate_rolling_average_volume_change(df)
-                
-                
-                if not volume_est_cfg.TEST_DATA:
-                    df["Days Between Scans"] = df["Age"].diff()
-                    if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                        df["Date"] = "N/A"
-                        df["Scan_ID"] = df[
-                            "Age"
-                        ]
-                    else:
-                        df["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%d/%m/%Y")
-                        df["Scan_ID"] = pd.to_datetime(
-                            df["Date"], format="%d/%m/%Y"
-                        ).dt.strftime("%Y%m%d")
+        for method in CSV_METHODS:
+            os.makedirs(os.path.join(output_folder, method), exist_ok=True)
+
+        # Creating one DataFrame with the volume data of all methods and patients
+        df_columns = (
+            ["Volume", "Age"]
+            if (volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA)
+            else ["Date", "Volume", "Age"]
+        )
+        df = stack_series(mapping, df_columns)
+        if df.empty:
+            if volume_est_cfg.TIME_SERIES_STORE and self.updated_patients is not None:
+                self.save_time_series_store({})
+            return
+        change_rates = pd.DataFrame(
+            [
+                (patient_id, age, rate)
+                for patient_id, rates in self.volume_change_rate.items()
+                for age, rate in rates
+            ],
+            columns=["Patient_ID", "Age", "Volume Change Rate"],
+        )
+        df = derive_features(df, change_rates)
+
+        lesion_columns = []
+        if self.lesion_statistics is not None and not self.lesion_statistics.empty:
+            # measured per scan, attached to every method at the age of the scan
+            lesion_table = self.lesion_statistics.assign(
+                _age_key=self.lesion_statistics["Age"].astype(np.float64)
+            ).drop(columns="Age")
+            lesion_table = lesion_table.drop_duplicates(["Patient_ID", "_age_key"])
+            lesion_columns = [
+                column
+                for column in lesion_table.columns
+                if column not in ("Patient_ID", "_age_key")
+            ]
+            df = df.assign(_age_key=df["Age"].astype(np.float64))
+            df = df.merge(
+                lesion_table, on=["Patient_ID", "_age_key"], how="left"
+            ).drop(columns="_age_key")
+
+        change_point_columns = []
+        if self.change_points:
+            # the series are sorted by age, as in the change point detection
+            change_point_table = self.build_change_point_table().assign(
+                **{"Change Point": True}
+            )
+            df["_position"] = df.groupby("Series", sort=False).cumcount()
+            df = df.merge(
+                change_point_table, on=["method", "Patient_ID", "_position"], how="left"
+            ).drop(columns="_position")
+            df["Change Point"] = df["Change Point"].eq(True)
+            df["Change Points"] = df.groupby("Series", sort=False)["Change Point"].transform(
+                "sum"
+            )
+            change_point_columns = ["Change Point", "Change Points"]
 
-                # Reordering columns based on data type
-                columns_order = (
-                    [
-                        "Scan_ID",
-                        "Date",
-                        "Age",
-                        "Days Between Scans",
-                        "Volume",
-                        "Volume Median",
-                        "Volume Avg",
-                        "Volume Std",
-                        "Normalized Volume",
-                        "Normalized Volume Median",
-                        "Normalized Volume Avg",
-                        "Normalized Volume Std",
-                        "Baseline Volume",
-                        "Volume Change",
-                        "Volume Change Median",
-                        "Volume Change Avg",
-                        "Volume Change Std",
-                        "Volume Change Pct",
-                        "Volume Change Pct Median",
-                        "Volume Change Pct Avg",
-                        "Volume Change Pct Std",
-                        "Volume Change Rate",
-                        "Volume Change Rate Median",
-                        "Volume Change Rate Avg",
-                        "Volume Change Rate Std",
-                        "Volume Change Rate Pct",
-                        "Volume Change Rate Pct Median",
-                        "Volume Change Rate Pct Avg",
-                        "Volume Change Rate Pct Std",
-                        "Change Speed",
-                        "Change Type",
-                        "Change Trend",
-                        "Change Acceleration",
-                        "Relative Volume Change Pct",
-                        "Cumulative Volume Change Pct",
-                        "AUC",
-                        "Coefficient of Variation",
-                        "Rolling Volume Change Average",
-                        
-                        
-                    ]
-                    if not volume_est_cfg.TEST_DATA
-                    else [
-                        "Scan_ID",
-                        "Date",
-                        "Volume",
-                        "Volume Median",
-                        "Volume Avg",
-                        "Volume Std",
-                        "Normalized Volume",
-                        "Normalized Volume Median",
-                        "Normalized Volume Avg",
-                        "Normalized Volume Std",
-                        "Baseline Volume",
-                        "Volume Change",
-                        "Volume Change Median",
-                        "Volume Change Avg",
-                        "Volume Change Std",
-                        "Volume Change Pct",
-                        "Volume Change Pct Median",
-                        "Volume Change Pct Avg",
-                        "Volume Change Pct Std",
-                        "Volume Change Rate",
-                        "Volume Change Rate Median",
-                        "Volume Change Rate Avg",
-                        "Volume Change Rate Std",
-                        "Volume Change Rate Pct",
-                        "Volume Change Rate Pct Median",
-                        "Volume Change Rate Pct Avg",
-                        "Volume Change Rate Pct Std",
-                        "Change Speed",
-                        "Change Type",
-                        "Change Trend",
-                        "Change Acceleration",
-                        "Relative Volume Change Pct",
-                        "Cumulative Volume Change Pct",
-                        "AUC",
-                        "Coefficient of Variation",
-                        "Rolling Volume Change Average",
-                    ]
+        if not volume_est_cfg.TEST_DATA:
+            df["Days Between Scans"] = df.groupby("Series", sort=False)["Age"].diff()
+            if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
+                df["Date"] = "N/A"
+                df["Scan_ID"] = df["Age"]
+            else:
+                df["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%d/%m/%Y")
+                df["Scan_ID"] = pd.to_datetime(
+                    df["Date"], format="%d/%m/%Y"
+                ).dt.strftime("%Y%m%d")
+        elif volume_est_cfg.CBTN_DATA:
+            # test data in the CBTN layout (e.g. synthetic cohorts), the scan id is the age
+            df["Date"] = "N/A"
+            df["Scan_ID"] = df["Age"]
+
+        # Reordering columns based on data type
+        columns_order = (
+            [
+                "Scan_ID",
+                "Date",
+                "Age",
+                "Days Between Scans",
+            ]
+            if not volume_est_cfg.TEST_DATA
+            else [
+                "Scan_ID",
+                "Date",
+            ]
+        ) + [
+            "Volume",
+            "Volume Median",
+            "Volume Avg",
+            "Volume Std",
+            "Normalized Volume",
+            "Normalized Volume Median",
+            "Normalized Volume Avg",
+            "Normalized Volume Std",
+            "Baseline Volume",
+            "Volume Change",
+            "Volume Change Median",
+            "Volume Change Avg",
+            "Volume Change Std",
+            "Volume Change Pct",
+            "Volume Change Pct Median",
+            "Volume Change Pct Avg",
+            "Volume Change Pct Std",
+            "Volume Change Rate",
+            "Volume Change Rate Median",
+            "Volume Change Rate Avg",
+            "Volume Change Rate Std",
+            "Volume Change Rate Pct",
+            "Volume Change Rate Pct Median",
+            "Volume Change Rate Pct Avg",
+            "Volume Change Rate Pct Std",
+            "Change Speed",
+            "Change Type",
+            "Change Trend",
+            "Change Acceleration",
+            "Relative Volume Change Pct",
+            "Cumulative Volume Change Pct",
+            "AUC",
+            "Coefficient of Variation",
+            "Rolling Volume Change Average",
+        ] + change_point_columns + lesion_columns
+
+        # Export to CSV
+        if volume_est_cfg.TIME_SERIES_CSV:
+            csv_df = df[columns_order]
+            starts, lengths = series_bounds(df["Series"].to_numpy())
+            for start, length in zip(starts, lengths):
+                method, patient_id = df["method"].iat[start], df["Patient_ID"].iat[start]
+                csv_file_path = os.path.join(
+                    output_folder, method, f"{patient_id}_{method}.csv"
                 )
-                df = df[columns_order]
-
-                # Export to CSV
-                df.to_csv(csv_file_path, index=False)
-
-    @staticmethod
-    def calculate_change_speed(df):
-        """Classify the change speed based on the average volume change rate."""
-
-        avg_change_rate = df["Volume Change Rate Pct Avg"].iloc[0]
-
-        if avg_change_rate < np.percentile(df["Volume Change Rate Pct"], 25):
-            return "slow"
-        elif avg_change_rate < np.percentile(df["Volume Change Rate Pct"], 75):
-            return "moderate"
-        return "rapid"
+                csv_df.iloc[start : start + length].to_csv(csv_file_path, index=False)
+
+        if volume_est_cfg.TIME_SERIES_STORE:
+            store_df = df[columns_order + ["Patient_ID", "method"]]
+            store_df = store_df.assign(Patient_ID=store_df["Patient_ID"].astype(str))
+            self.save_time_series_store(
+                {
+                    method: method_df.drop(columns="method")
+                    for method, method_df in store_df.groupby("method", sort=False)
+                }
+            )
 
-    @staticmethod
-    def calculate_change_type(df):
+    def save_time_series_store(self, data_by_method):
         """
-        Calculate the change type for a given patient based on the variability and pattern of volume change rates.
-        """
-        df_clean = df.dropna(subset=["Age", "Volume"])
-
-        x = df_clean["Age"].values
-        y = df_clean["Volume"].values
+        Write the time series to the Parquet dataset, in incremental mode the rows of the
+        outdated patients are replaced and all other patients are kept.
 
-        # linear regression
-        _, _, r_value, _, _ = linregress(x, y)
-        r_squared = r_value**2
-        
-        # Classify based on best fit
-        if r_squared >= 0.8:
-            return "Linear"
-        else:
-            return "Non-linear"
-            
-    @staticmethod
-    def calculate_change_trend(df):
-        """
-        Classify the trend of the volume change rate as increasing, decreasing, or stable.
+        Args:
+            data_by_method (dict): Mapping method -> DataFrame with the time series.
         """
-        trend = np.sign(np.mean(df['Volume Change Rate Avg']))
-        if trend > 0:
-            return "Increasing"
-        elif trend < 0:
-            return "Decreasing"
+        store_dir = volume_est_cfg.TIME_SERIES_STORE_DIR
+        if self.updated_patients is None:
+            write_time_series_store(data_by_method, store_dir)
         else:
-            return "Stable"
-         
-    @staticmethod
-    def calculate_change_acceleration(df):
-        """
-        Calcualte acceleration of the volume.
-        """
-        df_clean = df.dropna(subset=["Age", "Volume"])
+            update_time_series_store(data_by_method, store_dir, self.outdated_patients)
+        print(f"\tSaved time series store to {store_dir}.")
 
-        x = df_clean["Age"].values.reshape(-1, 1)
-        y = df_clean["Volume"].values.reshape(-1, 1)
-        
-        poly_features = PolynomialFeatures(degree=2)
-        x_poly = poly_features.fit_transform(x)
-        model = LinearRegression()
-        model.fit(x_poly, y)
-        quadratic_coef = model.coef_[0][2]
-        
-        # Classify based on best fit
-        if quadratic_coef > 0:
-            return "Increasing"
-        else:
-            return "Decreasing"
-    
-    @staticmethod
-    def calculate_relative_volume_change_pct(df):
-        """
-        Calculates relative volume change based on the baseline volume.
-        """
-        baseline_volume = df["Baseline Volume"].iloc[0]
-        relative_change = (df["Volume"] - baseline_volume) / baseline_volume * 100
-        return relative_change
-    
-    @staticmethod
-    def calculate_auc(df):
+    def remove_outdated_outputs(self, plots_dir, csv_dir):
         """
-        Calculates the area under the curve (AUC) for the volume data.
-        """
-        df_clean = df.dropna(subset=["Age", "Normalized Volume"])
-        x = df_clean["Age"].values
-        y = df_clean["Normalized Volume"].values
-        auc_value = auc(x, y)
-        return auc_value
-    
-    @staticmethod
-    def calculate_volume_coefficient_of_variation(df):
-        """"
-        Calculates the coefficient of variation for the volume data.
-        """
-        mean_volume = df["Volume Avg"]
-        std_volume = df["Volume Std"]
-        cv = std_volume / mean_volume
-        return cv
-    
-    @staticmethod
-    def calculate_rolling_average_volume_change(df, window_size=3):
-        """
-        Calculate the rolling average of the volume change based on a specified window size.
-        """
-        rolling_avg_change = df["Volume Change"].rolling(window=window_size).mean()
-        return rolling_avg_change
-    
-    @staticmethod
-    def calculate_cumulative_relative_volume_change_pct(df):
-        """
-        Calculate the cumulative average relative volume change percentage.
-        """
-        baseline_volume = df["Baseline Volume"].iloc[0]
-        relative_change_pct = (df["Volume"] - baseline_volume) / baseline_volume * 100
-        cumulative_relative_change_pct = relative_change_pct.cumsum()
-        return cumulative_relative_change_pct
-    ############################
-    # Plotting-related methods #
-    ############################
+        Delete the plots and CSV files of the outdated patients before they are rebuilt,
+        the file names of the plots contain the age range of the scans.
 
-    def setup_plot_base(self, normalize=False):
+        Args:
+            plots_dir (str): Directory of the volume plots.
+            csv_dir (str): Directory of the time series CSV files.
         """
-        Setup the base of a plot with the necessary properties.
+        removed = 0
+        for patient_id in sorted(self.outdated_patients):
+            escaped_id = glob.escape(str(patient_id))
+            for data_type in self.data_sources:
+                removed += remove_files(
+                    os.path.join(plots_dir, data_type),
+                    [
+                        f"volume_{data_type}_{escaped_id}_*.png",
+                        f"normalized_volume_{data_type}_{escaped_id}_*.png",
+                    ],
+                )
+            removed += remove_files(plots_dir, [f"volume_comparison_{escaped_id}.png"])
+            for method in CSV_METHODS:
+                removed += remove_files(
+                    os.path.join(csv_dir, method), [f"{escaped_id}_{method}.csv"]
+                )
+        print(f"\tRemoved {removed} outdated plots and csv's.")
 
-        Returns:
-            tuple: A tuple containing the figure and axis objects of the plot.
+    def save_incremental_state(self):
         """
-        plt.close("all")
-        fig, a_x1 = plt.subplots(figsize=(12, 8))
-        a_x1.set_xlabel("Age (days)", size=15)
-        if normalize:
-            a_x1.set_ylabel("Normalized Volume (mm³)", size=15)
-        else:
-            a_x1.set_ylabel("Volume (mm³)", size=15)
-
-        a_x1.tick_params(axis="y", size=13)
-        return fig, a_x1
-
-    def add_volume_change_to_plot(self, a_x, ages, volumes):
+        Save the mask signatures, the patients with outputs and the smoothing window for
+        the next incremental run.
         """
-        Add volume change annotations to the plot.
+        save_manifest(
+            volume_est_cfg.INCREMENTAL_MANIFEST,
+            self.mask_signatures,
+            self.filtered_data.keys(),
+            self.window_size,
+        )
 
-        Args:
-            a_x (matplotlib.axes.Axes): Axis object of the plot.
-            dates (list): List of dates.
-            volumes (list): List of volumes.
-        """
-        if ages is None:
-            ages = list(range(len(volumes)))
-
-        _ , volume_change_pct = zip(*[
-            self.calculate_volume_change(volumes[i - 1], vol)
-            for i, vol in enumerate(volumes[1:], 1)
-        ])
-        volume_change_pct = list(volume_change_pct)
-        volume_change_pct.insert(0, 0)
-
-        for i, (age, volume, volume_change) in enumerate(
-            zip(ages, volumes, volume_change_pct)
-        ):
-            a_x.text(
-                age,
-                volume,
-                f"{volume_change:.2f}%",
-                fontsize=8,
-                va="bottom",
-                ha="left",
-            )
+    ############################
+    # Plotting-related methods #
+    ############################
 
-    def add_date_to_plot(self, a_x, dates, ages):
+    def make_plot_queue(self):
         """
-        Add date annotations to the plot.
+        Create the plot job queue configured in volume_est_cfg (mode, workers and sampling).
+        In 'sampled' mode the same patients are plotted for every data source.
         """
-        if dates is not None and ages:
-            a_x2 = a_x.twiny()
-            a_x2.xaxis.set_ticks_position("top")
-            a_x2.xaxis.set_label_position("top")
-            a_x2.set_xlabel("Dates")
-            a_x2.set_xlim(a_x.get_xlim())
-            a_x2.set_xticks(ages)
-            date_labels = [
-                date.strftime("%d/%m/%Y") if isinstance(date, datetime) else date
-                for date in dates
-            ]
-            a_x2.set_xticklabels(date_labels, rotation=90)
-            a_x2.xaxis.set_tick_params(labelsize=8)
+        plot_queue = PlotQueue(
+            mode=volume_est_cfg.PLOT_MODE,
+            workers=volume_est_cfg.PLOT_WORKERS,
+            sample_size=volume_est_cfg.PLOT_SAMPLE_SIZE,
+            seed=volume_est_cfg.PLOT_SAMPLE_SEED,
+        )
+        patient_ids = set()
+        for data in self.data_sources.values():
+            patient_ids.update(data.keys())
+        plot_queue.set_patients(patient_ids)
+        return plot_queue
 
     def plot_volumes(self, output_path):
         """
@@ -1128,192 +1198,79 @@ class VolumeEstimator:
 
         Args:
             output_path (str): The directory where plots should be saved.
+
+        Returns:
+            int: Number of rendered plots.
         """
+        plot_queue = self.make_plot_queue()
         for data_type, data in self.data_sources.items():
             if getattr(volume_est_cfg, data_type.upper(), None):
-                self.plot_each_type(data, output_path, data_type)
-                print(f"\tPlotted {data_type} data!")
+                self.plot_each_type(
+                    self.select_updated(data), output_path, data_type, plot_queue
+                )
+                print(f"\tQueued {data_type} plots!")
+        num_plots = plot_queue.run()
+        print(f"\tRendered {num_plots} plots (mode: {plot_queue.mode}).")
+        return num_plots
 
-    def plot_each_type(self, data, output_path, data_type):
+    def plot_each_type(self, data, output_path, data_type, plot_queue=None):
         """
-        Plots the volumes data for a specific data type.
+        Queues the volume and normalized volume plots for a specific data type.
 
         Args:
             data (dict): Data to plot.
             output_path (str): The directory where plots should be saved.
             data_type (str): The type of data ('raw', 'filtered', etc.)
+            plot_queue (PlotQueue, optional): Queue to add the plots to. If None, the
+                plots are rendered right away.
         """
         type_output_path = os.path.join(output_path, data_type)
         os.makedirs(type_output_path, exist_ok=True)
         os.makedirs(output_path, exist_ok=True)
+        render_now = plot_queue is None
+        if render_now:
+            plot_queue = self.make_plot_queue()
 
         for patient_id, volumes_data in data.items():
             volumes_data.sort(key=lambda x: x[-1])  # sort by age
 
             if volume_est_cfg.CBTN_DATA or volume_est_cfg.JOINT_DATA:
-                # CBTN data: (volume, age)
+                # CBTN data: (volume, age), no dates
                 volumes, ages = zip(*volumes_data)
-                self.plot_data(
-                    data_type,
-                    type_output_path,
-                    patient_id,
-                    None,
-                    volumes,
-                    ages,
-                    has_dates=False,  # No dates in CBTN data
-                )
-                self.plot_normalized_data(
-                    data_type,
-                    type_output_path,
-                    patient_id,
-                    None,
-                    volumes,
-                    ages,
-                    has_dates=False,  # No dates in CBTN data
-                )
+                dates = None
             else:
                 # BCH data: (date, volume, age)
                 dates, volumes, ages = zip(*volumes_data)
-                self.plot_data(
-                    data_type,
-                    type_output_path,
-                    patient_id,
-                    dates,
-                    volumes,
-                    ages,
-                    has_dates=True,
-                )
-                self.plot_normalized_data(
-                    data_type,
-                    type_output_path,
-                    patient_id,
-                    dates,
-                    volumes,
-                    ages,
-                    has_dates=True,
-                )
-
-    def plot_data(
-        self,
-        data_type,
-        output_path,
-        patient_id,
-        dates,
-        volumes,
-        ages=None,
-        has_dates=True,
-    ):
-        """
-        Plots and saves the volume data for a single patient.
-
-        Args:
-            data_type (str): The type of data ('raw', 'filtered', etc.)
-            output_path (str): The directory where plots should be saved.
-            patient_id (str): The ID of the patient.
-            dates (list): List of dates.
-            volumes (list): List of volumes.
-            ages (list): List of ages.
-        """
-        os.makedirs(output_path, exist_ok=True)
-        fig, a_x1 = self.setup_plot_base(normalize=False)
 
-        if has_dates:
-            dates, volumes, ages = zip(
-                *sorted(zip(dates, volumes, ages), key=lambda x: x[2])
+            age_range = f"{min(ages)}_{max(ages)}"
+            params = {
+                "data_type": data_type,
+                "dates": dates,
+                "volumes": volumes,
+                "ages": ages,
+            }
+            change_points = self.change_points.get(data_type, {}).get(patient_id)
+            plot_queue.submit(
+                "volume",
+                os.path.join(
+                    type_output_path, f"volume_{data_type}_{patient_id}_{age_range}.png"
+                ),
+                patient_id,
+                **params,
             )
-            a_x1.plot(ages, volumes, color="tab:blue", marker="o")
-            self.add_volume_change_to_plot(a_x1, ages, volumes)
-            self.add_date_to_plot(a_x1, dates, ages)
-
-        else:
-            volumes, ages = zip(*sorted(zip(volumes, ages), key=lambda x: x[1]))
-            a_x1.plot(ages, volumes, color="tab:blue", marker="o")
-            self.add_volume_change_to_plot(a_x1, ages, volumes)
-
-        plt.title(f"Patient ID: {patient_id} - {data_type}")
-        fig.set_tight_layout(True)
-
-        age_range = (
-            f"{min(ages)}_{max(ages)}"  # Assuming ages is a list of float values
-        )
-        plt.savefig(
-            os.path.join(
-                output_path, f"volume_{data_type}_{patient_id}_{age_range}.png"
-            )
-        )
-        plt.close(fig)
-
-    def plot_normalized_data(
-        self,
-        data_type,
-        output_path,
-        patient_id,
-        dates,
-        volumes,
-        ages=None,
-        has_dates=True,
-        window_size=None,
-    ):
-        """
-        Plots and saves the normalized volume data for a single patient, signifying 25% change and shrinkage.
-        """
-        fig, ax1 = self.setup_plot_base(normalize=True)
-
-        initial_volume = volumes[0] if volumes[0] not in [0, np.nan] else 1
-        normalized_volumes = [v / initial_volume for v in volumes]
-
-        if has_dates:
-            dates, normalized_volumes, ages = zip(
-                *sorted(zip(dates, normalized_volumes, ages), key=lambda x: x[2])
-            )
-
-        else:
-            normalized_volumes, ages = zip(
-                *sorted(zip(normalized_volumes, ages), key=lambda x: x[1])
+            plot_queue.submit(
+                "normalized",
+                os.path.join(
+                    type_output_path,
+                    f"normalized_volume_{data_type}_{patient_id}_{age_range}.png",
+                ),
+                patient_id,
+                change_points=change_points,
+                **params,
             )
 
-        ax1.plot(ages, normalized_volumes, color="tab:blue", marker="o", linestyle="-")
-        self.add_volume_change_to_plot(ax1, ages, normalized_volumes)
-
-        num_scans = len(normalized_volumes)
-        window_size = window_size if window_size else max(3, num_scans // 2)
-        moving_average = (
-            pd.Series(normalized_volumes)
-            .rolling(window=window_size, min_periods=1)
-            .mean()
-        )
-        ax1.plot(
-            ages,
-            moving_average,
-            color="tab:orange",
-            linestyle="-",
-            label="Moving Average",
-        )
-
-        algo = rpt.detection.Pelt(model="rbf").fit(np.array(normalized_volumes))
-        result = algo.predict(pen=10)
-
-        # Plot detected change points
-        for cp in result:
-            if cp < len(ages):
-                ax1.axvline(x=ages[cp], color="red", linestyle="--")
-
-        if has_dates:
-            self.add_date_to_plot(ax1, dates, ages)
-
-        age_range = f"{min(ages)}_{max(ages)}"
-        handles, labels = ax1.get_legend_handles_labels()
-        by_label = dict(zip(labels, handles))
-        plt.legend(by_label.values(), by_label.keys(), loc="best")
-        plt.title(f"Patient ID: {patient_id} - Normalized Volume {data_type}")
-        fig.set_tight_layout(True)
-        plt.savefig(
-            os.path.join(
-                output_path,
-                f"normalized_volume_{data_type}_{patient_id}_{age_range}.png",
-            )
-        )
-        plt.close(fig)
+        if render_now:
+            plot_queue.run()
 
     def plot_comparison(self, output_path):
         """
@@ -1322,38 +1279,20 @@ class VolumeEstimator:
         Args:
             output_path (str): The directory where the comparison plots should be saved.
         """
-        unique_patient_ids = set(self.data_sources["filtered"].keys())
+        plot_queue = self.make_plot_queue()
+        unique_patient_ids = set(self.select_updated(self.data_sources["filtered"]).keys())
 
         for patient_id in unique_patient_ids:
-            fig, axs = plt.subplots(1, len(self.data_sources), figsize=(24, 8))
-
-            for i, (key, data) in enumerate(self.data_sources.items()):
-                a_x = axs[i]
-
-                patient_data = data.get(patient_id, [])
-
-                if not patient_data:
-                    a_x.set_title(f"No Data: {key}")
-                    continue
-
-                if len(patient_data[0]) == 3:
-                    _, volumes, ages = zip(*patient_data)
-                    a_x.plot(ages, volumes, label=f"{key} data")
-                    a_x.set_xlabel("Date")
-                elif len(patient_data[0]) == 2:
-                    volumes, ages = zip(*patient_data)
-                    a_x.plot(ages, volumes, label=f"{key} data")
-                    a_x.set_xlabel("Age")
-
-                a_x.set_title(f"{key} Data for Patient {patient_id}")
-                a_x.set_ylabel("Volume")
-                a_x.legend()
-
-            plt.tight_layout()
-            plt.savefig(
-                os.path.join(output_path, f"volume_comparison_{patient_id}.png")
+            plot_queue.submit(
+                "comparison",
+                os.path.join(output_path, f"volume_comparison_{patient_id}.png"),
+                patient_id,
+                series=[
+                    (key, data.get(patient_id, []))
+                    for key, data in self.data_sources.items()
+                ],
             )
-            plt.close(fig)
+        plot_queue.run()
 
 
 if __name__ == "__main__":
@@ -1370,6 +1309,12 @@ if __name__ == "__main__":
     else:
         ve.process_files()
     print("\tAll files processed.")
+    if ve.outdated_patients:
+        print("Removing outdated outputs:")
+        ve.remove_outdated_outputs(volume_est_cfg.PLOTS_DIR, volume_est_cfg.CSV_DIR)
+    if volume_est_cfg.CHANGE_POINTS:
+        print("Detecting change points:")
+        ve.detect_volume_change_points()
     print("Generating plots:")
     ve.plot_volumes(output_path=volume_est_cfg.PLOTS_DIR)
     print("\tSaved all plots.")
@@ -1387,3 +1332,4 @@ if __name__ == "__main__":
     print("Generating time-series csv's.")
     ve.generate_csv(output_folder=volume_est_cfg.CSV_DIR)
     print("\tSaved all csv's.")
+    ve.save_incremental_state()
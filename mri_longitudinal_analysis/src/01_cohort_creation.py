@@ -8,10 +8,20 @@ import os
 import warnings
 import seaborn as sns
 import matplotlib.pyplot as plt
-from scipy.stats import ttest_ind, mannwhitneyu, chi2_contingency, fisher_exact
 from cfg.src import cohort_creation_cfg
 from cfg.utils.helper_functions_cfg import NORD_PALETTE
-from utils.helper_functions import zero_fill, categorize_age_group, categorize_time_since_first_diagnosis, save_dataframe, check_assumptions
+from utils.time_series_store import is_time_series_store, read_time_series_store
+from utils.time_series_csv import list_volume_csvs, read_volume_csvs
+from utils.cohort_statistics import (
+    categorical,
+    cohort_comparison_table,
+    continuous,
+    describe,
+    summary_lines,
+    write_table,
+)
+from utils.treatment_info import bch_treatment_types, cbtn_treatment_info
+from utils.helper_functions import zero_fill, categorize_age_groups, categorize_times_since_first_diagnosis, save_dataframe, check_assumptions
 
 class CohortCreation:
     
@@ -342,53 +352,71 @@ class CohortCreation:
             f"\tFinal clinical {self.cohort} data has length {len(self.clinical_data_reduced)}."
         )
 
+    @staticmethod
+    def load_volumes_store(store_path):
+        """
+        Load the volume time series of one smoothing method from the Parquet dataset
+        written by the volume estimation, with the same patient ID and date handling
+        as the per-patient CSV files.
+        """
+        patient_df = read_time_series_store(
+            store_path, method=cohort_creation_cfg.VOLUMES_METHOD
+        ).drop(columns=["method"])
+        if "bch" in str(store_path).lower():
+            patient_df["Patient_ID"] = (
+                patient_df["Patient_ID"].astype(str).str.zfill(7).astype("string")
+            )
+            patient_df["Date"] = pd.to_datetime(
+                patient_df["Date"], format="%d/%m/%Y", errors="coerce"
+            )
+        else:
+            patient_df["Patient_ID"] = patient_df["Patient_ID"].astype(str)
+        return patient_df
+
     def load_volumes_data(self, volumes_data_paths):
         """
-        Load volumes data from specified paths. Each path contains CSV files for different patients.
-        The data from each file is loaded, processed, and concatenated into a single DataFrame.
+        Load volumes data from specified paths. Each path contains CSV files for different patients
+        or is the Parquet time series dataset of the volume estimation.
+        The CSV files of a path are read concurrently and concatenated once (see
+        utils.time_series_csv), the ages at the first and last scan and the follow-up times
+        come from a single aggregation per patient.
         Parameters:
         - volumes_data_paths (list): List containing paths to directories of volume data CSV files.
         The function updates the `self.volumes_data` attribute with the concatenated DataFrame.
         """
         data_frames = []
         total_files = 0
-        age_at_last_scan = {}
-        age_at_first_scan = {}
         for volumes_data_path in volumes_data_paths:
-            all_files = [f for f in os.listdir(volumes_data_path) if f.endswith(".csv")]
+            if is_time_series_store(volumes_data_path):
+                store_df = self.load_volumes_store(volumes_data_path)
+                print(f"\tVolume data found: {store_df['Patient_ID'].nunique()} patients.")
+                total_files += 1
+                data_frames.append(store_df)
+                continue
+
+            all_files = list_volume_csvs(volumes_data_path)
             print(f"\tVolume data found: {len(all_files)}.")
             total_files += len(all_files)
-            for file in all_files:
-                patient_id = file.split("_")[0]
-                patient_df = pd.read_csv(os.path.join(volumes_data_path, file))
-                # Adjust patient id
-                patient_df["Patient_ID"] = patient_id
-                if "bch" in str(volumes_data_path).lower():
-                    patient_df["Patient_ID"] = (
-                        patient_df["Patient_ID"]
-                        .astype(str)
-                        .str.zfill(7)
-                        .astype("string")
-                    )
-                    patient_df["Date"] = pd.to_datetime(
-                        patient_df["Date"], format="%d/%m/%Y", errors='coerce'
-                    )
-                age_at_last_scan[patient_id] = patient_df["Age"].max()
-                age_at_first_scan[patient_id] = patient_df["Age"].min()
-        
-                data_frames.append(patient_df)
+            path_df = read_volume_csvs(all_files, workers=cohort_creation_cfg.LOADER_WORKERS)
+            if "bch" in str(volumes_data_path).lower():
+                path_df["Patient_ID"] = (
+                    path_df["Patient_ID"].astype(str).str.zfill(7).astype("string")
+                )
+                path_df["Date"] = pd.to_datetime(
+                    path_df["Date"], format="%d/%m/%Y", errors="coerce"
+                )
+            data_frames.append(path_df)
         print(f"\tTotal volume data files found: {total_files}.")
-        
-        # Ensure all DataFrames have the same columns before concatenation
-        all_columns = set().union(*(df.columns for df in data_frames))
-        data_frames = [df.reindex(columns=all_columns) for df in data_frames]
-        
-        # Concatenate DataFrames
-        self.volumes_data = pd.concat(data_frames, ignore_index=True)
-        
+
+        # Concatenate DataFrames, columns missing in some of them are NaN
+        self.volumes_data = pd.concat(data_frames, ignore_index=True, sort=False)
+
         # Convert 'Age' column to numeric, coercing errors to NaN
         self.volumes_data['Age'] = pd.to_numeric(self.volumes_data['Age'], errors='coerce')
-        
+        scan_ages = self.volumes_data.groupby("Patient_ID", sort=False)["Age"].agg(["min", "max"])
+        self.age_at_last_scan = scan_ages["max"].to_dict()
+        self.age_at_first_scan = scan_ages["min"].to_dict()
+
         # Fill NaN values appropriately based on column type
         fill_values = {}
         for column in self.volumes_data.columns:
@@ -399,161 +427,51 @@ class CohortCreation:
                 fill_values[column] = pd.NaT
             else:
                 fill_values[column] = ''
-        
+
         # Apply the fill operation to the entire DataFrame at once
         self.volumes_data = self.volumes_data.fillna(fill_values)
-        
-        self.age_at_last_scan = age_at_last_scan
-        self.age_at_first_scan = age_at_first_scan
-        
+
         if self.cohort in ["CBTN", "JOINT"]:
-            follow_up_times = {}
-            cbtn_patient_ids = [
-                patient_id
-                for patient_id in self.volumes_data["Patient_ID"].unique()
-                if not patient_id.isdigit()
-            ]
-            for patient_id in cbtn_patient_ids:
-                patient_data = self.volumes_data[
-                    self.volumes_data["Patient_ID"] == patient_id
-                ]
-                min_date = patient_data["Age"].min()
-                max_date = patient_data["Age"].max()
-                follow_up = max_date - min_date
-                follow_up_times[patient_id] = follow_up
+            # follow-up of the CBTN patients (non numeric IDs), on the filled ages
+            follow_up = self.volumes_data.groupby("Patient_ID", sort=False)["Age"].agg(
+                ["min", "max"]
+            )
+            is_cbtn = ~follow_up.index.astype(str).str.isdigit()
+            follow_up_times = (follow_up["max"] - follow_up["min"])[is_cbtn]
             self.volumes_data["Follow-Up Time"] = self.volumes_data["Patient_ID"].map(
                 follow_up_times
             )
-        
+
         # Patient IDs in volumes data
         patient_ids_volumes = set(self.volumes_data["Patient_ID"].unique())
-        
+
         return patient_ids_volumes
-    
+
     def extract_treatment_types_bch(self):
         """
         Extract treatment types from the clinical data based on whether surgical resection,
-        systemic therapy, or radiation was part of the initial treatment.
+        systemic therapy, or radiation was part of the initial treatment
+        (see utils.treatment_info).
 
         Returns:
-        - treatment_list (list): A list of treatment types derived from the clinical data.
+        - treatment_types (pd.Series): The treatment type of every row of the clinical data.
 
         This function is called within the `load_clinical_data` method.
         """
-        treatment_list = []
-        for _, row in self.clinical_data.iterrows():
-            treatments = []
-
-            if row["Surgical Resection"] == "Yes":
-                treatments.append("Surgery")
-
-            if row["Systemic therapy before radiation"] == "Yes":
-                treatments.append("Chemotherapy")
-
-            if row["Radiation as part of initial treatment"] == "Yes":
-                treatments.append("Radiation")
-
-            treatment_type = ", ".join(treatments) if treatments else "No Treatment"
-            if treatment_type == "Surgery, Chemotherapy, Radiation":
-                treatment_type = "All Treatments"
-            treatment_list.append(treatment_type)
-
-        return treatment_list
+        return bch_treatment_types(self.clinical_data)
 
     def extract_treatment_info_cbtn(self):
         """
-        Extracts treatment information for CBTN data.
+        Extracts treatment information for CBTN data (see utils.treatment_info).
 
         Updates self.clinical_data with the columns:
         [Age at First Diagnosis, Treatment Type,
         Received Treatment, Age at First Treatment]
+        and caps the Age at Last Clinical Follow-Up at the Age at First Treatment.
         """
-
-        # Extract the first age recorded in volumes data for each patient
-        min_ages = self.volumes_data.groupby('Patient_ID')['Age'].min().reset_index()
-        min_ages.columns = ['Patient_ID', 'First Age']
-        
-        # Initialize new columns in clinical_data
-        new_columns = {
-            "Age at First Diagnosis": pd.Series(dtype='float64'),
-            "Treatment Type": pd.Series(dtype='object'),
-            "Received Treatment": pd.Series(dtype='object'),
-            "Age at First Treatment": pd.Series(dtype='float64')
-        }
-        self.clinical_data = self.clinical_data.assign(**new_columns)
-        # Prepare a dictionary to store updates
-        updates = {col: [] for col in new_columns.keys()}
-        update_indices = []
-        
-        # Loop through each patient in clinical_data
-        for idx, row in self.clinical_data.iterrows():
-            patient_id = str(row["CBTN Subject ID"])
-            surgery = row["Surgery"]
-            chemotherapy = row["Chemotherapy"]
-            radiation = row["Radiation"]
-            age_at_first_treatment = row["Age at Treatment"]
-            age_at_first_diagnosis = row["Age at Diagnosis"]
-            
-
-            if patient_id in min_ages['Patient_ID'].values:
-                first_age = min_ages[min_ages["Patient_ID"] == patient_id]["First Age"].values[0]
-            else:
-                continue
-            
-            # Age at First Diagnosis
-            if np.isnan(age_at_first_diagnosis) or age_at_first_diagnosis > first_age:
-                age_at_first_diagnosis = int(first_age)
-                
-            updates["Age at First Diagnosis"].append(age_at_first_diagnosis)
-    
-
-            # Age at First Treatment
-            if np.isnan(age_at_first_treatment):
-                age_at_first_treatment = np.nan
-            updates["Age at First Treatment"].append(age_at_first_treatment)            
-            
-            # Treatment Type
-            treatments = []
-            if surgery == "Yes":
-                treatments.append("Surgery")
-            if chemotherapy == "Yes":
-                treatments.append("Chemotherapy")
-            if radiation == "Yes":
-                treatments.append("Radiation")
-            treatment_type = ", ".join(treatments) if treatments else "No Treatment"
-            if treatment_type == "Surgery, Chemotherapy, Radiation":
-                treatment_type = "All Treatments"
-            updates["Treatment Type"].append(treatment_type)
-
-            # Received Treatment
-            received_treatment = "Yes" if treatments else "No"
-            updates["Received Treatment"].append(received_treatment)
-                    
-            update_indices.append(idx)
-                
-        # Apply all updates at once
-        for col, values in updates.items():
-            self.clinical_data.loc[update_indices, col] = values
-
-        # Convert columns to appropriate data types
-        self.clinical_data["Age at First Diagnosis"] = pd.to_numeric(
-            self.clinical_data["Age at First Diagnosis"], errors="coerce"
-        )
-        self.clinical_data["Age at First Treatment"] = pd.to_numeric(
-            self.clinical_data["Age at First Treatment"], errors="coerce"
-        )
-        
-        # Fill NA values in Age at First Treatment
-        mask = self.clinical_data["Age at First Treatment"].isna()
-        self.clinical_data.loc[mask, "Age at First Treatment"] = self.clinical_data.loc[mask, "Age at Last Clinical Follow-Up"]
-
-        # Update Age at Last Clinical Follow-Up
-        self.clinical_data["Age at Last Clinical Follow-Up"] = pd.to_numeric(
-            self.clinical_data["Age at Last Clinical Follow-Up"], errors="coerce"
-        )
-        self.clinical_data["Age at Last Clinical Follow-Up"] = np.minimum(
-            self.clinical_data["Age at Last Clinical Follow-Up"],
-            self.clinical_data["Age at First Treatment"]
+        treatment_info = cbtn_treatment_info(self.clinical_data, self.volumes_data)
+        self.clinical_data = self.clinical_data.assign(
+            **{column: treatment_info[column] for column in treatment_info.columns}
         )
 
     def merge_data(self):
@@ -576,11 +494,9 @@ class CohortCreation:
                 on=["Patient_ID"],
                 how="right",
             )
-            self.merged_data["Follow-Up Time"] = self.merged_data.apply(
-                lambda row: row["Follow-Up Time"]
-                if row["Dataset"] == "DF_BCH"
-                else row["Volumes Follow-Up Time"],
-                axis=1,
+            self.merged_data["Follow-Up Time"] = self.merged_data["Follow-Up Time"].where(
+                self.merged_data["Dataset"] == "DF_BCH",
+                self.merged_data["Volumes Follow-Up Time"],
             )
 
             self.merged_data = self.merged_data.drop(
@@ -605,10 +521,10 @@ class CohortCreation:
                 self.merged_data["Follow-Up Time"] = self.merged_data["Volumes Follow-Up Time"]
                 self.merged_data = self.merged_data.drop(columns=["Volumes Follow-Up Time"])
         
-        self.merged_data["Age Group"] = self.merged_data.apply( lambda x: categorize_age_group(x, column="Age"), axis=1).astype("category")
-        self.merged_data["Age Group at Diagnosis"] = self.merged_data.apply(lambda x: categorize_age_group(x, column="Age at First Diagnosis"), axis=1).astype("category")
+        self.merged_data["Age Group"] = categorize_age_groups(self.merged_data, column="Age")
+        self.merged_data["Age Group at Diagnosis"] = categorize_age_groups(self.merged_data, column="Age at First Diagnosis")
         self.merged_data['Age at First Diagnosis (Years)'] = self.merged_data['Age at First Diagnosis'] / 365.25
-        self.merged_data["Time Period Since Diagnosis"] = self.merged_data.apply(categorize_time_since_first_diagnosis, axis=1).astype("category")
+        self.merged_data["Time Period Since Diagnosis"] = categorize_times_since_first_diagnosis(self.merged_data)
         self.merged_data["Baseline Volume cm3"] = self.merged_data["Baseline Volume"] / 1000
         self.merged_data["Change Speed"] = self.merged_data["Change Speed"].astype(
             "category"
@@ -700,152 +616,56 @@ class CohortCreation:
         print("\tData types and NaN values checked.")
 
 
+# Variables of the summary statistics, continuous ones per scan and categorical
+# ones per patient
+SUMMARY_VARIABLES = [
+    continuous("Age", scale=365.25, unit="years"),
+    continuous("Age at First Diagnosis (Years)", unit="years", name="Age at Diagnosis"),
+    continuous("Days Between Scans", scale=30.4, unit="months", nonzero=True),
+    categorical("Age Group at Diagnosis"),
+    categorical("Received Treatment"),
+    categorical("Symptoms"),
+    categorical("Histology"),
+    categorical("Location"),
+    categorical("Sex"),
+    categorical("Treatment Type"),
+    categorical("BRAF Status"),
+    continuous("Volume Change", scale=1000, unit="cm3", nonzero=True),
+    continuous("Volume Change Pct", unit="%", nonzero=True),
+    continuous("Volume Change Rate", scale=1000, unit="cm3/day", nonzero=True),
+    continuous("Volume Change Rate Pct", unit="%/day", nonzero=True),
+    continuous("Normalized Volume", unit="mm^3"),
+    continuous("Volume", scale=1000, unit="cm^3"),
+    continuous("Baseline Volume", scale=1000, unit="cm^3"),
+    continuous("Follow-Up Time", scale=365.25, unit="years"),
+]
+
+
 class CohortStatistics:
     def __init__(self, cohort_data):
         self.cohort_data = cohort_data
         print("Step 1: Initializing CohortStatistics class...")
 
-    def printout_stats(self, file_path):
+    def printout_stats(self, file_path, table_file_path=None):
         """
-        Descriptive statistics written to a file.
+        Descriptive statistics of the SUMMARY_VARIABLES written to a file.
 
         Parameters:
-        - output_file_path (str): Path to the output path.
-        - prefix (str): Prefix used for naming the output file.
+        - file_path (str): Path to the output text file.
+        - table_file_path (str, optional): Path to a .csv or .txt file for the table of
+        all statistics (see utils.cohort_statistics).
         """
+        summary_table = describe(self.cohort_data, SUMMARY_VARIABLES)
+        if table_file_path:
+            write_table(summary_table, table_file_path)
+
         with open(file_path, "w", encoding="utf-8") as file:
 
             def write_stat(statement):
                 file.write(statement + "\n")
 
-            # Age
-            median_age = self.cohort_data["Age"].median()
-            max_age = self.cohort_data["Age"].max()
-            min_age = self.cohort_data["Age"].min()
-            write_stat(f"\t\tMedian Age: {median_age / 365.25} years")
-            write_stat(f"\t\tMaximum Age: {max_age / 365.25} years")
-            write_stat(f"\t\tMinimum Age: {min_age / 365.25} years")
-            median_age_diagnosis = self.cohort_data["Age at First Diagnosis (Years)"].median()
-            max_age_diagnosis = self.cohort_data["Age at First Diagnosis (Years)"].max()
-            min_age_diagnosis = self.cohort_data["Age at First Diagnosis (Years)"].min()
-            write_stat(f"\t\tMedian Age at Diagnosis: {median_age_diagnosis} years")
-            write_stat(f"\t\tMaximum Age at Diagnosis: {max_age_diagnosis} years")
-            write_stat(f"\t\tMinimum Age at Diagnosis: {min_age_diagnosis} years")
-
-            # Days Between Scans
-            median_days_between_scans = self.cohort_data["Days Between Scans"].median()
-            max_days_between_scans = self.cohort_data["Days Between Scans"].max()
-            unique_days = self.cohort_data["Days Between Scans"].unique()
-            next_smallest = min(day for day in unique_days if day > 0)
-
-            write_stat(f"\t\tMedian Days Between Scans: {median_days_between_scans / 30.4} months")
-            write_stat(f"\t\tMaximum Days Between Scans: {max_days_between_scans / 30.4} months")
-            write_stat(f"\t\tMinimum Days Between Scans: {next_smallest /30.4} months")
-
-            # Sex, Received Treatment, Symptoms, Location,
-            # Patient Classification, Treatment Type
-            copy_df = self.cohort_data.copy()
-            unique_pat = copy_df.drop_duplicates(subset=["Patient_ID"])
-            counts_braf = unique_pat["BRAF Status"].value_counts()
-            counts_sex = unique_pat["Sex"].value_counts()
-            counts_received_treatment = unique_pat["Received Treatment"].value_counts()
-            counts_symptoms = unique_pat["Symptoms"].value_counts()
-            counts_histology = unique_pat["Histology"].value_counts()
-            counts_location = unique_pat["Location"].value_counts()
-            counts_treatment_type = unique_pat["Treatment Type"].value_counts()
-            counts_age_group = unique_pat["Age Group at Diagnosis"].value_counts()
-            
-            write_stat(f"\t\tAge Group at Diagnosis: {counts_age_group}")
-            write_stat(f"\t\tReceived Treatment: {counts_received_treatment}")
-            write_stat(f"\t\tSymptoms: {counts_symptoms}")
-            write_stat(f"\t\tHistology: {counts_histology}")
-            write_stat(f"\t\tLocation: {counts_location}")
-            write_stat(f"\t\tSex: {counts_sex}")
-            write_stat(f"\t\tTreatment Type: {counts_treatment_type}")
-            write_stat(f"\t\tBRAF Status: {counts_braf}")
-
-            # Volume Change
-            mm3_to_cm3 = 1000
-            filtered_data = self.cohort_data[self.cohort_data["Volume Change"] != 0]
-            median_volume_change = filtered_data["Volume Change"].median()
-            max_volume_change = filtered_data["Volume Change"].max()
-            min_volume_change = filtered_data["Volume Change"].min()
-            write_stat(f"\t\tMedian Volume Change: {median_volume_change / mm3_to_cm3} cm3")
-            write_stat(f"\t\tMaximum Volume Change: {max_volume_change / mm3_to_cm3} cm3")
-            write_stat(f"\t\tMinimum Volume Change: {min_volume_change / mm3_to_cm3} cm3")
-
-            filtered_data = self.cohort_data[self.cohort_data["Volume Change Pct"] != 0]
-            median_volume_change_pct = filtered_data["Volume Change Pct"].median()
-            max_volume_change_pct = filtered_data["Volume Change Pct"].max()
-            min_volume_change_pct = filtered_data["Volume Change Pct"].min()
-            write_stat(f"\t\tMedian Volume Change Pct: {median_volume_change_pct} %")
-            write_stat(f"\t\tMaximum Volume Change Pct: {max_volume_change_pct} %")
-            write_stat(f"\t\tMinimum Volume Change Pct: {min_volume_change_pct} %")
-
-            # Volume Change Rate
-            filtered_data = self.cohort_data[
-                self.cohort_data["Volume Change Rate"] != 0
-            ]
-            median_volume_change_rate = filtered_data["Volume Change Rate"].median()
-            max_volume_change_rate = filtered_data["Volume Change Rate"].max()
-            min_volume_change_rate = filtered_data["Volume Change Rate"].min()
-            write_stat(
-                f"\t\tMedian Volume Change Rate: {median_volume_change_rate/mm3_to_cm3} cm3/day"
-            )
-            write_stat(
-                f"\t\tMaximum Volume Change Rate: {max_volume_change_rate/mm3_to_cm3} cm3/day"
-            )
-            write_stat(
-                f"\t\tMinimum Volume Change Rate: {min_volume_change_rate/mm3_to_cm3} cm3/day"
-            )
-            filtered_data = self.cohort_data[self.cohort_data["Volume Change Rate Pct"] != 0]
-            median_volume_change_rate_pct = filtered_data["Volume Change Rate Pct"].median()
-            max_volume_change_rate_pct = filtered_data["Volume Change Rate Pct"].max()
-            min_volume_change_rate_pct = filtered_data["Volume Change Rate Pct"].min()
-            write_stat("\t\tMedian Volume Change Rate Pct: {:.2f} %/day".format(median_volume_change_rate_pct)) 
-            write_stat("\t\tMaximum Volume Change Rate Pct: {:.2f} %/day".format(max_volume_change_rate_pct))
-            write_stat("\t\tMinimum Volume Change Rate Pct: {:.2f} %/day".format(min_volume_change_rate_pct))
-
-            # Normalized Volume
-            median_normalized_volume = self.cohort_data["Normalized Volume"].median()
-            max_normalized_volume = self.cohort_data["Normalized Volume"].max()
-            min_normalized_volume = self.cohort_data["Normalized Volume"].min()
-            write_stat(f"\t\tMedian Normalized Volume: {median_normalized_volume} mm^3")
-            write_stat(f"\t\tMaximum Normalized Volume: {max_normalized_volume} mm^3")
-            write_stat(f"\t\tMinimum Normalized Volume: {min_normalized_volume} mm^3")
-
-            # Volume
-            median_volume = self.cohort_data["Volume"].median()
-            max_volume = self.cohort_data["Volume"].max()
-            min_volume = self.cohort_data["Volume"].min()
-            write_stat(f"\t\tMedian Volume: {median_volume / mm3_to_cm3} cm^3")
-            write_stat(f"\t\tMaximum Volume: {max_volume / mm3_to_cm3} cm^3")
-            write_stat(f"\t\tMinimum Volume: {min_volume / mm3_to_cm3} cm^3")
-
-            # Baseline volume
-            median_baseline_volume = self.cohort_data["Baseline Volume"].median()
-            max_baseline_volume = self.cohort_data["Baseline Volume"].max()
-            min_baseline_volume = self.cohort_data["Baseline Volume"].min()
-            write_stat(
-                f"\t\tMedian Baseline Volume: {median_baseline_volume / mm3_to_cm3} cm^3"
-            )
-            write_stat(
-                f"\t\tMaximum Baseline Volume: {max_baseline_volume / mm3_to_cm3} cm^3"
-            )
-            write_stat(
-                f"\t\tMinimum Baseline Volume: {min_baseline_volume / mm3_to_cm3} cm^3"
-            )
-
-            # Follow-Up time
-            median_follow_up = self.cohort_data["Follow-Up Time"].median()
-            max_follow_up = self.cohort_data["Follow-Up Time"].max()
-            min_follow_up = self.cohort_data["Follow-Up Time"].min()
-            median_follow_up_y = median_follow_up / 365.25
-            max_follow_up_y = max_follow_up / 365.25
-            min_follow_up_y = min_follow_up / 365.25
-            write_stat(f"\t\tMedian Follow-Up Time: {median_follow_up_y:.2f} years")
-            write_stat(f"\t\tMaximum Follow-Up Time: {max_follow_up_y:.2f} years")
-            write_stat(f"\t\tMinimum Follow-Up Time: {min_follow_up_y:.2f} years")
+            for line in summary_lines(summary_table):
+                write_stat(line)
 
             # get the ids of the patients with the three highest normalized volumes that do not repeat
             top_normalized_volumes = self.cohort_data.nlargest(3, "Normalized Volume")
@@ -943,74 +763,10 @@ class CohortStatistics:
         """
         Create a table comparing the two cohorts based on the variables of interest.
         """
-        cohort_var = "Dataset"
-        data = self.cohort_data.copy()
-        cohort_table = pd.DataFrame(
-            columns=["Variable", "Cohort 1", "Cohort 2", "P-value"]
+        cohort_table = cohort_comparison_table(
+            self.cohort_data, categorical_vars, continuous_vars, check_assumptions
         )
-        aggregated_data = data.groupby(["Patient_ID", cohort_var]).last().reset_index()
-        aggregated_data = aggregated_data.dropna(subset=continuous_vars)
-        for var in categorical_vars + continuous_vars:
-            cohort1_data = aggregated_data[
-                aggregated_data[cohort_var] == aggregated_data[cohort_var].unique()[0]
-            ]
-            cohort2_data = aggregated_data[
-                aggregated_data[cohort_var] == aggregated_data[cohort_var].unique()[1]
-            ]
-
-            if var in categorical_vars:
-                contingency_table = pd.crosstab(
-                    aggregated_data[cohort_var], aggregated_data[var]
-                )
-                if cohort1_data[var].nunique() == 2 and cohort2_data[var].nunique() == 2:
-                    _, p_val = fisher_exact(contingency_table)
-                else:
-                    _, p_val, _, _ = chi2_contingency(contingency_table)
-
-                cohort1_value = contingency_table.loc[
-                    aggregated_data[cohort_var].unique()[0]
-                ].to_dict()
-                cohort2_value = contingency_table.loc[
-                    aggregated_data[cohort_var].unique()[1]
-                ].to_dict()
-            else:
-                if len(cohort1_data) >= 30 and len(cohort2_data) >= 30:
-                    if check_assumptions(var, var, cohort1_data, "t-test") and check_assumptions(var, var, cohort2_data, "t-test"):
-                        _, p_val = ttest_ind(cohort1_data[var], cohort2_data[var])
-                    else:
-                        _, p_val = mannwhitneyu(cohort1_data[var], cohort2_data[var])
-                else:
-                    _, p_val = mannwhitneyu(cohort1_data[var], cohort2_data[var])
-
-                cohort1_value = (
-                    f"{cohort1_data[var].mean():.2f} ± {cohort1_data[var].std():.2f}"
-                )
-                cohort2_value = (
-                    f"{cohort2_data[var].mean():.2f} ± {cohort2_data[var].std():.2f}"
-                )
-
-            new_row = pd.DataFrame(
-                {
-                    "Variable": [var],
-                    "Cohort 1": [cohort1_value],
-                    "Cohort 2": [cohort2_value],
-                    "P-value": [f"{p_val:.3f}"],
-                }
-            )
-            cohort_table = pd.concat([cohort_table, new_row], ignore_index=True)
-
-        # Ensure the output directory exists
-        file_type = str(output_file_path).split('.')[-1]
-        if file_type.lower() == 'csv':
-            cohort_table.to_csv(output_file_path, index=False)
-            print(f"\tCohort table saved as CSV: {output_file_path}")
-        elif file_type.lower() == 'txt':
-            with open(output_file_path, 'w', encoding='utf-8') as f:
-                f.write(cohort_table.to_string(index=False))
-            print(f"\tCohort table saved as TXT: {output_file_path}")
-        else:
-            raise ValueError("Invalid file_type. Choose either 'csv' or 'txt'.")
-
+        write_table(cohort_table, output_file_path)
         return cohort_table
 
 
@@ -1046,6 +802,8 @@ if __name__ == "__main__":
     numerical_vars = cohort_creation_cfg.NUMERICAL_VARS
     cohort_data = cohort_creation.merged_data
     cohort_statistics = CohortStatistics(cohort_data)
-    cohort_statistics.printout_stats(cohort_stats_file)
+    cohort_statistics.printout_stats(
+        cohort_stats_file, cohort_creation_cfg.OUTPUT_STATS_TABLE_FILE
+    )
     cohort_statistics.generate_distribution_plots(output_dir)
     cohort_statistics.create_cohort_table(categorical_vars, numerical_vars, cohort_table_file)
@@ -10,11 +10,13 @@ import matplotlib.pyplot as plt
 import matplotlib.lines as lines
 from cfg.src import trajectories_cfg
 from cfg.utils import helper_functions_cfg
-from utils.helper_functions import classify_patient_volumetric, classify_patient_composite, calculate_progression, plot_histo_distributions, save_dataframe, create_histogram
+from utils.cohort_artifact import read_cohort
+from utils.threshold_sweep import check_sweep, sweep_summary, sweep_thresholds, threshold_grid
+from utils.helper_functions import classify_patients, calculate_progression_data, plot_histo_distributions, save_dataframe, create_histogram
 
 class TrajectoryClassification:
     def __init__(self, path_to_data, variables, cohort, sample_size):
-        df = pd.read_csv(path_to_data)
+        df = read_cohort(path_to_data)
         self.data = df   
         self.category_list = variables     
         self.cohort = cohort
@@ -148,8 +150,8 @@ class TrajectoryClassification:
 
     def get_progression_data(self, progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping):
         self.data.sort_values(by=["Patient_ID", "Age"], inplace=True)
-        progression_data = self.data.groupby("Patient_ID").apply(lambda x:
-            calculate_progression(x, progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping)
+        progression_data = calculate_progression_data(
+            self.data, progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping
         )
         progression_data = progression_data.reset_index(drop=False)
         # consider on the one side the merging back to the first data frame and continue with the analysis dataframe at the same time
@@ -158,56 +160,65 @@ class TrajectoryClassification:
         )
         self.data["Time Since Diagnosis"] = self.data["Time Since Diagnosis"].astype("category") # catefory version of Time Since First Scan
         
+    def threshold_sweep(self, output_dir, progression_thresholds, regression_thresholds, change_thresholds, thresholds, time_period_mapping):
+        """
+        Classify the patients for every combination of the thresholds in one pass and
+        save the results per threshold combination and patient, and their counts.
+
+        Parameters:
+        - output_dir (str): Directory to save the sweep results.
+        - progression_thresholds, regression_thresholds, change_thresholds (list): Factors
+        of the baseline volume.
+        - thresholds (tuple): Configured progression, regression and change thresholds,
+        the sweep is checked against calculate_progression_data at them.
+        - time_period_mapping (dict): Numeric value of every time period.
+        """
+        print("Step 1: Sweeping the classification thresholds:")
+        self.data.sort_values(by=["Patient_ID", "Age"], inplace=True)
+        check_sweep(self.data, *thresholds, time_period_mapping)
+        grid = threshold_grid(progression_thresholds, regression_thresholds, change_thresholds)
+        results = sweep_thresholds(self.data, grid)
+        summary = sweep_summary(results)
+
+        dir_name = os.path.join(output_dir, "threshold_sweep")
+        os.makedirs(dir_name, exist_ok=True)
+        results_file = os.path.join(dir_name, f"{self.cohort}_threshold_sweep_patients.parquet")
+        summary_file = os.path.join(dir_name, f"{self.cohort}_threshold_sweep_summary.csv")
+        results.to_parquet(results_file, index=False)
+        summary.to_csv(summary_file, index=False)
+        print(
+            f"\tClassified {self.data['Patient_ID'].nunique()} patients for {len(grid)} threshold"
+            f" combinations, saved to {results_file} and {summary_file}."
+        )
+        return summary
+
     def classification_analysis(self, data, output_dir, column_name="Normalized Volume"):
         """
         Classify patients based on their tumor growth trajectories
         into progressors, stable or regressors.
         """
         print("Step 1: Starting Classification Analysis:")
-        patients_ids = data["Patient_ID"].unique()
-        patient_classifications_volumetric = {
-            patient_id: classify_patient_volumetric(
-                data,
-                patient_id,
-            )
-            for patient_id in patients_ids
-        }
-        patient_classifications_composite = {
-            patient_id: classify_patient_composite(
-                data,
-                patient_id,
-            )
-            for patient_id in patients_ids
-        }
-        
-        data["Classification Volumetric"] = data["Patient_ID"].map(patient_classifications_volumetric)
-        data["Classification Composite"] = data["Patient_ID"].map(patient_classifications_composite)
+        classifications = classify_patients(data)
+        volumetric = classifications["Patient Classification Volumetric"]
+        composite = classifications["Patient Classification Composite"]
+        binary_volumetric = classifications["Patient Classification Binary Volumetric"]
+        binary_composite = classifications["Patient Classification Binary Composite"]
 
         # Add classifications to the data DataFrame
-        data["Classification Volumetric"] = data["Patient_ID"].map(patient_classifications_volumetric)
-        data["Classification Composite"] = data["Patient_ID"].map(patient_classifications_composite)
-        
-        # Create binary classifications
-        data["Patient Classification Binary Volumetric"] = (
-            data["Classification Volumetric"].apply(lambda x: 1 if x == "Progressor" else 0)
-        )
-        data["Patient Classification Binary Composite"] = (
-            data["Classification Composite"].apply(lambda x: 1 if x == "Progressor" else 0)
-        )
+        data["Classification Volumetric"] = data["Patient_ID"].map(volumetric)
+        data["Classification Composite"] = data["Patient_ID"].map(composite)
+        data["Patient Classification Binary Volumetric"] = data["Patient_ID"].map(binary_volumetric)
+        data["Patient Classification Binary Composite"] = data["Patient_ID"].map(binary_composite)
         
         # Save classifications to self.data
         self.data["Patient Classification Volumetric"] = (
-            self.data["Patient_ID"].map(patient_classifications_volumetric).astype("category")
+            self.data["Patient_ID"].map(volumetric).astype("category")
         )
         self.data["Patient Classification Composite"] = (
-            self.data["Patient_ID"].map(patient_classifications_composite).astype("category")
-        )
-        self.data["Patient Classification Binary Volumetric"] = (
-            self.data["Patient_ID"].map(data.groupby("Patient_ID")["Patient Classification Binary Volumetric"].first())
-        )
-        self.data["Patient Classification Binary Composite"] = (
-            self.data["Patient_ID"].map(data.groupby("Patient_ID")["Patient Classification Binary Composite"].first())
+            self.data["Patient_ID"].map(composite).astype("category")
         )
+        self.data["Patient Classification Binary Volumetric"] = self.data["Patient_ID"].map(binary_volumetric)
+        self.data["Patient Classification Binary Composite"] = self.data["Patient_ID"].map(binary_composite)
         # Plots
         dir_name = os.path.join(output_dir, "classification")
         os.makedirs(dir_name, exist_ok=True)
@@ -221,6 +232,36 @@ class TrajectoryClassification:
         self.plot_classification_bars(data, dir_name)
         print("\tSaved classification bars plot.")
 
+    def change_point_analysis(self):
+        """
+        Relate the change points detected in the volume estimation stage to the
+        classifications. Adds the per-patient columns 'Patient Change Points' and
+        'Age at First Change Point'.
+        """
+        if "Change Point" not in self.data.columns:
+            print("\tNo change point columns in the cohort data, skipping.")
+            return
+        print("Step 2: Change Point Analysis:")
+        change_points = self.data["Change Point"].eq(True)
+        self.data["Patient Change Points"] = change_points.groupby(
+            self.data["Patient_ID"]
+        ).transform("sum")
+        first_change_age = self.data.loc[change_points].groupby("Patient_ID")["Age"].min()
+        self.data["Age at First Change Point"] = self.data["Patient_ID"].map(
+            first_change_age
+        )
+        unique_pat = self.data.drop_duplicates(subset=["Patient_ID"])
+        for classification in [
+            "Patient Classification Volumetric",
+            "Patient Classification Composite",
+        ]:
+            if classification in unique_pat.columns:
+                print(
+                    unique_pat.groupby(classification, observed=True)[
+                        "Patient Change Points"
+                    ].describe()
+                )
+
     ############################## Plotting Functions ##############################
     
     def plot_individual_trajectories(self, name, plot_data, column, category_column=None, unit=None, time_limit=4000, median_freq=273
@@ -680,11 +721,22 @@ if __name__ == "__main__":
     
     os.makedirs(output_dir, exist_ok=True)
     traj = TrajectoryClassification(path_to_data, variables, cohort, sample_size)
-    traj.trajectories(output_dir)
-    traj.get_progression_data(progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping)
-    traj.classification_analysis(traj.data, output_dir)
-    plot_histo_distributions(traj.data, output_dir, list_time_periods, age_groups, endpoint="volumetric")
-    plot_histo_distributions(traj.data, output_dir, list_time_periods, age_groups, endpoint="composite")
-    save_dataframe(traj.data, output_dir, f"{cohort}_trajectories")
-    traj.visualize_time_gap(traj.data, output_dir)
+    if trajectories_cfg.THRESHOLD_SWEEP:
+        traj.threshold_sweep(
+            output_dir,
+            trajectories_cfg.SWEEP_PROGRESSION_THRESHOLDS,
+            trajectories_cfg.SWEEP_REGRESSION_THRESHOLDS,
+            trajectories_cfg.SWEEP_CHANGE_THRESHOLDS,
+            (progression_threshold, regression_threshold, volume_change_threshold),
+            time_period_mapping,
+        )
+    else:
+        traj.trajectories(output_dir)
+        traj.get_progression_data(progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping)
+        traj.classification_analysis(traj.data, output_dir)
+        traj.change_point_analysis()
+        plot_histo_distributions(traj.data, output_dir, list_time_periods, age_groups, endpoint="volumetric")
+        plot_histo_distributions(traj.data, output_dir, list_time_periods, age_groups, endpoint="composite")
+        save_dataframe(traj.data, output_dir, f"{cohort}_trajectories")
+        traj.visualize_time_gap(traj.data, output_dir)
 # %%
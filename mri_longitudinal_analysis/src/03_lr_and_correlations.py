@@ -9,6 +9,7 @@ import pandas as pd
 import statsmodels.api as sm
 import seaborn as sns
 from utils.helper_functions import logistic_regression_analysis,calculate_vif, check_assumptions
+from utils.cohort_artifact import read_cohort
 from scipy import stats
 
 from cfg.src import lr_and_correlations_cfg
@@ -796,7 +797,7 @@ if __name__ == '__main__':
     lr_combinations = lr_and_correlations_cfg.LR_COMBINATIONS
     
     # Load the data
-    cohort_data = pd.read_csv(data_path)
+    cohort_data = read_cohort(data_path)
     # Initialize the logistics regression analysis
     lr = LogisticRegressionAnalysis(cohort_data, cohort, output_dir)
     lr.lr_analysis(output_dir, lr_vars, lr_combinations, outcome_var, categorical_vars)
@@ -14,13 +14,14 @@ from lifelines.statistics import logrank_test
 from lifelines.utils import concordance_index
 from lifelines.plotting import remove_ticks, remove_spines, move_spines # add_at_risk_counts ; just in case default should be used
 from itertools import combinations
+from utils.cohort_artifact import read_cohort
 from utils.helper_functions import calculate_vif
 from sklearn.preprocessing import StandardScaler
 
 
 class Time2Event:
     def __init__(self, data_path):
-        self.data = pd.read_csv(data_path)
+        self.data = read_cohort(data_path)
         self.ref_cats = {}
     
     def time_to_event_analysis(self, prefix, output_dir, variables, duration_col, event_col, stratify_by=None, progression_type="composite"):
@@ -376,9 +377,11 @@ class Time2Event:
                 continuous_columns.append(col)
         
         for var in categorical_columns:
-            ref_cat = analysis_data[var].mode()[0]
-            self.ref_cats[var] = ref_cat
-            analysis_data[var] = analysis_data[var].astype('category')
+            # categories of the values present, sorted as read from the CSV, so the ordered
+            # categoricals of the cohort artifact keep the same reference category
+            analysis_data[var] = analysis_data[var].astype(object).astype('category')
+            # drop_first drops the first category, the reference of the hazard ratios
+            self.ref_cats[var] = analysis_data[var].cat.categories[0]
             dummies = pd.get_dummies(analysis_data[var], prefix=var, drop_first=True)
             analysis_data = pd.concat([analysis_data, dummies], axis=1)
             analysis_data.drop(var, axis=1, inplace=True)
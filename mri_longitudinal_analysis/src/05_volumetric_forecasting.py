@@ -10,6 +10,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from cfg.src import arima_cfg
+from utils.time_series_store import (
+    is_time_series_store,
+    list_store_patients,
+    read_time_series_store,
+)
 from pandas.plotting import autocorrelation_plot
 from pmdarima import auto_arima
 from scipy.interpolate import Akima1DInterpolator  # , PchipInterpolator, CubicSpline
@@ -21,13 +26,41 @@ from statsmodels.tsa.stattools import acf, adfuller, pacf
 class TimeSeriesDataHandler:
     """Loads time-series data and processes it for the prediction."""
 
-    def __init__(self, directory, loading_limit):
+    def __init__(self, directory, loading_limit, method=None, columns=None):
         self.directory = directory
         self.loading_limit = loading_limit
+        self.method = method
+        self.columns = columns
+
+    def load_store(self):
+        """
+        Loads the time series of the first `loading_limit` patients from the Parquet
+        dataset, reading only the selected method and columns.
+
+        Returns:
+        - tuple: A list of DataFrames (one per patient) and their names.
+        """
+        patient_ids = list_store_patients(self.directory, self.method)
+        if self.loading_limit:
+            patient_ids = patient_ids[: self.loading_limit]
+        data = read_time_series_store(
+            self.directory, self.method, self.columns, patient_ids
+        )
+        time_series_list = []
+        file_names = []
+        for (patient_id, method), ts_data in data.groupby(
+            ["Patient_ID", "method"], sort=False, observed=True
+        ):
+            time_series_list.append(
+                ts_data.drop(columns=["Patient_ID", "method"]).reset_index(drop=True)
+            )
+            file_names.append(f"{patient_id}_{method}")
+        return time_series_list, file_names
 
     def load_data(self):
         """
-        Loads time series data either from a directory or from a specified file.
+        Loads time series data either from a directory, the Parquet time series dataset
+        or from a specified file.
 
         Returns:
         - list: A list of loaded time series data as DataFrames.
@@ -35,6 +68,9 @@ class TimeSeriesDataHandler:
         time_series_list = []
         file_names = []
         try:
+            if is_time_series_store(self.directory):
+                print("\tLoading data...")
+                return self.load_store()
             if os.path.isdir(self.directory):
                 print("\tLoading data...")
                 for idx, filename in enumerate(os.listdir(self.directory)):
@@ -1058,7 +1094,10 @@ if __name__ == "__main__":
 
     print("Starting ARIMA:")
     ts_handler = TimeSeriesDataHandler(
-        arima_cfg.TIME_SERIES_DIR_COHORT, arima_cfg.LOADING_LIMIT
+        arima_cfg.TIME_SERIES_DIR_COHORT,
+        arima_cfg.LOADING_LIMIT,
+        arima_cfg.TIME_SERIES_METHOD,
+        arima_cfg.TIME_SERIES_COLUMNS,
     )
     ts_data_list, filenames = ts_handler.load_data()
     print("\tData loaded!")
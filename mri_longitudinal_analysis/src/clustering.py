@@ -50,6 +50,11 @@ from tslearn.clustering import TimeSeriesKMeans
 from tslearn.preprocessing import TimeSeriesScalerMeanVariance
 
 from cfg.src import clustering_cfg
+from utils.time_series_store import (
+    is_time_series_store,
+    list_store_patients,
+    read_time_series_store,
+)
 
 
 class ClusterAnalysis:
@@ -101,8 +106,11 @@ class ClusterAnalysis:
     #####################
     def load_data(self, path, selected_features, limit):
         """
-        Loads the data from a directory with CSV files and returns a list of DataFrames.
+        Loads the data from a directory with CSV files (or from the Parquet time series
+        dataset) and returns a list of DataFrames.
         """
+        if is_time_series_store(path):
+            return self.load_store(path, selected_features, limit)
         dfs = []
         files_processed = 0
         for file in os.listdir(path):
@@ -123,6 +131,26 @@ class ClusterAnalysis:
                 files_processed += 1
         return dfs
 
+    @staticmethod
+    def load_store(path, selected_features, limit, method=clustering_cfg.TIME_SERIES_METHOD):
+        """
+        Loads the selected features of the first `limit` patients from the Parquet
+        dataset, only reading those columns and patients.
+        """
+        patient_ids = list_store_patients(path, method)
+        if limit is not None:
+            patient_ids = patient_ids[:limit]
+        data = read_time_series_store(path, method, selected_features, patient_ids)
+        selected_features = [
+            feature for feature in selected_features if feature in data.columns
+        ]
+        dfs = []
+        for patient_id, df in data.groupby("Patient_ID", sort=False, observed=True):
+            df_selected = df[selected_features].fillna(0.0).reset_index(drop=True)
+            df_selected.loc[:, "Patient_ID"] = f"{patient_id}_{method}"
+            dfs.append(df_selected)
+        return dfs
+
     def standardize_data(self, dfs):
         """
         Standardizes numerical data in the dataframe while preserving non-numeric columns.
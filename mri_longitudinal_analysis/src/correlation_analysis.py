@@ -13,7 +13,7 @@ import pandas as pd
 import seaborn as sns
 import numpy as np
 import statsmodels.api as sm
-from scipy.stats import shapiro, ttest_ind, chi2_contingency, mannwhitneyu, fisher_exact, levene
+from scipy.stats import shapiro, levene
 from cfg.src import correlation_cfg
 from cfg.utils.helper_functions_cfg import NORD_PALETTE
 from lifelines import KaplanMeierFitter, CoxPHFitter
@@ -38,10 +38,9 @@ from utils.helper_functions import (
     fdr_correction,
     visualize_fdr_correction,
     save_for_deep_learning,
-    categorize_age_group,
+    categorize_age_groups,
     # calculate_group_norms_and_stability,
-    classify_patient_volumetric,
-    classify_patient_composite,
+    classify_patients,
     plot_classification_trajectories,
     plot_individual_trajectories,
     #calculate_percentage_change,
@@ -58,9 +57,40 @@ from utils.helper_functions import (
     visualize_ind_indexes_distrib,
     visualize_volume_change, 
     #grid_search_weights,
-    categorize_time_since_first_diagnosis,
+    categorize_times_since_first_diagnosis,
     plot_histo_distributions
 )
+from utils.cohort_statistics import (
+    categorical,
+    cohort_comparison_table,
+    continuous,
+    describe,
+    summary_lines,
+    write_table,
+)
+from utils.treatment_info import bch_treatment_types, cbtn_treatment_info
+
+# Variables of the summary statistics, continuous ones per scan and categorical
+# ones per patient
+SUMMARY_VARIABLES = [
+    continuous("Age", unit="days"),
+    continuous("Days Between Scans", unit="days", nonzero=True),
+    categorical("Received Treatment"),
+    categorical("Symptoms"),
+    categorical("Histology"),
+    categorical("Location"),
+    categorical("Sex"),
+    categorical("Patient Classification Volumetric"),
+    categorical("Patient Classification Composite"),
+    categorical("Treatment Type"),
+    categorical("BRAF Status"),
+    continuous("Volume Change", unit="%", nonzero=True),
+    continuous("Volume Change Rate", unit="%/day", nonzero=True),
+    continuous("Normalized Volume", unit="mm^3"),
+    continuous("Volume", scale=1000, unit="cm^3"),
+    continuous("Baseline Volume", scale=1000, unit="cm^3"),
+    continuous("Follow-Up Time", scale=365.25, unit="years"),
+]
 
 
 class TumorAnalysis:
@@ -482,108 +512,28 @@ class TumorAnalysis:
     def extract_treatment_types_bch(self):
         """
         Extract treatment types from the clinical data based on whether surgical resection,
-        systemic therapy, or radiation was part of the initial treatment.
+        systemic therapy, or radiation was part of the initial treatment
+        (see utils.treatment_info).
 
         Returns:
-        - treatment_list (list): A list of treatment types derived from the clinical data.
+        - treatment_types (pd.Series): The treatment type of every row of the clinical data.
 
         This function is called within the `load_clinical_data` method.
         """
-        treatment_list = []
-        for _, row in self.clinical_data.iterrows():
-            treatments = []
-
-            if row["Surgical Resection"] == "Yes":
-                treatments.append("Surgery")
-
-            if row["Systemic therapy before radiation"] == "Yes":
-                treatments.append("Chemotherapy")
-
-            if row["Radiation as part of initial treatment"] == "Yes":
-                treatments.append("Radiation")
-
-            treatment_type = ", ".join(treatments) if treatments else "No Treatment"
-            if treatment_type == "Surgery, Chemotherapy, Radiation":
-                treatment_type = "All Treatments"
-            treatment_list.append(treatment_type)
-
-        return treatment_list
+        return bch_treatment_types(self.clinical_data)
 
     def extract_treatment_info_cbtn(self):
         """
-        Extracts treatment information for CBTN data.
+        Extracts treatment information for CBTN data (see utils.treatment_info).
 
         Updates self.clinical_data with the columns:
         [Age at First Diagnosis, Treatment Type,
         Received Treatment, Age at First Treatment]
+        and caps the Age at Last Clinical Follow-Up at the Age at First Treatment.
         """
-
-        # Extract the first age recorded in volumes data for each patient
-        min_ages = self.volumes_data.groupby('Patient_ID')['Age'].min().reset_index()
-        min_ages.columns = ['Patient_ID', 'First Age']
-        
-        # Initialize new columns in clinical_data
-        self.clinical_data["Age at First Diagnosis"] = None
-        self.clinical_data["Treatment Type"] = None
-        self.clinical_data["Received Treatment"] = None
-        self.clinical_data["Age at First Treatment"] = None
-        # Loop through each patient in clinical_data
-        for idx, row in self.clinical_data.iterrows():
-            patient_id = str(row["CBTN Subject ID"])
-            surgery = row["Surgery"]
-            chemotherapy = row["Chemotherapy"]
-            radiation = row["Radiation"]
-            age_at_first_treatment = row["Age at Treatment"]
-            age_at_first_diagnosis = row["Age at Diagnosis"]
-            
-
-            if patient_id in min_ages['Patient_ID'].values:
-                first_age = min_ages[min_ages["Patient_ID"] == patient_id]["First Age"].values[0]
-            else:
-                continue
-            
-            # Age at First Diagnosis
-            if np.isnan(age_at_first_diagnosis) or age_at_first_diagnosis > first_age:
-                age_at_first_diagnosis = int(first_age)
-                
-            self.clinical_data.at[
-                idx, "Age at First Diagnosis"
-            ] = age_at_first_diagnosis
-
-            # Age at First Treatment
-            if np.isnan(age_at_first_treatment):
-                age_at_first_treatment = self.clinical_data.at[idx, "Age at Last Clinical Follow-Up"]
-            self.clinical_data.at[idx, "Age at First Treatment"] = age_at_first_treatment
-            
-            # Treatment Type
-            treatments = []
-            if surgery == "Yes":
-                treatments.append("Surgery")
-            if chemotherapy == "Yes":
-                treatments.append("Chemotherapy")
-            if radiation == "Yes":
-                treatments.append("Radiation")
-            treatment_type = ", ".join(treatments) if treatments else "No Treatment"
-
-            if treatment_type != "Surgery, Chemotherapy, Radiation":
-                self.clinical_data.at[idx, "Treatment Type"] = treatment_type
-            else:
-                self.clinical_data.at[idx, "Treatment Type"] = "All Treatments"
-
-            # Received Treatment
-            received_treatment = "Yes" if treatments else "No"
-            self.clinical_data.at[idx, "Received Treatment"] = received_treatment
-
-                
-        self.clinical_data["Age at First Diagnosis"] = pd.to_numeric(
-            self.clinical_data["Age at First Diagnosis"], errors="coerce"
-        )
-        self.clinical_data["Age at First Treatment"].fillna(self.clinical_data["Age at Last Clinical Follow-Up"], inplace=True)               
-        self.clinical_data["Age at Last Clinical Follow-Up"] = np.minimum(
-            pd.to_numeric(
-                self.clinical_data["Age at Last Clinical Follow-Up"], errors="coerce"
-            ),
-            self.clinical_data["Age at First Treatment"],
+        treatment_info = cbtn_treatment_info(self.clinical_data, self.volumes_data)
+        self.clinical_data = self.clinical_data.assign(
+            **{column: treatment_info[column] for column in treatment_info.columns}
         )
 
     def merge_data(self):
@@ -606,11 +556,9 @@ class TumorAnalysis:
                 on=["Patient_ID"],
                 how="right",
             )
-            self.merged_data["Follow-Up Time"] = self.merged_data.apply(
-                lambda row: row["Follow-Up Time"]
-                if row["Dataset"] == "DF/BCH"
-                else row["Volumes Follow-Up Time"],
-                axis=1,
+            self.merged_data["Follow-Up Time"] = self.merged_data["Follow-Up Time"].where(
+                self.merged_data["Dataset"] == "DF/BCH",
+                self.merged_data["Volumes Follow-Up Time"],
             )
 
             self.merged_data = self.merged_data.drop(
@@ -635,10 +583,10 @@ class TumorAnalysis:
                 self.merged_data["Follow-Up Time"] = self.merged_data["Volumes Follow-Up Time"]
                 self.merged_data = self.merged_data.drop(columns=["Volumes Follow-Up Time"])
         
-        self.merged_data["Age Group"] = self.merged_data.apply( lambda x: categorize_age_group(x, column="Age"), axis=1).astype("category")
-        self.merged_data["Age Group at Diagnosis"] = self.merged_data.apply(lambda x: categorize_age_group(x, column="Age at First Diagnosis"), axis=1).astype("category")
+        self.merged_data["Age Group"] = categorize_age_groups(self.merged_data, column="Age")
+        self.merged_data["Age Group at Diagnosis"] = categorize_age_groups(self.merged_data, column="Age at First Diagnosis")
         self.merged_data['Age at First Diagnosis (Years)'] = self.merged_data['Age at First Diagnosis'] / 365.25
-        self.merged_data["Time Period Since Diagnosis"] = self.merged_data.apply(categorize_time_since_first_diagnosis, axis=1).astype("category")
+        self.merged_data["Time Period Since Diagnosis"] = categorize_times_since_first_diagnosis(self.merged_data)
         self.merged_data["Baseline Volume cm3"] = self.merged_data["Baseline Volume"] / 1000
         self.merged_data["Change Speed"] = self.merged_data["Change Speed"].astype(
             "category"
@@ -1701,45 +1649,24 @@ class TumorAnalysis:
         into progressors, stable or regressors.
         """
         print("\tStarting Classification Analysis:")
-        patients_ids = data["Patient_ID"].unique()
-        patient_classifications_volumetric = {
-            patient_id: classify_patient_volumetric(
-                data,
-                patient_id,
-            )
-            for patient_id in patients_ids
-        }
-        patient_classifications_composite = {
-            patient_id: classify_patient_composite(
-                data,
-                patient_id,
-            )
-            for patient_id in patients_ids
-        }
+        classifications = classify_patients(data)
         
-        data["Classification Volumetric"] = data["Patient_ID"].map(patient_classifications_volumetric)
-        data["Classification Composite"] = data["Patient_ID"].map(patient_classifications_composite)
+        data["Classification Volumetric"] = data["Patient_ID"].map(classifications["Patient Classification Volumetric"])
+        data["Classification Composite"] = data["Patient_ID"].map(classifications["Patient Classification Composite"])
 
         # Transform and save to original dataframe        
-        data["Patient Classification Binary Volumetric"] = (
-            pd.to_numeric(
-                data["Classification Volumetric"].apply(lambda x: 1 if x == "Progressor" else 0),
-                errors="coerce",
-            )
-            .fillna(0)
-            .astype(int)
+        data["Patient Classification Binary Volumetric"] = data["Patient_ID"].map(
+            classifications["Patient Classification Binary Volumetric"]
         )
-        classifications_series_volumetric = pd.Series(patient_classifications_volumetric)
         self.merged_data["Patient Classification Volumetric"] = (
             self.merged_data["Patient_ID"]
-            .map(classifications_series_volumetric)
+            .map(classifications["Patient Classification Volumetric"])
             .astype("category")
         )
         self.merged_data["Patient Classification Binary Volumetric"] = data["Patient Classification Binary Volumetric"]
         
-        data["Patient Classification Binary Composite"] = (pd.to_numeric(data["Classification Composite"].apply(lambda x: 1 if x == "Progressor" else 0), errors="coerce").fillna(0).astype(int))
-        classifications_series_composite = pd.Series(patient_classifications_composite)
-        self.merged_data["Patient Classification Composite"] = (self.merged_data["Patient_ID"].map(classifications_series_composite).astype("category"))
+        data["Patient Classification Binary Composite"] = data["Patient_ID"].map(classifications["Patient Classification Binary Composite"])
+        self.merged_data["Patient Classification Composite"] = (self.merged_data["Patient_ID"].map(classifications["Patient Classification Composite"]).astype("category"))
         self.merged_data["Patient Classification Binary Composite"] = data["Patient Classification Binary Composite"]
 
         # Plots
@@ -1840,7 +1767,8 @@ class TumorAnalysis:
 
     def printout_stats(self, output_file_path, prefix):
         """
-        Descriptive statistics written to a file.
+        Descriptive statistics of the SUMMARY_VARIABLES written to a file, and their
+        table (see utils.cohort_statistics) to a CSV file.
 
         Parameters:
         - output_file_path (str): Path to the output path.
@@ -1848,125 +1776,17 @@ class TumorAnalysis:
         """
         filename = f"{prefix}_summary_statistics.txt"
         file_path = os.path.join(output_file_path, filename)
+        summary_table = describe(self.merged_data, SUMMARY_VARIABLES)
+        write_table(
+            summary_table, os.path.join(output_file_path, f"{prefix}_summary_statistics.csv")
+        )
         with open(file_path, "w", encoding="utf-8") as file:
 
             def write_stat(statement):
                 file.write(statement + "\n")
 
-            # Age
-            median_age = self.merged_data["Age"].median()
-            max_age = self.merged_data["Age"].max()
-            min_age = self.merged_data["Age"].min()
-            write_stat(f"\t\tMedian Age: {median_age} days")
-            write_stat(f"\t\tMaximum Age: {max_age} days")
-            write_stat(f"\t\tMinimum Age: {min_age} days")
-
-            # Days Between Scans
-            median_days_between_scans = self.merged_data["Days Between Scans"].median()
-            max_days_between_scans = self.merged_data["Days Between Scans"].max()
-            unique_days = self.merged_data["Days Between Scans"].unique()
-            next_smallest = min(day for day in unique_days if day > 0)
-
-            write_stat(f"\t\tMedian Days Between Scans: {median_days_between_scans} days")
-            write_stat(f"\t\tMaximum Days Between Scans: {max_days_between_scans} days")
-            write_stat(f"\t\tMinimum Days Between Scans: {next_smallest} days")
-
-            # Sex, Received Treatment, Symptoms, Location,
-            # Patient Classification, Treatment Type
-            copy_df = self.merged_data.copy()
-            unique_pat = copy_df.drop_duplicates(subset=["Patient_ID"])
-            counts_braf = unique_pat["BRAF Status"].value_counts()
-            counts_sex = unique_pat["Sex"].value_counts()
-            counts_received_treatment = unique_pat["Received Treatment"].value_counts()
-            counts_symptoms = unique_pat["Symptoms"].value_counts()
-            counts_histology = unique_pat["Histology"].value_counts()
-            counts_location = unique_pat["Location"].value_counts()
-            counts_patient_classification_vol = unique_pat[
-                "Patient Classification Volumetric"
-            ].value_counts()
-            counts_patient_classification_com = unique_pat[
-                "Patient Classification Composite"
-            ].value_counts()
-            counts_treatment_type = unique_pat["Treatment Type"].value_counts()
-            
-
-            write_stat(f"\t\tReceived Treatment: {counts_received_treatment}")
-            write_stat(f"\t\tSymptoms: {counts_symptoms}")
-            write_stat(f"\t\tHistology: {counts_histology}")
-            write_stat(f"\t\tLocation: {counts_location}")
-            write_stat(f"\t\tSex: {counts_sex}")
-            write_stat(f"\t\tPatient Classification Volumetric: {counts_patient_classification_vol}")
-            write_stat(f"\t\tPatient Classification Composite: {counts_patient_classification_com}")
-            write_stat(f"\t\tTreatment Type: {counts_treatment_type}")
-            write_stat(f"\t\tBRAF Status: {counts_braf}")
-
-            # Volume Change
-            filtered_data = self.merged_data[self.merged_data["Volume Change"] != 0]
-            median_volume_change = filtered_data["Volume Change"].median()
-            max_volume_change = filtered_data["Volume Change"].max()
-            min_volume_change = filtered_data["Volume Change"].min()
-            write_stat(f"\t\tMedian Volume Change: {median_volume_change} %")
-            write_stat(f"\t\tMaximum Volume Change: {max_volume_change} %")
-            write_stat(f"\t\tMinimum Volume Change: {min_volume_change} %")
-
-            # Volume Change Rate
-            filtered_data = self.merged_data[
-                self.merged_data["Volume Change Rate"] != 0
-            ]
-            median_volume_change_rate = filtered_data["Volume Change Rate"].median()
-            max_volume_change_rate = filtered_data["Volume Change Rate"].max()
-            min_volume_change_rate = filtered_data["Volume Change Rate"].min()
-            write_stat(
-                f"\t\tMedian Volume Change Rate: {median_volume_change_rate} %/day"
-            )
-            write_stat(
-                f"\t\tMaximum Volume Change Rate: {max_volume_change_rate} %/day"
-            )
-            write_stat(
-                f"\t\tMinimum Volume Change Rate: {min_volume_change_rate} %/day"
-            )
-
-            # Normalized Volume
-            median_normalized_volume = self.merged_data["Normalized Volume"].median()
-            max_normalized_volume = self.merged_data["Normalized Volume"].max()
-            min_normalized_volume = self.merged_data["Normalized Volume"].min()
-            write_stat(f"\t\tMedian Normalized Volume: {median_normalized_volume} mm^3")
-            write_stat(f"\t\tMaximum Normalized Volume: {max_normalized_volume} mm^3")
-            write_stat(f"\t\tMinimum Normalized Volume: {min_normalized_volume} mm^3")
-
-            # Volume
-            mm3_to_cm3 = 1000
-            median_volume = self.merged_data["Volume"].median()
-            max_volume = self.merged_data["Volume"].max()
-            min_volume = self.merged_data["Volume"].min()
-            write_stat(f"\t\tMedian Volume: {median_volume / mm3_to_cm3} cm^3")
-            write_stat(f"\t\tMaximum Volume: {max_volume / mm3_to_cm3} cm^3")
-            write_stat(f"\t\tMinimum Volume: {min_volume / mm3_to_cm3} cm^3")
-
-            # Baseline volume
-            median_baseline_volume = self.merged_data["Baseline Volume"].median()
-            max_baseline_volume = self.merged_data["Baseline Volume"].max()
-            min_baseline_volume = self.merged_data["Baseline Volume"].min()
-            write_stat(
-                f"\t\tMedian Baseline Volume: {median_baseline_volume / mm3_to_cm3} cm^3"
-            )
-            write_stat(
-                f"\t\tMaximum Baseline Volume: {max_baseline_volume / mm3_to_cm3} cm^3"
-            )
-            write_stat(
-                f"\t\tMinimum Baseline Volume: {min_baseline_volume / mm3_to_cm3} cm^3"
-            )
-
-            # Follow-Up time
-            median_follow_up = self.merged_data["Follow-Up Time"].median()
-            max_follow_up = self.merged_data["Follow-Up Time"].max()
-            min_follow_up = self.merged_data["Follow-Up Time"].min()
-            median_follow_up_y = median_follow_up / 365.25
-            max_follow_up_y = max_follow_up / 365.25
-            min_follow_up_y = min_follow_up / 365.25
-            write_stat(f"\t\tMedian Follow-Up Time: {median_follow_up_y:.2f} years")
-            write_stat(f"\t\tMaximum Follow-Up Time: {max_follow_up_y:.2f} years")
-            write_stat(f"\t\tMinimum Follow-Up Time: {min_follow_up_y:.2f} years")
+            for line in summary_lines(summary_table):
+                write_stat(line)
 
             # get the ids of the patients with the three highest normalized volumes that do not repeat
             top_normalized_volumes = self.merged_data.nlargest(3, "Normalized Volume")
@@ -2089,63 +1909,9 @@ class TumorAnalysis:
         """
         Create a table comparing the two cohorts based on the variables of interest.
         """
-        cohort_var = "Dataset"
-        data = self.merged_data.copy()
-        cohort_table = pd.DataFrame(
-            columns=["Variable", "Cohort 1", "Cohort 2", "P-value"]
+        return cohort_comparison_table(
+            self.merged_data, categorical_vars, continuous_vars, self.check_assumptions
         )
-        aggregated_data = data.groupby(["Patient_ID", cohort_var]).last().reset_index()
-        aggregated_data = aggregated_data.dropna(subset=continuous_vars)
-        for var in categorical_vars + continuous_vars:
-            cohort1_data = aggregated_data[
-                aggregated_data[cohort_var] == aggregated_data[cohort_var].unique()[0]
-            ]
-            cohort2_data = aggregated_data[
-                aggregated_data[cohort_var] == aggregated_data[cohort_var].unique()[1]
-            ]
-
-            if var in categorical_vars:
-                contingency_table = pd.crosstab(
-                    aggregated_data[cohort_var], aggregated_data[var]
-                )
-                if cohort1_data[var].nunique() == 2 and cohort2_data[var].nunique() == 2:
-                    _, p_val = fisher_exact(contingency_table)
-                else:
-                    _, p_val, _, _ = chi2_contingency(contingency_table)
-
-                cohort1_value = contingency_table.loc[
-                    aggregated_data[cohort_var].unique()[0]
-                ].to_dict()
-                cohort2_value = contingency_table.loc[
-                    aggregated_data[cohort_var].unique()[1]
-                ].to_dict()
-            else:
-                if len(cohort1_data) >= 30 and len(cohort2_data) >= 30:
-                    if self.check_assumptions(var, var, cohort1_data, "t-test") and self.check_assumptions(var, var, cohort2_data, "t-test"):
-                        _, p_val = ttest_ind(cohort1_data[var], cohort2_data[var])
-                    else:
-                        _, p_val = mannwhitneyu(cohort1_data[var], cohort2_data[var])
-                else:
-                    _, p_val = mannwhitneyu(cohort1_data[var], cohort2_data[var])
-
-                cohort1_value = (
-                    f"{cohort1_data[var].mean():.2f} ± {cohort1_data[var].std():.2f}"
-                )
-                cohort2_value = (
-                    f"{cohort2_data[var].mean():.2f} ± {cohort2_data[var].std():.2f}"
-                )
-
-            new_row = pd.DataFrame(
-                {
-                    "Variable": [var],
-                    "Cohort 1": [cohort1_value],
-                    "Cohort 2": [cohort2_value],
-                    "P-value": [f"{p_val:.3f}"],
-                }
-            )
-            cohort_table = pd.concat([cohort_table, new_row], ignore_index=True)
-
-        return cohort_table
 
     ##########################################
     # EFS RELATED ANALYSIS AND VISUALIZATION #
@@ -4,24 +4,34 @@ It includes functions for bias field correction, brain extraction, and registrat
 """
 import glob
 import os
-import random
 import sys
+from functools import partial
 
 import SimpleITK as sitk
 from cfg.src import preprocess_cfg
-from tqdm import tqdm
+from utils.bias_field import BiasFieldCorrector
+from utils.fused_pipeline import (
+    BiasCorrectionStage,
+    BrainExtractionStage,
+    FusedPipeline,
+    RegistrationStage,
+)
+from utils.registration_engine import RegistrationEngine
+from utils.transform_applier import TransformApplier
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 from lib.HDBET_Code.HD_BET.hd_bet import hd_bet
 
 
-def bf_correction(input_dir, output_dir):
+def bf_correction(input_dir, output_dir, bias_corrector=None):
     """
     Perform bias field correction on MRI data using SimpleITK.
 
     Args:
         input_dir (str): Path to the input directory containing MRI scans.
         output_dir (str): Path to the output directory where corrected scans will be saved.
+        bias_corrector (BiasFieldCorrector, optional): N4 settings (fast mode, saved
+            fields). Defaults to the full resolution N4 with default settings.
 
     Returns:
         None. The corrected MRI scans are saved in the specified output directory.
@@ -33,8 +43,7 @@ def bf_correction(input_dir, output_dir):
             continue
         print(id_)
         img = sitk.ReadImage(img_path, sitk.sitkFloat32)
-        img = sitk.N4BiasFieldCorrection(img)
-        id_ = img_path.split("/")[-1].split(".")[0]
+        img = (bias_corrector or BiasFieldCorrector()).correct(img, id_)
         filename = id_ + "_bf_corrected.nii.gz"
         sitk.WriteImage(img, os.path.join(output_dir, filename))
     print("bias field correction complete!")
@@ -64,9 +73,18 @@ def registration(
     temp_img,
     interp_type="linear",
     save_tfm=True,
+    workers=None,
+    threads=1,
+    ledger_file=None,
+    resume=True,
+    retry_failed=False,
+    cache_dir=None,
+    bias_corrector=None,
+    profile_file=None,
 ):
     """
-    Register MRI scans to a template using SimpleITK.
+    Register MRI scans to a template using SimpleITK, in a pool of worker processes
+    (see utils.registration_engine).
 
     Args:
         input_data (list): List of paths to MRI scans.
@@ -75,153 +93,162 @@ def registration(
         temp_img (str): Path to the template image used for registration.
         interp_type (str, optional): Interpolation type used for registration. Defaults to 'linear'.
         save_tfm (bool, optional): If True, transformation files are saved. Defaults to True.
+        workers (int, optional): Number of worker processes. Defaults to the number of
+            CPUs divided by the threads per worker.
+        threads (int, optional): SimpleITK threads per worker. Defaults to 1.
+        ledger_file (str, optional): Job ledger recording status, duration and error per
+            scan. Defaults to 'registration_ledger.sqlite' in the output directory.
+        resume (bool, optional): Skip scans that are already registered. Defaults to True.
+        retry_failed (bool, optional): With resume, run failed scans again. Defaults to False.
+        cache_dir (str, optional): Cache of the prepared template (1 mm resample and
+            pyramid levels). Defaults to 'template_cache' in the output directory.
+        bias_corrector (BiasFieldCorrector, optional): N4 settings of the bias field
+            correction before the registration. Defaults to the full resolution N4.
+        profile_file (str, optional): JSON lines file receiving the time and memory of
+            every stage per scan (see utils.preprocess_profile). Defaults to None.
 
     Returns:
         Registered MRI scans and transformations are saved in the specified directories.
     """
     print("Registering test data...")
+    engine = RegistrationEngine(
+        template_path=temp_img,
+        output_dir=output_dir,
+        nnunet_dir=nnunet_dir,
+        ledger_file=ledger_file
+        or os.path.join(output_dir, "registration_ledger.sqlite"),
+        workers=workers,
+        threads=threads,
+        interp_type=interp_type,
+        save_tfm=save_tfm,
+        cache_dir=cache_dir,
+        bias_corrector=bias_corrector,
+        profile_file=profile_file,
+    )
+    summary = engine.run(input_data, resume=resume, retry_failed=retry_failed)
+    print("Registered", summary.get("done", 0), "scans.")
+    print("Problematic IDs:", [failure[0] for failure in engine.ledger.failures()])
+
+
+def apply_transforms(
+    input_data,
+    output_dir,
+    transform_dir,
+    temp_img,
+    interp_type="linear",
+    workers=None,
+    threads=1,
+    cache_dir=None,
+):
+    """
+    Resample images and labels onto the template grid with the transforms saved by
+    the registration, without registering them again (see utils.transform_applier).
 
-    fixed_img = sitk.ReadImage(temp_img, sitk.sitkFloat32)
-    problematic_ids = []
-    processed_files = get_processed_files(
-        output_dir
-    )  # Get list of already processed files
-
-    random.shuffle(input_data)
-    count = 0
-    for _, img_path in enumerate(tqdm(input_data)):
-        id_ = os.path.basename(img_path)  # Get filename from the full path
-        id_ = id_.replace(".nii.gz", "")
-        if id_ in processed_files:
-            print(f"Skipping already processed file: {id_}")
-            continue
-
-        try:
-            moving_img = sitk.ReadImage(img_path, sitk.sitkFloat32)
-            # print('moving image:', moving_image.shape)
-
-            # bias filed correction
-            moving_img = sitk.N4BiasFieldCorrection(moving_img)
-
-            # respace fixed img on z-direction
-            # z_spacing = moving_img.GetSpacing()[2]
-            old_size = fixed_img.GetSize()
-            old_spacing = fixed_img.GetSpacing()
-            new_spacing = (
-                1,
-                1,
-                1,
-            )  # CHANGED FROM ORIGINAL WHERE Z_SPACING WAS MAINTAINED
-            new_size = [
-                int(round((old_size[0] * old_spacing[0]) / float(new_spacing[0]))),
-                int(round((old_size[1] * old_spacing[1]) / float(new_spacing[1]))),
-                int(round((old_size[2] * old_spacing[2]) / float(new_spacing[2]))),
-            ]
-            # new_size =
-            # [old_size[0], old_size[1], int(round((old_size[2] * 1) / float(z_spacing)))]
-            # new_size = [old_size[0], old_size[1], old_size[2]]
-            if interp_type == "linear":
-                interp_type = sitk.sitkLinear
-            elif interp_type == "bspline":
-                interp_type = sitk.sitkBSpline
-            elif interp_type == "nearest_neighbor":
-                interp_type = sitk.sitkNearestNeighbor
-            resample = sitk.ResampleImageFilter()
-            resample.SetOutputSpacing(new_spacing)
-            resample.SetSize(new_size)
-            resample.SetOutputOrigin(fixed_img.GetOrigin())
-            resample.SetOutputDirection(fixed_img.GetDirection())
-            resample.SetInterpolator(interp_type)
-            resample.SetDefaultPixelValue(fixed_img.GetPixelIDValue())
-            resample.SetOutputPixelType(sitk.sitkFloat32)
-            fixed_img = resample.Execute(fixed_img)
-            # print(fixed_img.shape)
-            transform = sitk.CenteredTransformInitializer(
-                fixed_img,
-                moving_img,
-                sitk.Euler3DTransform(),
-                sitk.CenteredTransformInitializerFilter.GEOMETRY,
-            )
-            # multi-resolution rigid registration using Mutual Information
-            registration_method = sitk.ImageRegistrationMethod()
-            registration_method.SetMetricAsMattesMutualInformation(
-                numberOfHistogramBins=50
-            )
-            registration_method.SetMetricSamplingStrategy(registration_method.RANDOM)
-            registration_method.SetMetricSamplingPercentage(0.01)
-            registration_method.SetInterpolator(sitk.sitkLinear)
-            registration_method.SetOptimizerAsGradientDescent(
-                learningRate=1.0,
-                numberOfIterations=100,
-                convergenceMinimumValue=1e-6,
-                convergenceWindowSize=10,
-            )
-            registration_method.SetOptimizerScalesFromPhysicalShift()
-            registration_method.SetShrinkFactorsPerLevel(shrinkFactors=[4, 2, 1])
-            registration_method.SetSmoothingSigmasPerLevel(smoothingSigmas=[2, 1, 0])
-            registration_method.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
-            registration_method.SetInitialTransform(transform)
-            final_transform = registration_method.Execute(fixed_img, moving_img)
-
-            ## WRITE MODIFIED SCAN
-            moving_img_resampled = sitk.Resample(
-                moving_img,
-                fixed_img,
-                final_transform,
-                sitk.sitkLinear,
-                0.0,
-                moving_img.GetPixelID(),
-            )
+    Args:
+        input_data (list): Paths to the images and labels, named '<id>.nii.gz' or
+            '<id>_<suffix>.nii.gz' for the transform '<id>_T2.tfm'.
+        output_dir (str): Directory to save the resampled images.
+        transform_dir (str): Directory of the saved transforms.
+        temp_img (str): Path to the template image used for registration.
+        interp_type (str, optional): Interpolator of the images, labels always use the
+            nearest neighbor. Defaults to 'linear'.
+        workers (int, optional): Number of worker processes. Defaults to the number of
+            CPUs divided by the threads per worker.
+        threads (int, optional): SimpleITK threads per worker. Defaults to 1.
+        cache_dir (str, optional): Cache of the prepared template. Defaults to
+            'template_cache' in the transform directory.
 
-            # get the file names
-            filename = os.path.basename(img_path)  # Get filename from the full path
-            filename_without_ext = filename.replace(".nii.gz", "")
-            new_filename = f"{filename_without_ext}_0000.nii.gz"
-            out_path = os.path.join(output_dir, new_filename)
-            sitk.WriteImage(moving_img_resampled, out_path)
-
-            segmentation_loc = img_path.replace(".nii.gz", "_label.nii.gz")
-            if not os.path.isfile(segmentation_loc):
-                print(f"No corresponding label file for {img_path}")
-                continue
-
-            moving_label = sitk.ReadImage(segmentation_loc, sitk.sitkFloat32)
-            moving_label_resampled = sitk.Resample(
-                moving_label,
-                fixed_img,
-                final_transform,
-                sitk.sitkNearestNeighbor,
-                0.0,
-                moving_img.GetPixelID(),
-            )
-            if not os.path.exists(os.path.join(nnunet_dir, "labelsTs")):
-                os.makedirs(os.path.join(nnunet_dir, "labelsTs"))
-            sitk.WriteImage(
-                moving_label_resampled,
-                os.path.join(nnunet_dir, "labelsTs", f"{id_}" + ".nii.gz"),
-            )
+    Returns:
+        Resampled images and labels are saved in the output directory.
+    """
+    print("Applying saved transforms...")
+    applier = TransformApplier(
+        template_path=temp_img,
+        transform_dir=transform_dir,
+        output_dir=output_dir,
+        interp_type=interp_type,
+        cache_dir=cache_dir,
+        workers=workers,
+        threads=threads,
+    )
+    summary = applier.run(input_data)
+    print("Resampled", summary["done"], "images.")
+
+
+def fused_preprocessing(
+    input_data,
+    output_dir,
+    nnunet_dir,
+    temp_img,
+    registration_step=True,
+    extraction_step=True,
+    bf_correction_step=False,
+    bias_corrector=None,
+    cache_dir=None,
+    threads=1,
+    queue_size=2,
+    checkpoint_dir=None,
+    checkpoints=(),
+    resume=True,
+    profile_file=None,
+):
+    """
+    Run registration, brain extraction and bias field correction as one in-memory
+    pipeline (see utils.fused_pipeline), only the final images are written.
 
-            if save_tfm:
-                sitk.WriteTransform(
-                    final_transform, os.path.join(output_dir, f"{id_}" + "_T2.tfm")
-                )
-        except IOError as io_error:
-            print(f"Error with image {id_}: {io_error}")
-            with open("log_file.txt", "a", encoding="utf-8") as file:
-                file.write(
-                    f"Image is causing trouble: {img_path}\n Error: {io_error}\n"
-                )
-            continue
-        except RuntimeError as run_error:
-            with open("log_file.txt", "a", encoding="utf-8") as file:
-                file.write(
-                    f"Image is causing trouble: {img_path}\n Error: {run_error}\n"
-                )
-            continue
+    Args:
+        input_data (list): List of paths to MRI scans.
+        output_dir (str): Directory to save the preprocessed scans and transformations.
+        nnunet_dir (str): Directory for nnUNet segmentation outputs.
+        temp_img (str): Path to the template image used for registration.
+        registration_step (bool, optional): Register the scans. Defaults to True.
+        extraction_step (bool, optional): Extract the brain with HD-BET. Defaults to True.
+        bf_correction_step (bool, optional): Bias correct the extracted brain.
+            Defaults to False.
+        bias_corrector (BiasFieldCorrector, optional): N4 settings. Defaults to the full
+            resolution N4.
+        cache_dir (str, optional): Cache of the prepared template. Defaults to
+            'template_cache' in the output directory.
+        threads (int, optional): SimpleITK threads. Defaults to 1.
+        queue_size (int, optional): Scans waiting between two stages. Defaults to 2.
+        checkpoint_dir (str, optional): Directory of the debug checkpoints.
+        checkpoints (list, optional): Stages after which the images are saved, out of
+            'registration', 'brain_extraction' and 'bias_correction'.
+        resume (bool, optional): Skip scans that are already preprocessed. Defaults to True.
+        profile_file (str, optional): JSON lines file receiving the time and memory of
+            every stage per scan (see utils.preprocess_profile). Defaults to None.
 
-        count += 1
-    print("Registered", count, "scans.")
-    print("Problematic IDs:", problematic_ids)
+    Returns:
+        Preprocessed MRI scans and transformations are saved in the specified directories.
+    """
+    print("Preprocessing with the fused pipeline...")
+    stages = []
+    if registration_step:
+        stages.append(
+            RegistrationStage(
+                temp_img,
+                cache_dir or os.path.join(output_dir, "template_cache"),
+                bias_corrector=bias_corrector,
+            )
+        )
+    if extraction_step:
+        stages.append(
+            BrainExtractionStage(partial(hd_bet, device="0", mode="fast", tta=0))
+        )
+    if bf_correction_step:
+        stages.append(BiasCorrectionStage(bias_corrector))
+    pipeline = FusedPipeline(
+        stages,
+        output_dir,
+        nnunet_dir,
+        queue_size=queue_size,
+        checkpoint_dir=checkpoint_dir,
+        checkpoints=checkpoints,
+        threads=threads,
+        profile_file=profile_file,
+    )
+    summary = pipeline.run(input_data, resume=resume)
+    print("Preprocessed", summary["done"], "scans.")
 
 
 def get_image_files(base_dir):
@@ -249,26 +276,6 @@ def get_image_files(base_dir):
     return image_files_
 
 
-def get_processed_files(output_dir):
-    """
-    Get a list of already processed files in the output directory.
-
-    Args:
-        output_dir (str): Directory where processed files are saved.
-
-    Returns:
-        set: A set of base names of processed files.
-    """
-    processed_files = set()
-    for filename in os.listdir(output_dir):
-        if filename.endswith("_0000.nii.gz"):
-            # Extract the base name without the suffix and file extension
-            base_name = filename.replace("_0000.nii.gz", "")
-            processed_files.add(base_name)
-
-    return processed_files
-
-
 if __name__ == "__main__":
     os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
@@ -276,6 +283,8 @@ if __name__ == "__main__":
     REGISTRATION = preprocess_cfg.REGISTRATION
     EXTRACTION = preprocess_cfg.EXTRACTION
     BF_CORRECTION = preprocess_cfg.BF_CORRECTION
+    APPLY_TRANSFORMS = preprocess_cfg.APPLY_TRANSFORMS
+    FUSED_PIPELINE = preprocess_cfg.FUSED_PIPELINE
 
     input_data_dir = preprocess_cfg.INPUT_DIR
     output_path = preprocess_cfg.OUPUT_DIR
@@ -286,6 +295,13 @@ if __name__ == "__main__":
     segmentation_output_dir = preprocess_cfg.SEG_PRED_DIR
 
     image_files = get_image_files(input_data_dir)
+    n4_corrector = BiasFieldCorrector(
+        fast=preprocess_cfg.N4_FAST,
+        shrink_factor=preprocess_cfg.N4_SHRINK_FACTOR,
+        iterations=preprocess_cfg.N4_ITERATIONS,
+        convergence=preprocess_cfg.N4_CONVERGENCE,
+        field_dir=preprocess_cfg.BIAS_FIELD_DIR if preprocess_cfg.SAVE_BIAS_FIELDS else None,
+    )
 
     # create dirs
     os.makedirs(output_path, exist_ok=True)
@@ -294,16 +310,61 @@ if __name__ == "__main__":
     # os.makedirs(bf_correction_dir, exist_ok=True)
     os.makedirs(segmentation_output_dir, exist_ok=True)
 
+    if FUSED_PIPELINE:
+        fused_preprocessing(
+            input_data=image_files,
+            output_dir=preprocess_cfg.PIPELINE_OUTPUT_DIR,
+            nnunet_dir=segmentation_output_dir,
+            temp_img=preprocess_cfg.TEMP_IMG,
+            registration_step=REGISTRATION,
+            extraction_step=EXTRACTION,
+            bf_correction_step=BF_CORRECTION,
+            bias_corrector=n4_corrector,
+            cache_dir=preprocess_cfg.TEMPLATE_CACHE_DIR,
+            threads=preprocess_cfg.REGISTRATION_THREADS,
+            queue_size=preprocess_cfg.PIPELINE_QUEUE_SIZE,
+            checkpoint_dir=preprocess_cfg.PIPELINE_CHECKPOINT_DIR,
+            checkpoints=preprocess_cfg.PIPELINE_CHECKPOINTS,
+            resume=preprocess_cfg.RESUME,
+            profile_file=preprocess_cfg.PROFILE_FILE,
+        )
+        # the directory passes below are replaced by the pipeline
+        REGISTRATION = EXTRACTION = BF_CORRECTION = False
+
     if REGISTRATION:
         registration(
             input_data=image_files,
             output_dir=reg_dir,
             nnunet_dir=segmentation_output_dir,
             temp_img=preprocess_cfg.TEMP_IMG,
+            workers=preprocess_cfg.REGISTRATION_WORKERS,
+            threads=preprocess_cfg.REGISTRATION_THREADS,
+            ledger_file=preprocess_cfg.REGISTRATION_LEDGER,
+            resume=preprocess_cfg.RESUME,
+            retry_failed=preprocess_cfg.RETRY_FAILED,
+            cache_dir=preprocess_cfg.TEMPLATE_CACHE_DIR,
+            bias_corrector=n4_corrector,
+            profile_file=preprocess_cfg.PROFILE_FILE,
+        )
+
+    if APPLY_TRANSFORMS:
+        apply_transforms(
+            input_data=sorted(
+                glob.glob(str(preprocess_cfg.APPLY_TRANSFORMS_INPUT_DIR / "*.nii.gz"))
+            ),
+            output_dir=preprocess_cfg.APPLY_TRANSFORMS_OUTPUT_DIR,
+            transform_dir=reg_dir,
+            temp_img=preprocess_cfg.TEMP_IMG,
+            interp_type=preprocess_cfg.APPLY_TRANSFORMS_INTERP,
+            workers=preprocess_cfg.REGISTRATION_WORKERS,
+            threads=preprocess_cfg.REGISTRATION_THREADS,
+            cache_dir=preprocess_cfg.TEMPLATE_CACHE_DIR,
         )
 
     if EXTRACTION:
         brain_extraction(input_dir=reg_dir, output_dir=brain_dir)
 
     if BF_CORRECTION:
-        bf_correction(input_dir=brain_dir, output_dir=bf_correction_dir)
+        bf_correction(
+            input_dir=brain_dir, output_dir=bf_correction_dir, bias_corrector=n4_corrector
+        )
@@ -0,0 +1,203 @@
+"""
+Benchmark of the volume estimation (src/00_volume_estimation.py) on synthetic cohorts.
+
+For every configured scale a synthetic cohort is generated (see
+utils.synthetic_cohort) and the stages of the VolumeEstimator are timed one after
+the other: process_files (volumes, filtering and all smoothing methods), each
+smoothing method on its own, the change point detection, generate_csv and the
+plots. Every stage reports its wall time, the throughput, the peak resident set
+size of this process during the stage (see utils.preprocess_profile) and the
+largest peak resident set size of its finished worker processes so far.
+"""
+import importlib
+import os
+import resource
+import time
+
+import pandas as pd
+
+from cfg.src import volume_est_cfg
+from cfg.utils import benchmark_volume_estimation_cfg
+from utils.preprocess_profile import start_peak_rss, stop_peak_rss
+from utils.synthetic_cohort import generate_cohort
+
+
+def workers_rss_watermark_mb():
+    """
+    Largest peak resident set size of the (waited for) child processes in MB. A
+    watermark over all workers so far, not attributable to a stage.
+    """
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def configure_volume_estimation(output_dir):
+    """
+    Point all outputs of the volume estimation to the given directory and select the
+    CBTN layout of the synthetic masks without clinical data.
+    """
+    settings = {
+        "TEST_DATA": True,
+        "BCH_DATA": False,
+        "CBTN_DATA": True,
+        "JOINT_DATA": False,
+        "INCREMENTAL": False,
+        "OUTPUT_DIR": output_dir,
+        "PLOTS_DIR": output_dir / "volume_plots",
+        "CSV_DIR": output_dir / "time_series",
+        "ZERO_VOLUME_FILE": output_dir / "zero_volume_segmentations.txt",
+        "FEW_SCANS_FILE": output_dir / "few_scans_patients.txt",
+        "HIGH_VOLUME_FILE": output_dir / "high_volume_segmentations.txt",
+        "VOLUME_CACHE": benchmark_volume_estimation_cfg.VOLUME_CACHE,
+        "VOLUME_CACHE_FILE": output_dir / "volume_cache.sqlite",
+        "TIME_SERIES_STORE_DIR": output_dir / "time_series" / "time_series.parquet",
+        "INCREMENTAL_MANIFEST": output_dir / "incremental_manifest.json",
+        "CHANGE_POINT_CACHE": benchmark_volume_estimation_cfg.CHANGE_POINT_CACHE,
+        "CHANGE_POINT_CACHE_FILE": output_dir / "change_point_cache.sqlite",
+        "PLOT_MODE": benchmark_volume_estimation_cfg.PLOT_MODE,
+        "PLOT_SAMPLE_SIZE": benchmark_volume_estimation_cfg.PLOT_SAMPLE_SIZE,
+    }
+    for name, value in settings.items():
+        setattr(volume_est_cfg, name, value)
+
+
+class StageTimer:
+    """
+    Collects the wall time, throughput and memory of the benchmarked stages.
+
+    Attributes:
+        num_patients (int): Scale of the benchmarked cohort.
+        results (list): One dict per timed stage.
+    """
+
+    def __init__(self, num_patients):
+        self.num_patients = num_patients
+        self.results = []
+
+    def run(self, stage, func, num_items, unit="scans"):
+        """
+        Time a single call of func and record the stage. If num_items is callable it
+        is evaluated on the return value of func.
+        """
+        token = object()
+        per_stage = start_peak_rss(token)
+        start = time.perf_counter()
+        try:
+            result = func()
+        finally:
+            seconds = time.perf_counter() - start
+            stage_rss = stop_peak_rss(token) if per_stage else float("nan")
+        if callable(num_items):
+            num_items = num_items(result)
+        children_rss = workers_rss_watermark_mb()
+        self.results.append(
+            {
+                "Patients": self.num_patients,
+                "Stage": stage,
+                "Seconds": seconds,
+                "Items": num_items,
+                "Unit": unit,
+                "Throughput (items/s)": num_items / seconds if seconds > 0 else float("nan"),
+                "Peak RSS (MB)": stage_rss,
+                "RSS Watermark Workers (MB)": children_rss,
+            }
+        )
+        print(
+            f"\t{stage}: {seconds:.2f}s, {num_items} {unit}"
+            f" ({self.results[-1]['Throughput (items/s)']:.1f}/s), peak RSS {stage_rss:.0f} MB"
+            f" (workers watermark {children_rss:.0f} MB)"
+        )
+        return result
+
+
+def prepare_cohort(num_patients):
+    """
+    Generate (or reuse) the synthetic cohort of the given scale.
+
+    Returns:
+        tuple: (directory of the masks, number of scans).
+    """
+    cohort_dir = benchmark_volume_estimation_cfg.WORK_DIR / f"cohort_{num_patients}"
+    mask_dir = cohort_dir / "masks"
+    cohort_file = cohort_dir / "synthetic_cohort.csv"
+    if benchmark_volume_estimation_cfg.REUSE_COHORTS and os.path.isfile(cohort_file):
+        cohort = pd.read_csv(cohort_file)
+        print(f"\tReusing the synthetic cohort in {mask_dir}.")
+    else:
+        start = time.perf_counter()
+        cohort = generate_cohort(
+            mask_dir,
+            num_patients=num_patients,
+            scans_per_patient=benchmark_volume_estimation_cfg.SCANS_PER_PATIENT,
+            shape=benchmark_volume_estimation_cfg.SHAPE,
+            spacing=benchmark_volume_estimation_cfg.SPACING,
+            seed=benchmark_volume_estimation_cfg.SEED,
+            workers=benchmark_volume_estimation_cfg.GENERATOR_WORKERS,
+        )
+        cohort.to_csv(cohort_file, index=False)
+        print(
+            f"\tGenerated {len(cohort)} masks in {time.perf_counter() - start:.1f}s"
+            f" to {mask_dir}."
+        )
+    return mask_dir, len(cohort)
+
+
+def benchmark_scale(num_patients):
+    """
+    Benchmark all stages of the volume estimation on a cohort of the given scale.
+
+    Returns:
+        list: One dict per stage, see StageTimer.
+    """
+    mask_dir, num_scans = prepare_cohort(num_patients)
+    configure_volume_estimation(
+        benchmark_volume_estimation_cfg.WORK_DIR / f"output_{num_patients}"
+    )
+    volume_estimation = importlib.import_module("src.00_volume_estimation")
+    estimator = volume_estimation.VolumeEstimator(mask_dir)
+
+    timer = StageTimer(num_patients)
+    timer.run("process_files", estimator.process_files, num_scans)
+    num_filtered = sum(len(scans) for scans in estimator.filtered_data.values())
+    if volume_est_cfg.POLY_SMOOTHING:
+        timer.run("polynomial_smoothing", estimator.apply_polysmoothing, num_filtered)
+    if volume_est_cfg.KERNEL_SMOOTHING:
+        timer.run("kernel_smoothing", estimator.apply_kernel_smoothing, num_filtered)
+    if volume_est_cfg.WINDOW_SMOOTHING:
+        timer.run(
+            "sliding_window_and_moving_average",
+            estimator.apply_sliding_window_interpolation,
+            num_filtered,
+        )
+    if volume_est_cfg.CHANGE_POINTS:
+        num_series = sum(len(data) for data in estimator.data_sources.values())
+        timer.run(
+            "change_points", estimator.detect_volume_change_points, num_series, "series"
+        )
+    timer.run(
+        "generate_csv",
+        lambda: estimator.generate_csv(output_folder=volume_est_cfg.CSV_DIR),
+        num_filtered,
+    )
+    timer.run(
+        "plot_volumes",
+        lambda: estimator.plot_volumes(output_path=volume_est_cfg.PLOTS_DIR),
+        lambda num_plots: num_plots,
+        "plots",
+    )
+    return timer.results
+
+
+if __name__ == "__main__":
+    os.makedirs(benchmark_volume_estimation_cfg.WORK_DIR, exist_ok=True)
+    all_results = []
+    for scale in benchmark_volume_estimation_cfg.SCALES:
+        print(f"Benchmarking the volume estimation with {scale} patients:")
+        all_results.extend(benchmark_scale(scale))
+        # keep the results of finished scales if a larger one fails
+        pd.DataFrame(all_results).to_csv(
+            benchmark_volume_estimation_cfg.RESULTS_FILE, index=False
+        )
+
+    print("Benchmark results:")
+    print(pd.DataFrame(all_results).to_string(index=False, float_format="%.2f"))
+    print(f"\tSaved results to {benchmark_volume_estimation_cfg.RESULTS_FILE}.")
@@ -0,0 +1,128 @@
+"""
+N4 bias field correction with an optional fast mode and reuse of estimated fields.
+
+The full mode runs sitk.N4BiasFieldCorrection on the image with its default
+settings. The fast mode estimates the bias field on a copy of the image shrunk by
+an integer factor, with a configurable number of iterations per fitting level
+and convergence threshold, then reconstructs the log bias field on the full
+resolution grid (the B-spline field is smooth, so little is lost) and divides the
+image by it. The log bias field of a scan can be saved next to the outputs and is
+reused by later passes over the same image instead of estimating it again.
+"""
+import os
+
+import SimpleITK as sitk
+
+
+def estimate_log_bias_field(
+    image, fast=False, shrink_factor=4, iterations=(50, 50, 30, 20), convergence=0.001
+):
+    """
+    Estimate the N4 log bias field of an image on its full resolution grid.
+
+    Args:
+        image (sitk.Image): Image to correct (float32).
+        fast (bool): Estimate on the image shrunk by shrink_factor.
+        shrink_factor (int): Shrink factor of the fast mode.
+        iterations (tuple): Maximum iterations per fitting level of the fast mode, its
+            length is the number of fitting levels.
+        convergence (float): Convergence threshold of the fast mode.
+
+    Returns:
+        sitk.Image: Log bias field with the geometry of the image.
+    """
+    corrector = sitk.N4BiasFieldCorrectionImageFilter()
+    if fast:
+        corrector.SetMaximumNumberOfIterations([int(i) for i in iterations])
+        corrector.SetConvergenceThreshold(convergence)
+        factor = [int(shrink_factor)] * image.GetDimension()
+        corrector.Execute(sitk.Shrink(image, factor))
+    else:
+        corrector.Execute(image)
+    return corrector.GetLogBiasFieldAsImage(image)
+
+
+def apply_log_bias_field(image, log_field):
+    """
+    Divide the image by the bias field.
+    """
+    return sitk.Cast(image / sitk.Exp(log_field), image.GetPixelID())
+
+
+def same_geometry(image, other):
+    """Whether two images share size, spacing, origin and direction."""
+    return (
+        image.GetSize() == other.GetSize()
+        and all(abs(a - b) < 1e-4 for a, b in zip(image.GetSpacing(), other.GetSpacing()))
+        and all(abs(a - b) < 1e-3 for a, b in zip(image.GetOrigin(), other.GetOrigin()))
+        and all(abs(a - b) < 1e-6 for a, b in zip(image.GetDirection(), other.GetDirection()))
+    )
+
+
+class BiasFieldCorrector:
+    """
+    N4 bias field correction of scans, optionally fast and with saved fields.
+
+    Attributes:
+        fast (bool): Estimate the field on a shrunk image.
+        shrink_factor (int): Shrink factor of the fast mode.
+        iterations (tuple): Maximum iterations per fitting level of the fast mode.
+        convergence (float): Convergence threshold of the fast mode.
+        field_dir (str): Directory of the saved log bias fields, None to not save them.
+    """
+
+    def __init__(
+        self,
+        fast=False,
+        shrink_factor=4,
+        iterations=(50, 50, 30, 20),
+        convergence=0.001,
+        field_dir=None,
+    ):
+        if shrink_factor < 1:
+            raise ValueError(f"The shrink factor must be at least 1, got {shrink_factor}.")
+        self.fast = fast
+        self.shrink_factor = int(shrink_factor)
+        self.iterations = tuple(iterations)
+        self.convergence = convergence
+        self.field_dir = str(field_dir) if field_dir else None
+
+    def field_path(self, id_):
+        """Path of the saved log bias field of a scan."""
+        return os.path.join(self.field_dir, f"{id_}_bias_field.nii.gz")
+
+    def load_field(self, id_, image):
+        """
+        Saved log bias field of a scan, None if there is none for the grid of the image.
+        """
+        if not self.field_dir or id_ is None or not os.path.isfile(self.field_path(id_)):
+            return None
+        log_field = sitk.ReadImage(self.field_path(id_), sitk.sitkFloat32)
+        return log_field if same_geometry(image, log_field) else None
+
+    def correct(self, image, id_=None):
+        """
+        Bias correct an image, reusing the saved field of the scan if there is one.
+
+        Args:
+            image (sitk.Image): Image to correct (float32).
+            id_ (str, optional): Scan identifier under which the field is saved.
+
+        Returns:
+            sitk.Image: Corrected image.
+        """
+        log_field = self.load_field(id_, image)
+        if log_field is not None:
+            return apply_log_bias_field(image, log_field)
+        if not self.fast and (not self.field_dir or id_ is None):
+            return sitk.N4BiasFieldCorrection(image)
+
+        log_field = estimate_log_bias_field(
+            image, self.fast, self.shrink_factor, self.iterations, self.convergence
+        )
+        if self.field_dir and id_ is not None:
+            os.makedirs(self.field_dir, exist_ok=True)
+            sitk.WriteImage(
+                sitk.Cast(log_field, sitk.sitkFloat32), self.field_path(id_), True
+            )
+        return apply_log_bias_field(image, log_field)
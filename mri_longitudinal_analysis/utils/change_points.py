@@ -0,0 +1,228 @@
+"""
+Batched change-point detection on the normalized volume curves of all patients.
+
+The change points of every curve are detected once per run with a ruptures
+search (Pelt, Binseg or Window) in a pool of worker processes. Results are cached
+in SQLite by the detector configuration and a digest of the curve, so that only
+new or modified curves are searched again. The change points are reused by the
+plots and written as columns of the time series.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import ruptures as rpt
+
+CHANGE_POINT_ALGORITHMS = {
+    "pelt": rpt.Pelt,
+    "binseg": rpt.Binseg,
+    "window": rpt.Window,
+}
+
+
+def normalize_volumes(volumes):
+    """
+    Divide the volumes by the first volume (by 1 if the first volume is 0).
+    """
+    initial_volume = volumes[0] if volumes[0] not in [0, np.nan] else 1
+    return [volume / initial_volume for volume in volumes]
+
+
+def detect_change_points(values, algorithm="pelt", model="rbf", penalty=10, width=4):
+    """
+    Detect the change points of a single curve.
+
+    Args:
+        values (list): Curve, ordered by age.
+        algorithm (str): Search method, one of CHANGE_POINT_ALGORITHMS.
+        model (str): Cost model of ruptures, e.g. 'rbf', 'l2' or 'l1'.
+        penalty (float): Penalty of the search.
+        width (int): Window width of the 'window' search.
+
+    Returns:
+        tuple: Indices of the points where a new segment starts. Curves that are too
+        short for the search have no change points.
+    """
+    signal = np.asarray(values, dtype=np.float64)
+    if algorithm == "window":
+        search = CHANGE_POINT_ALGORITHMS[algorithm](width=width, model=model)
+    else:
+        search = CHANGE_POINT_ALGORITHMS[algorithm](model=model)
+    try:
+        breakpoints = search.fit(signal).predict(pen=penalty)
+    except rpt.exceptions.BadSegmentationParameters:
+        return ()
+    # the last breakpoint is always the end of the curve
+    return tuple(int(point) for point in breakpoints if point < len(signal))
+
+
+def curve_digest(values):
+    """
+    Digest of a curve, used as cache key.
+    """
+    return hashlib.blake2b(
+        np.asarray(values, dtype=np.float64).tobytes(), digest_size=16
+    ).hexdigest()
+
+
+class ChangePointCache:
+    """
+    SQLite backed store of detected change points, keyed by detector signature and
+    curve digest.
+
+    Attributes:
+        db_path (str): Path to the SQLite file.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS change_points (
+                    signature TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    change_points TEXT NOT NULL,
+                    PRIMARY KEY (signature, digest)
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, signature, digests):
+        """
+        Return the cached change points of the given curve digests.
+
+        Returns:
+            dict: Mapping digest -> tuple of change points, for cached digests only.
+        """
+        hits = {}
+        with self._connect() as conn:
+            for digest in set(digests):
+                row = conn.execute(
+                    "SELECT change_points FROM change_points"
+                    " WHERE signature = ? AND digest = ?",
+                    (signature, digest),
+                ).fetchone()
+                if row is not None:
+                    hits[digest] = tuple(json.loads(row[0]))
+        return hits
+
+    def update(self, signature, results):
+        """
+        Insert or replace the change points of freshly searched curves.
+
+        Args:
+            signature (str): Configuration of the detector.
+            results (dict): Mapping digest -> tuple of change points.
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO change_points VALUES (?, ?, ?)",
+                [
+                    (signature, digest, json.dumps(list(change_points)))
+                    for digest, change_points in results.items()
+                ],
+            )
+
+
+class ChangePointDetector:
+    """
+    Detects the change points of many curves at once.
+
+    Attributes:
+        algorithm (str): Search method, one of CHANGE_POINT_ALGORITHMS.
+        model (str): Cost model of ruptures.
+        penalty (float): Penalty of the search.
+        width (int): Window width of the 'window' search.
+        workers (int): Number of worker processes (at most the number of CPUs),
+            0 or 1 searches in this process.
+        cache (ChangePointCache): Cache of earlier results, None to disable it.
+    """
+
+    def __init__(
+        self, algorithm="pelt", model="rbf", penalty=10, width=4, workers=0, cache_file=None
+    ):
+        if algorithm not in CHANGE_POINT_ALGORITHMS:
+            raise ValueError(
+                f"Unknown change point algorithm '{algorithm}', expected one of"
+                f" {list(CHANGE_POINT_ALGORITHMS)}."
+            )
+        self.algorithm = algorithm
+        self.model = model
+        self.penalty = penalty
+        self.width = width
+        self.workers = workers
+        self.cache = ChangePointCache(cache_file) if cache_file else None
+
+    @property
+    def signature(self):
+        """
+        String identifying the configuration, cached results are only reused if it
+        did not change.
+        """
+        signature = f"algorithm={self.algorithm};model={self.model};penalty={self.penalty}"
+        if self.algorithm == "window":
+            signature += f";width={self.width}"
+        return signature
+
+    def detect(self, curves):
+        """
+        Detect the change points of all curves.
+
+        Args:
+            curves (dict): Mapping key -> curve ordered by age.
+
+        Returns:
+            dict: Mapping key -> tuple of change point indices.
+        """
+        digests = {key: curve_digest(values) for key, values in curves.items()}
+        results = {}
+        if self.cache is not None:
+            results = self.cache.lookup(self.signature, digests.values())
+
+        # identical curves are only searched once
+        to_search = {}
+        for key, digest in digests.items():
+            if digest not in results and digest not in to_search:
+                to_search[digest] = curves[key]
+        print(
+            f"\tReusing {len(results)} cached change point searches,"
+            f" running {len(to_search)}."
+        )
+
+        if to_search:
+            search = partial(
+                detect_change_points,
+                algorithm=self.algorithm,
+                model=self.model,
+                penalty=self.penalty,
+                width=self.width,
+            )
+            workers = min(self.workers or 0, cpu_count(), len(to_search))
+            if workers > 1:
+                chunksize = max(1, len(to_search) // (workers * 4))
+                with Pool(workers) as pool:
+                    searched = pool.map(search, to_search.values(), chunksize=chunksize)
+            else:
+                searched = [search(values) for values in to_search.values()]
+            searched = dict(zip(to_search, searched))
+            results.update(searched)
+            if self.cache is not None:
+                self.cache.update(self.signature, searched)
+
+        return {key: results[digest] for key, digest in digests.items()}
@@ -0,0 +1,75 @@
+"""
+Typed cohort artifact shared by the analysis stages.
+
+The cohort creation (01) and the trajectory classification (02) save their cohort
+data frame as CSV for inspection and, next to it, as a Parquet file with the same
+name. The Parquet file keeps the schema of the data frame: categorical columns
+(with the order of the ordered ones), the string Patient_ID with its zero padding,
+numeric and boolean columns. The later stages read it back with read_cohort()
+without parsing text and re-deriving the column types.
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+COHORT_ARTIFACT_SUFFIX = ".parquet"
+
+
+def artifact_path(path):
+    """Path of the Parquet artifact of a cohort CSV (or artifact) path."""
+    return os.path.splitext(str(path))[0] + COHORT_ARTIFACT_SUFFIX
+
+
+def to_cohort_table(data):
+    """
+    Convert a cohort data frame to an Arrow table with explicit column types.
+
+    Patient_ID is stored as string, object columns with values of mixed types
+    (e.g. numeric and string scan ids) as strings.
+    """
+    data = data.copy()
+    data["Patient_ID"] = data["Patient_ID"].astype("string")
+    for column in data.columns[data.dtypes == object]:
+        if pd.api.types.infer_dtype(data[column], skipna=True).startswith("mixed"):
+            data[column] = data[column].astype("string")
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+def write_cohort(data, path):
+    """
+    Write a cohort data frame as Parquet artifact, replacing an existing one.
+
+    Args:
+        data (pd.DataFrame): Cohort data with a 'Patient_ID' column.
+        path (str): Path of the artifact or of its CSV, the suffix is replaced.
+
+    Returns:
+        str: Path of the written artifact.
+    """
+    path = artifact_path(path)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(to_cohort_table(data), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_cohort(path, columns=None):
+    """
+    Read a cohort data frame, from its Parquet artifact if there is one.
+
+    Args:
+        path (str): Path of the artifact or of its CSV.
+        columns (list, optional): Columns to read, all by default.
+
+    Returns:
+        pd.DataFrame: Cohort data. Read from a CSV without artifact, only the
+        'Patient_ID' column is typed (as string, keeping its zero padding).
+    """
+    parquet_path = artifact_path(path)
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path, columns=columns)
+    csv_path = os.path.splitext(str(path))[0] + ".csv"
+    print(f"\tNo cohort artifact {parquet_path}, reading {csv_path}.")
+    return pd.read_csv(csv_path, usecols=columns, dtype={"Patient_ID": "string"})
@@ -0,0 +1,291 @@
+"""
+Descriptive statistics of a cohort (Table 1) from declared variables.
+
+The variables of a summary are declared once with their kind (categorical or
+continuous) and level (per scan or per patient). describe() computes all counts,
+percentages, means, medians, IQRs and ranges with one grouped aggregation per
+level and kind, instead of one drop_duplicates and one scan of the data per
+reported line, and returns them as one long table that can be written as text or
+CSV. Used by the cohort creation (CohortStatistics) and the correlation analysis
+(TumorAnalysis).
+"""
+from collections import namedtuple
+
+import pandas as pd
+from scipy.stats import chi2_contingency, fisher_exact, mannwhitneyu, ttest_ind
+
+StatVariable = namedtuple(
+    "StatVariable", ["name", "column", "kind", "level", "scale", "unit", "nonzero"]
+)
+
+TABLE_COLUMNS = [
+    "Level",
+    "Group",
+    "Variable",
+    "Kind",
+    "Category",
+    "N",
+    "Count",
+    "Percent",
+    "Mean",
+    "Std",
+    "Min",
+    "Q1",
+    "Median",
+    "Q3",
+    "Max",
+    "Unit",
+]
+DESCRIBE_COLUMNS = {
+    "count": "N",
+    "mean": "Mean",
+    "std": "Std",
+    "min": "Min",
+    "25%": "Q1",
+    "50%": "Median",
+    "75%": "Q3",
+    "max": "Max",
+}
+
+
+def continuous(column, level="scan", scale=1, unit="", nonzero=False, name=None):
+    """
+    Declare a continuous variable.
+
+    Args:
+        column (str): Column of the data.
+        level (str): 'scan' for every row, 'patient' for one row per patient.
+        scale (float): The values are divided by it, e.g. 365.25 for days to years.
+        unit (str): Unit of the scaled values.
+        nonzero (bool): Ignore the zero values, e.g. the volume change of baselines.
+        name (str, optional): Reported name, the column by default.
+    """
+    return StatVariable(name or column, column, "continuous", level, scale, unit, nonzero)
+
+
+def categorical(column, level="patient", name=None):
+    """
+    Declare a categorical variable, counted per patient by default.
+    """
+    return StatVariable(name or column, column, "categorical", level, 1, "", False)
+
+
+def level_data(data, level, patient_column="Patient_ID"):
+    """Rows of a level: all rows, or the first row of every patient."""
+    if level == "patient":
+        return data.drop_duplicates(subset=[patient_column])
+    return data
+
+
+def continuous_stats(frame, variables, groups):
+    """
+    Count, mean, std, min, quartiles and max of the continuous variables per group,
+    in one grouped describe().
+    """
+    values = pd.DataFrame(
+        {
+            variable.name: (
+                frame[variable.column].where(frame[variable.column] != 0)
+                if variable.nonzero
+                else frame[variable.column]
+            )
+            / variable.scale
+            for variable in variables
+        },
+        index=frame.index,
+    )
+    stats = values.groupby(groups, sort=False, observed=True).describe()
+    stats = stats.stack(level=0, future_stack=True).rename(columns=DESCRIBE_COLUMNS)
+    stats.index.names = ["Group", "Variable"]
+    stats = stats.reset_index()
+    stats["Kind"] = "continuous"
+    stats["Unit"] = stats["Variable"].map({variable.name: variable.unit for variable in variables})
+    return stats
+
+
+def categorical_stats(frame, variables, groups):
+    """
+    Count and percentage of every category of the categorical variables per group,
+    in one grouped count. Missing values are not counted, the percentages are of
+    all rows of the group.
+    """
+    values = pd.DataFrame(
+        {variable.name: frame[variable.column].astype(object) for variable in variables},
+        index=frame.index,
+    )
+    values["Group"] = groups.to_numpy()
+    counts = (
+        values.melt(id_vars="Group", var_name="Variable", value_name="Category")
+        .dropna(subset=["Category"])
+        .groupby(["Group", "Variable", "Category"], sort=False)
+        .size()
+        .rename("Count")
+        .reset_index()
+    )
+    totals = groups.value_counts(sort=False)
+    counts["N"] = counts["Group"].map(totals)
+    counts["Percent"] = 100 * counts["Count"] / counts["N"]
+    counts["Kind"] = "categorical"
+    return counts.sort_values(
+        ["Group", "Variable", "Count"], ascending=[True, True, False], kind="stable"
+    )
+
+
+def describe(data, variables, group_by=None, patient_column="Patient_ID"):
+    """
+    Descriptive statistics of the declared variables.
+
+    Args:
+        data (pd.DataFrame): Cohort data, one row per scan.
+        variables (list): StatVariables from continuous() and categorical().
+        group_by (str, optional): Column of the groups, e.g. 'Dataset'. All rows form
+            the group 'All' by default.
+        patient_column (str): Column of the patient ids.
+
+    Returns:
+        pd.DataFrame: One row per continuous variable and per category of the
+        categorical variables (and group), with the TABLE_COLUMNS in the order of the
+        declared variables.
+    """
+    tables = []
+    for level in ("scan", "patient"):
+        frame = level_data(data, level, patient_column)
+        groups = (
+            frame[group_by].astype(object)
+            if group_by
+            else pd.Series("All", index=frame.index, dtype=object)
+        )
+        for kind, stats in (("continuous", continuous_stats), ("categorical", categorical_stats)):
+            selected = [
+                variable
+                for variable in variables
+                if variable.level == level and variable.kind == kind
+            ]
+            if selected:
+                table = stats(frame, selected, groups)
+                table["Level"] = level
+                tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+
+    table = pd.concat(tables, ignore_index=True).reindex(columns=TABLE_COLUMNS)
+    order = {variable.name: index for index, variable in enumerate(variables)}
+    group_order = {group: index for index, group in enumerate(pd.unique(table["Group"]))}
+    return (
+        table.assign(
+            _variable=table["Variable"].map(order), _group=table["Group"].map(group_order)
+        )
+        .sort_values(["_group", "_variable"], kind="stable")
+        .drop(columns=["_variable", "_group"])
+        .reset_index(drop=True)
+    )
+
+
+def summary_lines(table):
+    """
+    Lines of the text summary of a describe() table: median, maximum, minimum and
+    IQR of every continuous variable and the counts of every categorical variable.
+    """
+    lines = []
+    for (group, variable), rows in table.groupby(["Group", "Variable"], sort=False):
+        prefix = "" if group == "All" else f"{group} "
+        first = rows.iloc[0]
+        if first["Kind"] == "continuous":
+            unit = f" {first['Unit']}" if first["Unit"] else ""
+            lines.append(f"\t\t{prefix}Median {variable}: {first['Median']}{unit}")
+            lines.append(f"\t\t{prefix}Maximum {variable}: {first['Max']}{unit}")
+            lines.append(f"\t\t{prefix}Minimum {variable}: {first['Min']}{unit}")
+            lines.append(
+                f"\t\t{prefix}IQR {variable}: {first['Q1']} - {first['Q3']}{unit}"
+            )
+        else:
+            lines.append(f"\t\t{prefix}{variable}:")
+            for _, row in rows.iterrows():
+                lines.append(
+                    f"\t\t\t{row['Category']}: {int(row['Count'])} ({row['Percent']:.1f}%)"
+                )
+    return lines
+
+
+def write_table(table, output_file_path):
+    """
+    Write a table as CSV or as aligned text, depending on the file suffix.
+    """
+    file_type = str(output_file_path).split(".")[-1].lower()
+    if file_type == "csv":
+        table.to_csv(output_file_path, index=False)
+    elif file_type == "txt":
+        with open(output_file_path, "w", encoding="utf-8") as file:
+            file.write(table.to_string(index=False))
+    else:
+        raise ValueError("Invalid file_type. Choose either 'csv' or 'txt'.")
+    print(f"\tTable saved as {file_type.upper()}: {output_file_path}")
+
+
+def cohort_comparison_table(
+    data, categorical_vars, continuous_vars, check_assumptions, cohort_var="Dataset"
+):
+    """
+    Compare the first two cohorts of data variable by variable, on the last row of
+    every patient.
+
+    The counts per category and the mean ± std are taken from one describe() of all
+    variables. Categorical variables are tested with Fisher's exact test (two
+    categories in both cohorts) or the chi-squared test, continuous variables with
+    the t-test if check_assumptions(var, var, cohort_data, 't-test') holds for both
+    cohorts of at least 30 patients and the Mann-Whitney U test otherwise.
+
+    Returns:
+        pd.DataFrame: Columns Variable, Cohort 1, Cohort 2 and P-value.
+    """
+    aggregated_data = data.groupby(["Patient_ID", cohort_var]).last().reset_index()
+    aggregated_data = aggregated_data.dropna(subset=continuous_vars)
+    cohorts = aggregated_data[cohort_var].unique()[:2]
+    cohort_data = [aggregated_data[aggregated_data[cohort_var] == cohort] for cohort in cohorts]
+    variables = [categorical(var, level="scan") for var in categorical_vars] + [
+        continuous(var) for var in continuous_vars
+    ]
+    table = describe(
+        aggregated_data[aggregated_data[cohort_var].isin(cohorts)], variables, group_by=cohort_var
+    )
+
+    rows = []
+    for var in categorical_vars + continuous_vars:
+        var_table = table[table["Variable"] == var]
+        if var in categorical_vars:
+            contingency_table = (
+                var_table.pivot(index="Group", columns="Category", values="Count")
+                .reindex(index=list(cohorts))
+                .fillna(0)
+                .astype(int)
+                .sort_index(axis=1)
+            )
+            if all((contingency_table.loc[cohort] > 0).sum() == 2 for cohort in cohorts):
+                _, p_val = fisher_exact(contingency_table)
+            else:
+                _, p_val, _, _ = chi2_contingency(contingency_table)
+            values = [contingency_table.loc[cohort].to_dict() for cohort in cohorts]
+        else:
+            first, second = (cohort[var] for cohort in cohort_data)
+            if (
+                len(first) >= 30
+                and len(second) >= 30
+                and all(check_assumptions(var, var, cohort, "t-test") for cohort in cohort_data)
+            ):
+                _, p_val = ttest_ind(first, second)
+            else:
+                _, p_val = mannwhitneyu(first, second)
+            stats = var_table.set_index("Group")
+            values = [
+                f"{stats.loc[cohort, 'Mean']:.2f} ± {stats.loc[cohort, 'Std']:.2f}"
+                for cohort in cohorts
+            ]
+        rows.append(
+            {
+                "Variable": var,
+                "Cohort 1": values[0],
+                "Cohort 2": values[1],
+                "P-value": f"{p_val:.3f}",
+            }
+        )
+    return pd.DataFrame(rows, columns=["Variable", "Cohort 1", "Cohort 2", "P-value"])
@@ -0,0 +1,378 @@
+"""
+Fused, in-memory preprocessing of MRI scans.
+
+Instead of one directory-to-directory pass per step, every scan flows through a
+chain of pluggable stages (by default registration, brain extraction and bias
+field correction) as a SimpleITK image. The stages run in their own threads,
+connected by bounded queues: a loader reads the next scans while the stages
+work on the previous ones and the main thread writes the finished scans, so
+reading, computing and writing overlap while at most a few scans per stage are
+held in memory. Only the final outputs are written, plus optional debug
+checkpoints after chosen stages. The stages of every scan are profiled and can be
+appended to a JSON lines file (see utils.preprocess_profile).
+"""
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import SimpleITK as sitk
+
+from utils.bias_field import BiasFieldCorrector
+from utils.preprocess_profile import ScanProfile, append_records
+from utils.registration_engine import (
+    get_processed_files,
+    label_path,
+    register_image,
+    resample_label,
+    scan_id,
+    write_image,
+)
+from utils.template_cache import TemplateCache
+
+# closes a queue, every stage forwards it once all of its threads are done
+_DONE = object()
+
+
+class PipelineStage:
+    """
+    Base class of the pipeline stages.
+
+    A stage receives a scan as a dict with at least 'id', 'path', 'image' (sitk.Image),
+    'label' (sitk.Image or None) and 'profile' (ScanProfile), and returns it with the
+    processed image. Stages may add keys for later stages or the writer, e.g.
+    'transform', and record sub-stages in the profile.
+
+    Attributes:
+        name (str): Name of the stage, also names its checkpoints.
+        workers (int): Number of threads running the stage.
+    """
+
+    name = "stage"
+
+    def __init__(self, workers=1):
+        self.workers = max(1, workers)
+
+    def setup(self):
+        """Prepare shared resources, called once before the first scan."""
+
+    def process(self, scan):
+        """Process one scan and return it."""
+        raise NotImplementedError
+
+
+class RegistrationStage(PipelineStage):
+    """
+    N4 bias field correction and rigid registration to the template, the label of the
+    scan is resampled with the same transform (see utils.registration_engine).
+
+    Attributes:
+        template_path (str): Path to the template image.
+        template_cache (TemplateCache): Cache of the prepared template.
+        interp_type (str): Interpolator used to resample the template.
+        bias_corrector (BiasFieldCorrector): N4 settings before the registration.
+        fixed_pyramid (TemplatePyramid): Prepared template, loaded by setup().
+    """
+
+    name = "registration"
+
+    def __init__(
+        self, template_path, cache_dir, interp_type="linear", bias_corrector=None, workers=1
+    ):
+        super().__init__(workers)
+        self.template_path = str(template_path)
+        self.template_cache = TemplateCache(cache_dir)
+        self.interp_type = interp_type
+        self.bias_corrector = bias_corrector or BiasFieldCorrector()
+        self.fixed_pyramid = None
+
+    def setup(self):
+        _, self.fixed_pyramid = self.template_cache.get(self.template_path, self.interp_type)
+
+    def process(self, scan):
+        scan["image"], scan["transform"] = register_image(
+            scan["image"],
+            self.fixed_pyramid,
+            self.bias_corrector,
+            scan["id"],
+            scan["profile"],
+        )
+        if scan["label"] is not None:
+            scan["label"] = resample_label(
+                scan["label"], self.fixed_pyramid.image, scan["transform"]
+            )
+        return scan
+
+
+class BrainExtractionStage(PipelineStage):
+    """
+    Brain extraction with a directory based tool such as HD-BET.
+
+    The tool only reads '.nii.gz' files from a directory, so each scan is written to its
+    own scratch directory (in memory on /dev/shm when available) with the fastest gzip
+    level, extracted, and the brain image is read back. The '<name>_mask' output of the
+    tool is ignored.
+
+    Attributes:
+        extract_fn (callable): extract_fn(input_dir, output_dir) runs the tool.
+        scratch_dir (str): Parent of the per-scan scratch directories.
+    """
+
+    name = "brain_extraction"
+
+    def __init__(self, extract_fn, scratch_dir=None, workers=1):
+        super().__init__(workers)
+        self.extract_fn = extract_fn
+        if scratch_dir is None and os.path.isdir("/dev/shm"):
+            scratch_dir = "/dev/shm"
+        self.scratch_dir = scratch_dir
+
+    def process(self, scan):
+        work_dir = tempfile.mkdtemp(prefix=f"{scan['id']}_", dir=self.scratch_dir)
+        try:
+            input_dir = os.path.join(work_dir, "input")
+            output_dir = os.path.join(work_dir, "output")
+            os.makedirs(input_dir)
+            os.makedirs(output_dir)
+            sitk.WriteImage(
+                scan["image"],
+                os.path.join(input_dir, f"{scan['id']}_0000.nii.gz"),
+                useCompression=True,
+                compressionLevel=1,
+            )
+            self.extract_fn(input_dir, output_dir)
+            brains = [
+                filename
+                for filename in os.listdir(output_dir)
+                if filename.endswith(".nii.gz") and not scan_id(filename).endswith("mask")
+            ]
+            if len(brains) != 1:
+                raise RuntimeError(f"Expected one extracted brain, found {len(brains)}.")
+            scan["image"] = sitk.ReadImage(
+                os.path.join(output_dir, brains[0]), sitk.sitkFloat32
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return scan
+
+
+class BiasCorrectionStage(PipelineStage):
+    """
+    N4 bias field correction of the (registered, brain extracted) image, as done by
+    bf_correction() of the directory based preprocessing.
+
+    Attributes:
+        bias_corrector (BiasFieldCorrector): N4 settings.
+    """
+
+    name = "bias_correction"
+
+    def __init__(self, bias_corrector=None, workers=1):
+        super().__init__(workers)
+        self.bias_corrector = bias_corrector or BiasFieldCorrector()
+
+    def process(self, scan):
+        # same field name as bf_correction() on the registered '<id>_0000' image, the
+        # native space field of the registration is saved as '<id>'
+        scan["image"] = self.bias_corrector.correct(scan["image"], f"{scan['id']}_0000")
+        return scan
+
+
+class FusedPipeline:
+    """
+    Runs scans through a chain of stages in memory.
+
+    Attributes:
+        stages (list): PipelineStage instances, in order.
+        output_dir (str): Directory of the final images ('<id>_0000.nii.gz') and transforms.
+        nnunet_dir (str): Directory of the nnUNet outputs, labels go to 'labelsTs'.
+        save_tfm (bool): Whether the transforms are saved.
+        queue_size (int): Capacity of the queues between the stages.
+        checkpoint_dir (str): Directory of the debug checkpoints, one sub-directory per stage.
+        checkpoints (set): Names of the stages after which the image is saved.
+        threads (int): SimpleITK threads per filter.
+        profile_file (str): JSON lines file receiving the stage records of every scan,
+            None to not record them. The CPU time of a stage is that of the process and
+            includes the stages running concurrently on other scans.
+    """
+
+    def __init__(
+        self,
+        stages,
+        output_dir,
+        nnunet_dir,
+        save_tfm=True,
+        queue_size=2,
+        checkpoint_dir=None,
+        checkpoints=(),
+        threads=1,
+        profile_file=None,
+    ):
+        unknown = set(checkpoints) - {stage.name for stage in stages}
+        if unknown:
+            raise ValueError(f"Checkpoints of unknown stages: {sorted(unknown)}.")
+        if checkpoints and checkpoint_dir is None:
+            raise ValueError("Checkpoints need a checkpoint directory.")
+        self.stages = list(stages)
+        self.output_dir = str(output_dir)
+        self.nnunet_dir = str(nnunet_dir)
+        self.save_tfm = save_tfm
+        self.queue_size = max(1, queue_size)
+        self.checkpoint_dir = str(checkpoint_dir) if checkpoint_dir else None
+        self.checkpoints = set(checkpoints)
+        self.threads = max(1, threads)
+        self.profile_file = str(profile_file) if profile_file else None
+
+    @staticmethod
+    def load_scan(img_path):
+        """Read a scan and its label, if any."""
+        scan = {
+            "id": scan_id(img_path),
+            "path": str(img_path),
+            "image": None,
+            "label": None,
+            "error": None,
+            "profile": ScanProfile(scan_id(img_path)),
+        }
+        try:
+            with scan["profile"].stage("read"):
+                scan["image"] = sitk.ReadImage(str(img_path), sitk.sitkFloat32)
+                if os.path.isfile(label_path(img_path)):
+                    scan["label"] = sitk.ReadImage(label_path(img_path), sitk.sitkFloat32)
+        except (IOError, RuntimeError) as error:
+            scan["error"] = f"read: {error}"
+        return scan
+
+    def save_checkpoint(self, stage, scan):
+        """Write the image of a scan after a stage, if requested."""
+        if stage.name not in self.checkpoints:
+            return
+        stage_dir = os.path.join(self.checkpoint_dir, stage.name)
+        os.makedirs(stage_dir, exist_ok=True)
+        sitk.WriteImage(scan["image"], os.path.join(stage_dir, f"{scan['id']}_0000.nii.gz"))
+
+    def write_outputs(self, scan):
+        """Write the final image, the transform and the label of a scan."""
+        id_ = scan["id"]
+        write_image(scan["image"], os.path.join(self.output_dir, f"{id_}_0000.nii.gz"))
+        if self.save_tfm and scan.get("transform") is not None:
+            sitk.WriteTransform(
+                scan["transform"], os.path.join(self.output_dir, f"{id_}_T2.tfm")
+            )
+        if scan["label"] is not None:
+            os.makedirs(os.path.join(self.nnunet_dir, "labelsTs"), exist_ok=True)
+            sitk.WriteImage(
+                scan["label"], os.path.join(self.nnunet_dir, "labelsTs", f"{id_}.nii.gz")
+            )
+
+    def load_all(self, img_paths, out_queue):
+        """Producer: read the scans into the first queue."""
+        for img_path in img_paths:
+            out_queue.put(self.load_scan(img_path))
+        out_queue.put(_DONE)
+
+    def run_stage(self, stage, in_queue, out_queue):
+        """Consumer and producer: run one stage on the scans of its input queue."""
+        while True:
+            scan = in_queue.get()
+            if scan is _DONE:
+                # let the other threads of the stage stop as well
+                in_queue.put(_DONE)
+                return
+            if scan["error"] is None:
+                try:
+                    with scan["profile"].stage(stage.name):
+                        scan = stage.process(scan)
+                    self.save_checkpoint(stage, scan)
+                except Exception as error:  # pylint: disable=broad-except
+                    # a dead stage thread would block the whole pipeline
+                    scan["error"] = f"{stage.name}: {error}"
+            out_queue.put(scan)
+
+    @staticmethod
+    def close_stage(threads, out_queue):
+        """Forward the end of the input once all threads of a stage are done."""
+        for thread in threads:
+            thread.join()
+        out_queue.put(_DONE)
+
+    def start(self, img_paths):
+        """
+        Start the loader and the stage threads.
+
+        Returns:
+            queue.Queue: Queue of the processed scans, closed by _DONE.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threading.Thread(
+            target=self.load_all, args=(img_paths, queues[0]), daemon=True
+        ).start()
+        for index, stage in enumerate(self.stages):
+            workers = [
+                threading.Thread(
+                    target=self.run_stage,
+                    args=(stage, queues[index], queues[index + 1]),
+                    daemon=True,
+                )
+                for _ in range(stage.workers)
+            ]
+            for worker in workers:
+                worker.start()
+            threading.Thread(
+                target=self.close_stage, args=(workers, queues[index + 1]), daemon=True
+            ).start()
+        return queues[-1]
+
+    def run(self, input_data, resume=True):
+        """
+        Preprocess the given scans.
+
+        Args:
+            input_data (list): Paths to the MRI scans.
+            resume (bool): Skip scans with a final image in the output directory.
+
+        Returns:
+            dict: Number of scans per status ('done', 'failed', 'skipped').
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        processed = get_processed_files(self.output_dir) if resume else set()
+        to_run = sorted(path for path in input_data if scan_id(path) not in processed)
+        summary = {"done": 0, "failed": 0, "skipped": len(input_data) - len(to_run)}
+        print(
+            f"\tPreprocessing {len(to_run)} of {len(input_data)} scans through"
+            f" {' -> '.join(stage.name for stage in self.stages) or 'no stages'}."
+        )
+        if not to_run:
+            return summary
+
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(self.threads)
+        for stage in self.stages:
+            stage.setup()
+        start = time.perf_counter()
+        results = self.start(to_run)
+        while True:
+            scan = results.get()
+            if scan is _DONE:
+                break
+            if scan["error"] is None:
+                try:
+                    with scan["profile"].stage("write"):
+                        self.write_outputs(scan)
+                except (IOError, RuntimeError) as error:
+                    scan["error"] = f"write: {error}"
+            if self.profile_file:
+                append_records(self.profile_file, scan["profile"].records)
+            if scan["error"] is None:
+                summary["done"] += 1
+                stage_names = ["read", "write"] + [stage.name for stage in self.stages]
+                print(f"\t{scan['id']}: {scan['profile'].summary(stage_names)}")
+            else:
+                summary["failed"] += 1
+                print(f"Error with image {scan['id']}: {scan['error']}")
+        print(
+            f"\tPreprocessed scans per status: {summary}"
+            f" in {time.perf_counter() - start:.1f}s."
+        )
+        return summary
@@ -24,6 +24,7 @@ from sklearn.preprocessing import StandardScaler
 from statsmodels.stats.multitest import multipletests
 from statsmodels.stats.outliers_influence import variance_inflation_factor
 from scipy.interpolate import interp1d
+from utils.cohort_artifact import write_cohort
 
 ######################################
 # SMOOTHING and FILTERING OPERATIONS #
@@ -679,13 +680,15 @@ def zero_fill(series, width):
 
 def save_dataframe(df: pd.DataFrame, output_dir: str, cohort: str):
     """
-    Save data for deep learning in csv format.
+    Save data for further analyses in csv format, and as typed Parquet artifact
+    read by the later stages (see utils.cohort_artifact).
     """
     if df is not None:
         filename = f"{cohort}_cohort_data_features.csv"
         file_path = os.path.join(output_dir, filename)
         df.to_csv(file_path, index=False)
-        print(f"\tData saved for further analyses in {file_path}.")
+        artifact_file = write_cohort(df, file_path)
+        print(f"\tData saved for further analyses in {file_path} and {artifact_file}.")
 
 
 def categorize_age_group(data, column):
@@ -728,7 +731,60 @@ def categorize_time_since_first_diagnosis(data, column="Age"):
     #     return "5-10 years"
     else:
         return "5+ years"
-    
+
+
+# Upper bounds (inclusive, in years) and labels of the categories above, the last
+# label takes the values above the last bound and the missing values
+AGE_GROUP_BOUNDS = [2, 6, 13]
+AGE_GROUPS = ["Infant", "Preschool", "School Age", "Adolescent"]
+TIME_SINCE_DIAGNOSIS_BOUNDS = [1, 3, 5]
+TIME_SINCE_DIAGNOSIS_PERIODS = ["0-1 years", "1-3 years", "3-5 years", "5+ years"]
+
+
+def bin_ordered(values, bounds, labels):
+    """
+    Bin values into an ordered categorical, the first label whose inclusive upper
+    bound is not exceeded. Values above the last bound or missing get the last label.
+    Categories that do not occur are dropped, as with astype("category").
+
+    Args:
+        values (pd.Series): Numeric values.
+        bounds (list): Increasing upper bounds, one less than the labels.
+        labels (list): Labels in their order.
+
+    Returns:
+        pd.Series: Ordered categorical with the index of values.
+    """
+    numbers = values.to_numpy(dtype=float)
+    binned = np.select(
+        [numbers <= bound for bound in bounds], labels[:-1], default=labels[-1]
+    )
+    categorical = pd.Categorical(binned, categories=labels, ordered=True)
+    return pd.Series(categorical, index=values.index).cat.remove_unused_categories()
+
+
+def categorize_age_groups(data, column):
+    """
+    Vectorized categorize_age_group() of every row of data.
+
+    Returns:
+        pd.Series: Ordered categorical of the age groups.
+    """
+    return bin_ordered(data[column] / 365.25, AGE_GROUP_BOUNDS, AGE_GROUPS)
+
+
+def categorize_times_since_first_diagnosis(data, column="Age"):
+    """
+    Vectorized categorize_time_since_first_diagnosis() of every row of data.
+
+    Returns:
+        pd.Series: Ordered categorical of the time periods since the first diagnosis.
+    """
+    time_since_diagnosis = data[column] / 365 - data["Age at First Diagnosis"] / 365
+    return bin_ordered(
+        time_since_diagnosis, TIME_SINCE_DIAGNOSIS_BOUNDS, TIME_SINCE_DIAGNOSIS_PERIODS
+    )
+
     
 def calculate_group_norms_and_stability(data, volume_column, volume_change_column):
     """
@@ -780,6 +836,53 @@ def calculate_slope_and_angle(data, patient_id, column_name):
     return slope, angle
 
 
+def classify_patients(data):
+    """
+    Classify all patients at once, volumetrically (on the first row of every patient)
+    and by the composite of volumetric progression and received treatment.
+
+    Parameters:
+    - data (DataFrame): Cohort data with 'Patient_ID', 'Age at First Progression',
+    'Age at First Regression' and 'Received Treatment'.
+
+    Returns:
+    - DataFrame: Indexed by Patient_ID in the order of the data, with the columns
+    'Patient Classification Volumetric' ('Progressor', 'Regressor' or 'Stable'),
+    'Patient Classification Composite' ('Progressor' or 'Non-progressor') and their
+    binary versions 'Patient Classification Binary Volumetric' and
+    'Patient Classification Binary Composite' (1 for progressors).
+    """
+    first_rows = data.drop_duplicates(subset=["Patient_ID"]).set_index("Patient_ID")
+    volumetric = np.select(
+        [
+            first_rows["Age at First Progression"].notna(),
+            first_rows["Age at First Regression"].notna(),
+        ],
+        ["Progressor", "Regressor"],
+        default="Stable",
+    )
+    # every scan of the patient with treatment
+    received_treatment = (
+        (data["Received Treatment"] == "Yes")
+        .groupby(data["Patient_ID"], sort=False)
+        .all()
+        .reindex(first_rows.index)
+        .to_numpy(dtype=bool)
+    )
+    composite_progressor = (volumetric == "Progressor") | received_treatment
+    return pd.DataFrame(
+        {
+            "Patient Classification Volumetric": volumetric.astype(object),
+            "Patient Classification Composite": np.where(
+                composite_progressor, "Progressor", "Non-progressor"
+            ).astype(object),
+            "Patient Classification Binary Volumetric": (volumetric == "Progressor").astype(int),
+            "Patient Classification Binary Composite": composite_progressor.astype(int),
+        },
+        index=first_rows.index,
+    )
+
+
 def classify_patient_volumetric(
     data,
     patient_id,
@@ -792,15 +895,7 @@ def classify_patient_volumetric(
     if len(patient_data) == 0:
         return None
 
-    age_at_first_progression = patient_data["Age at First Progression"].iloc[0]
-    age_at_first_regression = patient_data["Age at First Regression"].iloc[0]
-    
-    if pd.notna(age_at_first_progression):
-        return "Progressor"
-    elif pd.notna(age_at_first_regression):
-        return "Regressor"
-    else:
-        return "Stable"
+    return classify_patients(patient_data)["Patient Classification Volumetric"].iloc[0]
 
 
 def classify_patient_composite(data,patient_id):
@@ -809,13 +904,11 @@ def classify_patient_composite(data,patient_id):
     """
     patient_data = data[data["Patient_ID"] == patient_id]
 
-    volumetric_class = classify_patient_volumetric(data, patient_id)
-    received_treatment = (patient_data["Received Treatment"] == "Yes").all()
-   
-    if volumetric_class == "Progressor" or received_treatment:
+    if len(patient_data) == 0:
+        # no scans: all (none) of them with treatment, as before
         return "Progressor"
-    else:
-        return "Non-progressor"
+
+    return classify_patients(patient_data)["Patient Classification Composite"].iloc[0]
 
 
 def calculate_percentage_change(data, patient_id, column_name):
@@ -1063,10 +1156,11 @@ def plot_histo_distributions(data, output_dir, time_bins, age_groups, endpoint="
     data = data.copy()
     dir_name = os.path.join(output_dir, "progression_status")
     os.makedirs(dir_name, exist_ok=True)
+    classifications = classify_patients(data)
     if endpoint == "volumetric":
-        data['Progressed'] = data.apply(lambda row: 1 if classify_patient_volumetric(data, row['Patient_ID']) == "Progressor" else 0, axis=1)
+        data['Progressed'] = data['Patient_ID'].map(classifications["Patient Classification Binary Volumetric"])
     else:   # clinical, composite progression
-        data['Progressed'] = data.apply(lambda row: 1 if classify_patient_composite(data, row['Patient_ID']) == 'Progressor' else 0, axis=1)
+        data['Progressed'] = data['Patient_ID'].map(classifications["Patient Classification Binary Composite"])
     
     data['Previously Progressed'] = 0
     cv_distribution(data, dir_name, age_groups=age_groups)
@@ -1371,81 +1465,129 @@ def plot_modified_progression(data, output_dir, variables, endpoint):
     plt.savefig(file_name, dpi=300)
     plt.close()
 
+PROGRESSION_COLUMNS = [
+    "Age at First Progression",
+    "Age at First Regression",
+    "Age at Volume Change",
+    "Time to Progression",
+    "Time to Regression",
+    "Time to Progression Years",
+    "Time to Regression Years",
+    "Time Gap",
+    "Time Gap Years",
+    "Time Since Diagnosis",
+]
+
+
+def segment_first(mask, starts, ends):
+    """
+    Position of the first True value of every segment [start, end) of a boolean array.
+
+    Returns:
+    - tuple: (positions, whether the segment has a True value). Segments without one
+    get their start as position.
+    """
+    positions = np.where(mask, np.arange(len(mask)), len(mask))
+    first = np.minimum.reduceat(positions, starts)
+    found = first < ends
+    return np.where(found, first, starts), found
+
+
+def calculate_progression_data(data, progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping):
+    """
+    Calculate the age at first progression, regression and volume change, the times
+    to progression and regression and the time period since diagnosis of all patients.
+
+    The data must be sorted by patient (and age). The scans of every patient form a
+    contiguous segment; the thresholds relative to the baseline volume, the first
+    crossings and the time periods are computed with NumPy reductions over the
+    segments instead of one pandas group per patient.
+
+    Parameters:
+    - data (DataFrame): Cohort data with 'Patient_ID', 'Age', 'Volume', 'Baseline Volume',
+    'Age at First Diagnosis' and 'Time Period Since Diagnosis'.
+    - progression_threshold, regression_threshold, volume_change_threshold (float):
+    Factors of the baseline volume.
+    - time_period_mapping (dict): Numeric value of every time period.
+
+    Returns:
+    - DataFrame: The PROGRESSION_COLUMNS, indexed by Patient_ID.
+    """
+    patient_ids = data["Patient_ID"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, patient_ids[1:] != patient_ids[:-1]])
+    ends = np.r_[starts[1:], len(data)]
+    lengths = ends - starts
+
+    volume = data["Volume"].to_numpy(dtype=float)
+    age = data["Age"].to_numpy(dtype=float)
+    baseline_volume = np.repeat(data["Baseline Volume"].to_numpy(dtype=float)[starts], lengths)
+    first_progression, progressed = segment_first(
+        volume >= baseline_volume * float(progression_threshold), starts, ends
+    )
+    first_regression, regressed = segment_first(
+        volume <= baseline_volume * float(regression_threshold), starts, ends
+    )
+    first_volume_change, volume_changed = segment_first(
+        volume >= baseline_volume * float(volume_change_threshold), starts, ends
+    )
+
+    age_at_first_progression = np.where(progressed, age[first_progression], np.nan)
+    age_at_volume_change = np.where(progressed & volume_changed, age[first_volume_change], np.nan)
+    age_at_first_regression = np.where(regressed, age[first_regression], np.nan)
+    age_at_first_diagnosis = data["Age at First Diagnosis"].to_numpy(dtype=float)[starts]
+    time_to_progression = age_at_first_progression - age_at_first_diagnosis
+    time_to_regression = age_at_first_progression - age_at_first_regression
+    # gap between the first volume change and the progression, 0 if not before it
+    time_gap = np.where(
+        progressed,
+        np.where(
+            volume_changed & (age_at_first_progression > age_at_volume_change),
+            age_at_first_progression - age_at_volume_change,
+            0,
+        ),
+        np.nan,
+    )
+
+    # time period at progression, or the latest time period of the patient
+    time_periods = data["Time Period Since Diagnosis"]
+    if pd.api.types.is_numeric_dtype(time_periods):
+        time_period_numeric = time_periods.to_numpy(dtype=float)
+    else:
+        time_period_numeric = (
+            time_periods.astype(object).map(time_period_mapping).to_numpy(dtype=float)
+        )
+    time_period_at_progression = np.where(
+        progressed,
+        time_period_numeric[first_progression],
+        np.fmax.reduceat(time_period_numeric, starts),
+    )
+    inverse_mapping = {v: k for k, v in time_period_mapping.items()}
+
+    return pd.DataFrame(
+        {
+            "Age at First Progression": age_at_first_progression,
+            "Age at First Regression": age_at_first_regression,
+            "Age at Volume Change": age_at_volume_change,
+            "Time to Progression": time_to_progression,
+            "Time to Regression": time_to_regression,
+            "Time to Progression Years": time_to_progression / 365.25,
+            "Time to Regression Years": time_to_regression / 365.25,
+            "Time Gap": time_gap,
+            "Time Gap Years": time_gap / 365.25,
+            "Time Since Diagnosis": pd.Series(time_period_at_progression).map(inverse_mapping).to_numpy(),
+        },
+        index=pd.Index(patient_ids[starts], name="Patient_ID"),
+    )
+
+
 def calculate_progression(group, progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping):
         """
         Calculate the age at first progression and time to progression for each patient.
+        Single patient version of calculate_progression_data.
         """
-        baseline_volume = group.iloc[0]["Baseline Volume"]
-        progression_threshold = baseline_volume * float(progression_threshold)
-        regression_threshold = baseline_volume * float(regression_threshold)
-        volume_change = baseline_volume * float(volume_change_threshold)
-
-        progression_mask = group["Volume"] >= progression_threshold
-        regression_mask = group["Volume"] <= regression_threshold
-        volume_change_mask = group["Volume"] >= volume_change
-
-        inverse_mapping = {v: k for k, v in time_period_mapping.items()}
-
-        if progression_mask.any():
-            first_progression_index = progression_mask.idxmax()
-            age_at_first_progression = group.loc[first_progression_index, "Age"]
-            age_at_first_diagnosis = group.iloc[0]["Age at First Diagnosis"]
-            time_to_progression = age_at_first_progression - age_at_first_diagnosis
-            
-            # calculate time period since diagnosis at progression
-            time_period_since_diagnosis_value  = group.loc[first_progression_index, "Time Period Since Diagnosis"]
-            time_period_since_diagnosis_numeric = get_time_period_numeric(time_period_since_diagnosis_value, time_period_mapping)
-            time_period_since_diagnosis_at_progression = inverse_mapping[time_period_since_diagnosis_numeric]
-        
-            # volume change calculations    
-            if volume_change_mask.any():
-                first_volume_change_index = volume_change_mask.idxmax()
-                age_at_volume_change = group.loc[first_volume_change_index, "Age"]
-                if (
-                    pd.notnull(age_at_first_progression)
-                    and age_at_first_progression > age_at_volume_change
-                ):
-                    time_gap = age_at_first_progression - age_at_volume_change
-                else:
-                    time_gap = 0
-            else:
-                time_gap = 0
-        
-        else:
-            age_at_first_progression = np.nan
-            age_at_volume_change = np.nan
-            time_period_since_diagnosis_numeric = group["Time Period Since Diagnosis"].map(time_period_mapping)
-            max_time_period_numeric = time_period_since_diagnosis_numeric.max()
-            time_period_since_diagnosis_at_progression = inverse_mapping[max_time_period_numeric]
-            time_to_progression = np.nan
-            time_gap = np.nan
-
-        if regression_mask.any():
-            first_regression_index = regression_mask.idxmax()
-            age_at_first_regression = group.loc[first_regression_index, "Age"]
-            time_to_regression = age_at_first_progression - age_at_first_regression
-        else:
-            age_at_first_regression = np.nan
-            time_to_regression = np.nan
-
-        time_to_progression_years = time_to_progression / 365.25 if pd.notnull(time_to_progression) else np.nan
-        time_to_regression_years = time_to_regression / 365.25 if pd.notnull(time_to_regression) else np.nan
-        time_gap_years = time_gap / 365.25 if pd.notnull(time_gap) else np.nan
-        
-        return pd.Series(
-            {
-                "Age at First Progression": age_at_first_progression,
-                "Age at First Regression": age_at_first_regression,
-                "Age at Volume Change": age_at_volume_change,
-                "Time to Progression": time_to_progression,
-                "Time to Regression": time_to_regression,
-                "Time to Progression Years": time_to_progression_years,
-                "Time to Regression Years": time_to_regression_years,
-                "Time Gap": time_gap,
-                "Time Gap Years": time_gap_years,
-                "Time Since Diagnosis": time_period_since_diagnosis_at_progression, 
-            }
-        )
+        return calculate_progression_data(
+            group.assign(Patient_ID=0), progression_threshold, regression_threshold, volume_change_threshold, time_period_mapping
+        ).iloc[0]
 
 def get_time_period_numeric(time_period_value, category_mapping):
        if isinstance(time_period_value, str):
@@ -0,0 +1,89 @@
+"""
+Bookkeeping for the incremental mode of the volume estimation.
+
+After every run a manifest stores the (size, mtime) signature of the masks of
+each patient, the patients that have outputs and the smoothing window. On the
+next run, comparing the manifest with the current directory listing yields the
+patients with new, modified or removed masks, so that only their derived series,
+CSV files and plots have to be rebuilt. A changed smoothing window affects all
+patients and requires a full rebuild.
+"""
+import glob
+import json
+import os
+
+
+def mask_signatures(files_by_patient):
+    """
+    Signature of the masks of every patient.
+
+    Args:
+        files_by_patient (dict): Mapping patient ID -> list of mask paths.
+
+    Returns:
+        dict: Mapping patient ID (as string) -> sorted list of [path, size, mtime_ns].
+    """
+    signatures = {}
+    for patient_id, file_paths in files_by_patient.items():
+        entries = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            entries.append([os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns])
+        signatures[str(patient_id)] = sorted(entries)
+    return signatures
+
+
+def load_manifest(manifest_path):
+    """
+    Load the manifest of the previous run, None if there is none.
+    """
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest_path, signatures, output_patients, window_size=None):
+    """
+    Save the mask signatures, the patients with outputs and the smoothing window of
+    the current run.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "masks": signatures,
+                "outputs": sorted(str(patient_id) for patient_id in output_patients),
+                "window_size": window_size,
+            },
+            file,
+        )
+    os.replace(temporary_path, manifest_path)
+
+
+def changed_patients(previous_signatures, current_signatures):
+    """
+    Patients whose masks were added, modified or removed since the previous run.
+    """
+    patient_ids = set(previous_signatures) | set(current_signatures)
+    return {
+        patient_id
+        for patient_id in patient_ids
+        if previous_signatures.get(patient_id) != current_signatures.get(patient_id)
+    }
+
+
+def remove_files(directory, patterns):
+    """
+    Delete the files in the directory that match any of the glob patterns.
+
+    Returns:
+        int: Number of deleted files.
+    """
+    removed = 0
+    for pattern in patterns:
+        for file_path in glob.glob(os.path.join(str(directory), pattern)):
+            os.remove(file_path)
+            removed += 1
+    return removed
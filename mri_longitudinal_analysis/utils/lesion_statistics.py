@@ -0,0 +1,203 @@
+"""
+Single-pass lesion statistics for segmentation masks.
+
+Every mask is read once and all configured metrics are derived from the same
+in-memory array: per-label volumes (bincount), connected components and their
+sizes (label + bincount), bounding box extents and the surface area (exposed
+voxel faces). Intermediate results are shared between metrics and only computed
+if a configured metric needs them, the heavy steps run on the bounding box crop.
+"""
+from functools import cached_property
+
+import numpy as np
+import SimpleITK as sitk
+from scipy import ndimage
+
+LESION_METRICS = ("label_volumes", "components", "bounding_box", "surface_area")
+
+
+class MaskMeasurement:
+    """
+    Lazily computed intermediate results of one mask, shared by the metrics.
+
+    Attributes:
+        array (np.ndarray): Voxel data in SimpleITK order (z, y, x).
+        spacing (tuple): Voxel spacing in SimpleITK order (x, y, z).
+        connectivity (int): Connectivity of the components, 1 (faces) up to the
+            number of dimensions (corners).
+    """
+
+    def __init__(self, array, spacing, connectivity=3):
+        self.array = array
+        self.spacing = tuple(float(s) for s in spacing)
+        self.connectivity = connectivity
+
+    @cached_property
+    def axis_spacing(self):
+        """Spacing along each array axis."""
+        return np.array(self.spacing[: self.array.ndim][::-1], dtype=np.float64)
+
+    @cached_property
+    def voxel_volume(self):
+        """Volume of one voxel in mm³."""
+        return float(np.prod(self.axis_spacing))
+
+    @cached_property
+    def bounding_box(self):
+        """Slices of the foreground bounding box, None for an empty mask."""
+        foreground = self.array > 0
+        box = []
+        for axis in range(foreground.ndim):
+            other_axes = tuple(a for a in range(foreground.ndim) if a != axis)
+            indices = np.flatnonzero(np.any(foreground, axis=other_axes))
+            if indices.size == 0:
+                return None
+            box.append(slice(indices[0], indices[-1] + 1))
+        return tuple(box)
+
+    @cached_property
+    def values(self):
+        """Voxel values inside the bounding box."""
+        if self.bounding_box is None:
+            return self.array[(slice(0, 0),) * self.array.ndim]
+        return self.array[self.bounding_box]
+
+    @cached_property
+    def foreground(self):
+        """Foreground (value > 0) inside the bounding box."""
+        return self.values > 0
+
+    @cached_property
+    def num_voxels(self):
+        """Number of foreground voxels."""
+        return int(np.count_nonzero(self.foreground))
+
+    @cached_property
+    def component_sizes(self):
+        """Number of voxels of every connected component."""
+        if self.num_voxels == 0:
+            return np.zeros(0, dtype=np.int64)
+        structure = ndimage.generate_binary_structure(
+            self.foreground.ndim, min(self.connectivity, self.foreground.ndim)
+        )
+        labeled, num_components = ndimage.label(self.foreground, structure=structure)
+        return np.bincount(labeled.ravel(), minlength=num_components + 1)[1:]
+
+
+def label_volumes(measurement, labels):
+    """Volume of every configured label."""
+    if labels is None:
+        return {}
+    counts = np.bincount(
+        measurement.values[measurement.foreground].astype(np.int64).ravel(),
+        minlength=max(labels) + 1,
+    )
+    return {
+        f"Volume Label {label}": float(counts[label] * measurement.voxel_volume)
+        for label in labels
+    }
+
+
+def components(measurement, _labels):
+    """Number of connected components and volume of the largest one."""
+    sizes = measurement.component_sizes
+    return {
+        "Components": int(sizes.size),
+        "Largest Component Volume": float(sizes.max(initial=0) * measurement.voxel_volume),
+    }
+
+
+def bounding_box(measurement, _labels):
+    """Extent of the foreground bounding box along x, y and z in mm."""
+    names = ["Bounding Box X", "Bounding Box Y", "Bounding Box Z"]
+    if measurement.bounding_box is None:
+        return {name: 0.0 for name in names}
+    # array axes are (z, y, x)
+    extents = [
+        (box.stop - box.start) * spacing
+        for box, spacing in zip(measurement.bounding_box, measurement.axis_spacing)
+    ][::-1]
+    return {name: float(extent) for name, extent in zip(names, extents)}
+
+
+def surface_area(measurement, _labels):
+    """Area of the voxel faces between foreground and background in mm²."""
+    padded = np.pad(measurement.foreground, 1)
+    area = 0.0
+    for axis in range(padded.ndim):
+        face_area = np.prod(np.delete(measurement.axis_spacing, axis))
+        area += np.count_nonzero(np.diff(padded, axis=axis)) * face_area
+    return {"Surface Area": float(area)}
+
+
+METRIC_FUNCTIONS = {
+    "label_volumes": label_volumes,
+    "components": components,
+    "bounding_box": bounding_box,
+    "surface_area": surface_area,
+}
+
+
+class LesionStatistics:
+    """
+    Computes a configurable set of lesion metrics with one read of every mask.
+
+    Attributes:
+        metrics (tuple): Names of the metrics, see METRIC_FUNCTIONS.
+        labels (list): Labels for the 'label_volumes' metric.
+        connectivity (int): Connectivity of the connected components (1 to 3 in 3D).
+    """
+
+    def __init__(self, metrics=LESION_METRICS, labels=(1,), connectivity=3):
+        unknown = [metric for metric in metrics if metric not in METRIC_FUNCTIONS]
+        if unknown:
+            raise ValueError(
+                f"Unknown lesion metrics {unknown}, expected any of {list(METRIC_FUNCTIONS)}."
+            )
+        self.metrics = tuple(metrics)
+        self.labels = sorted(int(label) for label in labels) if labels else None
+        self.connectivity = connectivity
+
+    @property
+    def signature(self):
+        """
+        String identifying the configuration, cached statistics are only reused
+        if it did not change.
+        """
+        return (
+            f"metrics={','.join(self.metrics)};labels={self.labels};"
+            f"connectivity={self.connectivity}"
+        )
+
+    def compute(self, array, spacing):
+        """
+        Compute all metrics of an in-memory mask.
+
+        Args:
+            array (np.ndarray): Voxel data in SimpleITK order (z, y, x).
+            spacing (tuple): Voxel spacing (x, y, z).
+
+        Returns:
+            tuple: (number of foreground voxels, dict with the metric columns).
+        """
+        measurement = MaskMeasurement(array, spacing, self.connectivity)
+        statistics = {}
+        for metric in self.metrics:
+            statistics.update(METRIC_FUNCTIONS[metric](measurement, self.labels))
+        return measurement.num_voxels, statistics
+
+    def measure(self, file_path):
+        """
+        Read a mask once and compute its volume together with all metrics.
+
+        Returns:
+            tuple: (total volume in mm³, number of foreground voxels, voxel spacing,
+            dict with the metric columns).
+        """
+        segmentation = sitk.ReadImage(str(file_path))
+        spacing = segmentation.GetSpacing()
+        num_voxels, statistics = self.compute(
+            sitk.GetArrayViewFromImage(segmentation), spacing
+        )
+        voxel_volume = spacing[0] * spacing[1] * spacing[2]
+        return num_voxels * voxel_volume, num_voxels, tuple(spacing), statistics
@@ -0,0 +1,195 @@
+"""
+Streaming utilities to read segmentation masks stored as NIfTI files.
+
+Instead of loading the whole volume into memory, the header is parsed to obtain
+the voxel spacing and data type and the voxel data is then decompressed in
+fixed-size chunks. Foreground voxels are counted chunk by chunk, so the peak
+memory per file is bounded by the chunk size and not by the size of the volume.
+"""
+import gzip
+import struct
+
+import numpy as np
+import SimpleITK as sitk
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# factor to mm of the spatial unit codes of xyzt_units (meter, mm, micron), unknown
+# units are taken as mm, as in the NIfTI reader of ITK / SimpleITK
+NIFTI_SPATIAL_UNITS_TO_MM = {1: 1000.0, 2: 1.0, 3: 0.001}
+
+# NIfTI datatype codes for the scalar types a mask can be stored with
+NIFTI_DTYPES = {
+    2: np.uint8,
+    4: np.int16,
+    8: np.int32,
+    16: np.float32,
+    64: np.float64,
+    256: np.int8,
+    512: np.uint16,
+    768: np.uint32,
+    1024: np.int64,
+    1280: np.uint64,
+}
+
+
+def open_nifti(file_path):
+    """
+    Open a .nii or .nii.gz file as a binary stream.
+    """
+    if str(file_path).endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def read_nifti_header(stream):
+    """
+    Parse the header of a single-file NIfTI-1 or NIfTI-2 image.
+
+    Args:
+        stream (file-like): Binary stream positioned at the start of the file.
+
+    Returns:
+        dict: Header fields needed to interpret the voxel data, i.e. 'shape',
+        'spacing' (in mm, converted from the spatial unit of xyzt_units), 'dtype',
+        'vox_offset', 'scl_slope', 'scl_inter' and 'header_size'.
+
+    Raises:
+        ValueError: If the header is not a supported single-file NIfTI header.
+    """
+    raw = stream.read(NIFTI1_HEADER_SIZE)
+    if len(raw) < NIFTI1_HEADER_SIZE:
+        raise ValueError("File is too short to contain a NIfTI header.")
+
+    endian = None
+    for candidate in ("<", ">"):
+        sizeof_hdr = struct.unpack(f"{candidate}i", raw[:4])[0]
+        if sizeof_hdr in (NIFTI1_HEADER_SIZE, NIFTI2_HEADER_SIZE):
+            endian = candidate
+            break
+    if endian is None:
+        raise ValueError("Unknown NIfTI header size.")
+
+    if sizeof_hdr == NIFTI1_HEADER_SIZE:
+        if raw[344:347] != b"n+1":
+            raise ValueError("Only single-file NIfTI-1 images (n+1) are supported.")
+        dim = struct.unpack(f"{endian}8h", raw[40:56])
+        datatype = struct.unpack(f"{endian}h", raw[70:72])[0]
+        pixdim = struct.unpack(f"{endian}8f", raw[76:108])
+        vox_offset = int(struct.unpack(f"{endian}f", raw[108:112])[0])
+        scl_slope, scl_inter = struct.unpack(f"{endian}2f", raw[112:120])
+        xyzt_units = raw[123]
+    else:
+        raw += stream.read(NIFTI2_HEADER_SIZE - NIFTI1_HEADER_SIZE)
+        if len(raw) < NIFTI2_HEADER_SIZE or raw[4:7] != b"n+2":
+            raise ValueError("Only single-file NIfTI-2 images (n+2) are supported.")
+        datatype = struct.unpack(f"{endian}h", raw[12:14])[0]
+        dim = struct.unpack(f"{endian}8q", raw[16:80])
+        pixdim = struct.unpack(f"{endian}8d", raw[104:168])
+        vox_offset = struct.unpack(f"{endian}q", raw[168:176])[0]
+        scl_slope, scl_inter = struct.unpack(f"{endian}2d", raw[176:192])
+        xyzt_units = struct.unpack(f"{endian}i", raw[500:504])[0]
+
+    if datatype not in NIFTI_DTYPES:
+        raise ValueError(f"Unsupported NIfTI datatype code: {datatype}")
+
+    n_dims = int(dim[0])
+    if not 1 <= n_dims <= 7:
+        raise ValueError(f"Invalid number of dimensions in header: {n_dims}")
+
+    shape = tuple(int(d) for d in dim[1 : n_dims + 1])
+    unit_scale = NIFTI_SPATIAL_UNITS_TO_MM.get(xyzt_units & 0x07, 1.0)
+    spacing = tuple(abs(float(p)) * unit_scale for p in pixdim[1:4])
+
+    return {
+        "shape": shape,
+        "spacing": spacing,
+        "dtype": np.dtype(NIFTI_DTYPES[datatype]).newbyteorder(endian),
+        "vox_offset": max(int(vox_offset), len(raw)),
+        "scl_slope": float(scl_slope),
+        "scl_inter": float(scl_inter),
+        "header_size": len(raw),
+    }
+
+
+def count_foreground_voxels(file_path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Count the voxels with a value > 0 in a NIfTI mask without loading the full volume.
+
+    The voxel data is decompressed into a single reusable buffer of `chunk_bytes`
+    bytes, so the memory usage stays constant regardless of the image size.
+    Intensity scaling (scl_slope / scl_inter) is applied as SimpleITK would.
+
+    Args:
+        file_path (str): Path to the .nii or .nii.gz file.
+        chunk_bytes (int): Size of the decompression buffer in bytes.
+
+    Returns:
+        tuple: (number of foreground voxels, voxel spacing as a 3-tuple).
+    """
+    with open_nifti(file_path) as stream:
+        header = read_nifti_header(stream)
+        dtype = header["dtype"]
+        itemsize = dtype.itemsize
+
+        # skip extensions between the header and the voxel data
+        to_skip = header["vox_offset"] - header["header_size"]
+        while to_skip > 0:
+            skipped = len(stream.read(min(to_skip, chunk_bytes)))
+            if skipped == 0:
+                raise ValueError("Unexpected end of file before the voxel data.")
+            to_skip -= skipped
+
+        slope, inter = header["scl_slope"], header["scl_inter"]
+        rescale = slope != 0 and not (slope == 1 and inter == 0)
+
+        items_per_chunk = max(chunk_bytes // itemsize, 1)
+        buffer = bytearray(items_per_chunk * itemsize)
+        view = memoryview(buffer)
+        foreground = np.empty(items_per_chunk, dtype=bool)
+        remaining = int(np.prod(header["shape"], dtype=np.int64))
+        num_voxels = 0
+        while remaining > 0:
+            n_items = min(items_per_chunk, remaining)
+            n_bytes = n_items * itemsize
+            filled = 0
+            while filled < n_bytes:
+                read = stream.readinto(view[filled:n_bytes])
+                if not read:
+                    raise ValueError("Unexpected end of file in the voxel data.")
+                filled += read
+            values = np.frombuffer(buffer, dtype=dtype, count=n_items)
+            if rescale:
+                values = values * slope + inter
+            np.greater(values, 0, out=foreground[:n_items])
+            num_voxels += int(np.count_nonzero(foreground[:n_items]))
+            remaining -= n_items
+
+    return num_voxels, header["spacing"]
+
+
+def mask_volume(file_path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Compute the foreground volume of a segmentation mask.
+
+    Single-file NIfTI images are streamed with `count_foreground_voxels`,
+    any other format readable by SimpleITK is loaded as a whole.
+
+    Args:
+        file_path (str): Path to the segmentation file.
+        chunk_bytes (int): Size of the decompression buffer in bytes.
+
+    Returns:
+        tuple: (total volume in mm³, number of foreground voxels, voxel spacing).
+    """
+    try:
+        num_voxels, spacing = count_foreground_voxels(file_path, chunk_bytes)
+    except ValueError:
+        segmentation = sitk.ReadImage(str(file_path))
+        spacing = segmentation.GetSpacing()
+        num_voxels = int((sitk.GetArrayViewFromImage(segmentation) > 0).sum())
+
+    voxel_volume = spacing[0] * spacing[1] * spacing[2]
+    return num_voxels * voxel_volume, num_voxels, tuple(spacing)
@@ -0,0 +1,300 @@
+"""
+Headless plot rendering for the per-patient figures of the volume estimation.
+
+Every figure is described by a small picklable job (kind, output file and the
+plotted values). The jobs are collected in a PlotQueue and rendered with the Agg
+backend, either in the main process or in a pool of worker processes. The queue
+can also skip the rendering ('off') or only keep the figures of a random but
+reproducible subset of the patients ('sampled').
+"""
+import os
+import random
+from collections import namedtuple
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from utils.change_points import detect_change_points, normalize_volumes
+
+PLOT_MODES = ("all", "sampled", "off")
+
+PlotJob = namedtuple("PlotJob", ["kind", "output_file", "params"])
+
+
+def setup_plot_base(normalize=False):
+    """
+    Setup the base of a plot with the necessary properties.
+
+    Returns:
+        tuple: A tuple containing the figure and axis objects of the plot.
+    """
+    plt.close("all")
+    fig, a_x1 = plt.subplots(figsize=(12, 8))
+    a_x1.set_xlabel("Age (days)", size=15)
+    if normalize:
+        a_x1.set_ylabel("Normalized Volume (mm³)", size=15)
+    else:
+        a_x1.set_ylabel("Volume (mm³)", size=15)
+
+    a_x1.tick_params(axis="y", size=13)
+    return fig, a_x1
+
+
+def add_volume_change_to_plot(a_x, ages, volumes):
+    """
+    Add the percentage volume change with respect to the previous scan to the plot.
+    """
+    if ages is None:
+        ages = list(range(len(volumes)))
+
+    volume_change_pct = [0]
+    for previous, current in zip(volumes[:-1], volumes[1:]):
+        volume_change_pct.append(
+            ((current - previous) / previous) * 100 if previous != 0 else 0
+        )
+
+    for age, volume, volume_change in zip(ages, volumes, volume_change_pct):
+        a_x.text(
+            age,
+            volume,
+            f"{volume_change:.2f}%",
+            fontsize=8,
+            va="bottom",
+            ha="left",
+        )
+
+
+def add_date_to_plot(a_x, dates, ages):
+    """
+    Add date annotations to the plot.
+    """
+    if dates is not None and ages:
+        a_x2 = a_x.twiny()
+        a_x2.xaxis.set_ticks_position("top")
+        a_x2.xaxis.set_label_position("top")
+        a_x2.set_xlabel("Dates")
+        a_x2.set_xlim(a_x.get_xlim())
+        a_x2.set_xticks(ages)
+        date_labels = [
+            date.strftime("%d/%m/%Y") if isinstance(date, datetime) else date
+            for date in dates
+        ]
+        a_x2.set_xticklabels(date_labels, rotation=90)
+        a_x2.xaxis.set_tick_params(labelsize=8)
+
+
+def render_volume_plot(output_file, data_type, patient_id, dates, volumes, ages):
+    """
+    Plot and save the volumes of a single patient over age.
+    """
+    fig, a_x1 = setup_plot_base(normalize=False)
+
+    if dates is not None:
+        dates, volumes, ages = zip(*sorted(zip(dates, volumes, ages), key=lambda x: x[2]))
+        a_x1.plot(ages, volumes, color="tab:blue", marker="o")
+        add_volume_change_to_plot(a_x1, ages, volumes)
+        add_date_to_plot(a_x1, dates, ages)
+    else:
+        volumes, ages = zip(*sorted(zip(volumes, ages), key=lambda x: x[1]))
+        a_x1.plot(ages, volumes, color="tab:blue", marker="o")
+        add_volume_change_to_plot(a_x1, ages, volumes)
+
+    plt.title(f"Patient ID: {patient_id} - {data_type}")
+    fig.set_tight_layout(True)
+    plt.savefig(output_file)
+    plt.close(fig)
+
+
+def render_normalized_plot(
+    output_file,
+    data_type,
+    patient_id,
+    dates,
+    volumes,
+    ages,
+    window_size=None,
+    change_points=None,
+):
+    """
+    Plot and save the normalized volumes of a single patient with their moving
+    average and change points. Without precomputed change points they are detected
+    with PELT.
+    """
+    fig, ax1 = setup_plot_base(normalize=True)
+
+    normalized_volumes = normalize_volumes(volumes)
+
+    if dates is not None:
+        dates, normalized_volumes, ages = zip(
+            *sorted(zip(dates, normalized_volumes, ages), key=lambda x: x[2])
+        )
+    else:
+        normalized_volumes, ages = zip(
+            *sorted(zip(normalized_volumes, ages), key=lambda x: x[1])
+        )
+
+    ax1.plot(ages, normalized_volumes, color="tab:blue", marker="o", linestyle="-")
+    add_volume_change_to_plot(ax1, ages, normalized_volumes)
+
+    num_scans = len(normalized_volumes)
+    window_size = window_size if window_size else max(3, num_scans // 2)
+    moving_average = (
+        pd.Series(normalized_volumes).rolling(window=window_size, min_periods=1).mean()
+    )
+    ax1.plot(
+        ages,
+        moving_average,
+        color="tab:orange",
+        linestyle="-",
+        label="Moving Average",
+    )
+
+    if change_points is None:
+        change_points = detect_change_points(normalized_volumes)
+
+    # Plot detected change points
+    for cp in change_points:
+        if cp < len(ages):
+            ax1.axvline(x=ages[cp], color="red", linestyle="--")
+
+    if dates is not None:
+        add_date_to_plot(ax1, dates, ages)
+
+    handles, labels = ax1.get_legend_handles_labels()
+    by_label = dict(zip(labels, handles))
+    plt.legend(by_label.values(), by_label.keys(), loc="best")
+    plt.title(f"Patient ID: {patient_id} - Normalized Volume {data_type}")
+    fig.set_tight_layout(True)
+    plt.savefig(output_file)
+    plt.close(fig)
+
+
+def render_comparison_plot(output_file, patient_id, series):
+    """
+    Plot the data of all data sources of a single patient next to each other.
+
+    Args:
+        series (list): (data source, scan tuples) pairs, one subplot each.
+    """
+    fig, axs = plt.subplots(1, len(series), figsize=(24, 8))
+
+    for a_x, (key, patient_data) in zip(np.atleast_1d(axs), series):
+        if not patient_data:
+            a_x.set_title(f"No Data: {key}")
+            continue
+
+        if len(patient_data[0]) == 3:
+            _, volumes, ages = zip(*patient_data)
+            a_x.plot(ages, volumes, label=f"{key} data")
+            a_x.set_xlabel("Date")
+        elif len(patient_data[0]) == 2:
+            volumes, ages = zip(*patient_data)
+            a_x.plot(ages, volumes, label=f"{key} data")
+            a_x.set_xlabel("Age")
+
+        a_x.set_title(f"{key} Data for Patient {patient_id}")
+        a_x.set_ylabel("Volume")
+        a_x.legend()
+
+    plt.tight_layout()
+    plt.savefig(output_file)
+    plt.close(fig)
+
+
+RENDERERS = {
+    "volume": render_volume_plot,
+    "normalized": render_normalized_plot,
+    "comparison": render_comparison_plot,
+}
+
+
+def use_agg_backend():
+    """
+    Switch matplotlib to the non-interactive Agg backend (pool initializer).
+    """
+    plt.switch_backend("Agg")
+
+
+def render_job(job):
+    """
+    Render a single plot job, returns the output file.
+    """
+    RENDERERS[job.kind](job.output_file, **job.params)
+    return job.output_file
+
+
+class PlotQueue:
+    """
+    Collects plot jobs and renders them in a pool of worker processes.
+
+    Attributes:
+        mode (str): 'all' renders every job, 'sampled' only the jobs of the sampled
+            patients and 'off' none.
+        workers (int): Number of worker processes (at most the number of CPUs),
+            0 or 1 renders in this process.
+        sample_size (int): Number of patients kept in 'sampled' mode.
+        seed (int): Seed of the patient sampling.
+    """
+
+    def __init__(self, mode="all", workers=0, sample_size=10, seed=42):
+        if mode not in PLOT_MODES:
+            raise ValueError(f"Unknown plot mode '{mode}', expected one of {PLOT_MODES}.")
+        self.mode = mode
+        self.workers = workers
+        self.sample_size = sample_size
+        self.seed = seed
+        self.jobs = []
+        self.sampled_patients = None
+
+    def set_patients(self, patient_ids):
+        """
+        Draw the patients to be plotted in 'sampled' mode. The draw only depends on
+        the seed and the set of patient ids, so all data sources use the same patients.
+        """
+        patient_ids = sorted(str(patient_id) for patient_id in patient_ids)
+        sample_size = min(self.sample_size, len(patient_ids))
+        self.sampled_patients = set(random.Random(self.seed).sample(patient_ids, sample_size))
+
+    def wants(self, patient_id):
+        """
+        Whether the figures of the given patient are rendered.
+        """
+        if self.mode == "off":
+            return False
+        if self.mode == "sampled" and self.sampled_patients is not None:
+            return str(patient_id) in self.sampled_patients
+        return True
+
+    def submit(self, kind, output_file, patient_id, **params):
+        """
+        Queue a figure of the given kind, unless the patient is skipped by the mode.
+        """
+        if not self.wants(patient_id):
+            return
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        self.jobs.append(PlotJob(kind, output_file, dict(params, patient_id=patient_id)))
+
+    def run(self):
+        """
+        Render all queued jobs and empty the queue.
+
+        Returns:
+            int: Number of rendered figures.
+        """
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return 0
+        workers = min(self.workers or 0, cpu_count(), len(jobs))
+        if workers > 1:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            with Pool(workers, initializer=use_agg_backend) as pool:
+                for _ in pool.imap_unordered(render_job, jobs, chunksize=chunksize):
+                    pass
+        else:
+            use_agg_backend()
+            for job in jobs:
+                render_job(job)
+        return len(jobs)
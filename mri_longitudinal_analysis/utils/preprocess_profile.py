@@ -0,0 +1,247 @@
+"""
+Per-scan, per-stage instrumentation of the preprocessing and its summary report.
+
+Every stage of a scan (read, N4, optimizer, resample, write, ...) is measured with
+its wall time, the CPU time of the process, the peak resident set size during the
+stage and stage specific values such as the optimizer iterations and the final
+metric. The peak is taken from the VmHWM watermark of /proc/self/status, reset at
+the start of every stage (Linux). Where that is not available, the lifetime
+watermark of the process (ru_maxrss) is recorded as rss_watermark_mb instead.
+The records are appended as JSON lines to a profile file by the registration
+engine and the fused pipeline. Run as a script, this module summarizes a profile
+file: p50/p95 per stage, the slowest scans and the scans taking much longer than
+the median.
+"""
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from cfg.utils import preprocess_profile_cfg
+
+
+# peak RSS (MB) of the open stages of this process before the last watermark reset
+_OPEN_STAGES = {}
+_OPEN_STAGES_LOCK = threading.Lock()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process over its lifetime in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_watermark_mb():
+    """
+    Peak resident set size of this process since the last watermark reset in MB,
+    None if /proc/self/status is not available.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_rss_watermark():
+    """Reset the peak RSS watermark of this process to its current RSS (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def start_peak_rss(token):
+    """
+    Start measuring the peak RSS of a stage by resetting the watermark. The process
+    wide watermark is shared by nested stages and stages of other threads, so the
+    peak so far of every open stage is kept before the reset.
+
+    Returns:
+        bool: Whether the peak of the stage can be measured.
+    """
+    with _OPEN_STAGES_LOCK:
+        watermark = rss_watermark_mb()
+        if watermark is None or not reset_rss_watermark():
+            return False
+        for open_token, peak in _OPEN_STAGES.items():
+            _OPEN_STAGES[open_token] = max(peak, watermark)
+        _OPEN_STAGES[token] = 0.0
+        return True
+
+
+def stop_peak_rss(token):
+    """Peak RSS in MB of a stage started with start_peak_rss()."""
+    with _OPEN_STAGES_LOCK:
+        return max(_OPEN_STAGES.pop(token), rss_watermark_mb() or 0.0)
+
+
+class ScanProfile:
+    """
+    Measurements of the stages of one scan.
+
+    Attributes:
+        id (str): Scan identifier.
+        records (list): One dict per finished stage.
+    """
+
+    def __init__(self, id_):
+        self.id = id_
+        self.records = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the enclosed block as stage name. The yielded record takes additional
+        values, e.g. record["iterations"]. A stage left by an exception is recorded as
+        failed and the exception is raised again.
+        """
+        record = {"id": self.id, "stage": name, "status": "done"}
+        token = object()
+        per_stage = start_peak_rss(token)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        finally:
+            record["wall_s"] = time.perf_counter() - wall
+            record["cpu_s"] = time.process_time() - cpu
+            if per_stage:
+                record["peak_rss_mb"] = stop_peak_rss(token)
+            else:
+                record["rss_watermark_mb"] = peak_rss_mb()
+            self.records.append(record)
+
+    def summary(self, stages=None):
+        """One line with the wall time of the (given) stages, for progress output."""
+        return ", ".join(
+            f"{record['stage']} {record['wall_s']:.1f}s"
+            for record in self.records
+            if stages is None or record["stage"] in stages
+        )
+
+
+def append_records(profile_file, records):
+    """
+    Append stage records as JSON lines, with the time they were written.
+    """
+    if not records:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(profile_file)), exist_ok=True)
+    now = datetime.now().isoformat(timespec="seconds")
+    with open(profile_file, "a", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps({**record, "time": now}) + "\n")
+
+
+def load_profile(profile_file):
+    """
+    Read a profile file. Scans processed several times keep their latest records.
+
+    Returns:
+        pd.DataFrame: One row per scan and stage.
+    """
+    with open(profile_file, "r", encoding="utf-8") as file:
+        profile = pd.DataFrame([json.loads(line) for line in file if line.strip()])
+    return profile.drop_duplicates(subset=["id", "stage"], keep="last").reset_index(drop=True)
+
+
+def quantile(q):
+    """Aggregation function of the q quantile, named for the report."""
+
+    def aggregate(values):
+        return values.quantile(q)
+
+    aggregate.__name__ = f"p{int(q * 100)}"
+    return aggregate
+
+
+def stage_report(profile):
+    """
+    Statistics of every stage over the scans.
+
+    Returns:
+        pd.DataFrame: Per stage the number of scans and failures, p50/p95/max of the
+        wall time, p50 of the CPU time, the largest peak RSS of the stage (or the
+        process watermark where the stage peak was not measured) and, where
+        recorded, the median total optimizer iterations and final metric.
+    """
+    aggregations = {
+        "Scans": ("id", "count"),
+        "Failed": ("status", lambda status: int((status == "failed").sum())),
+        "Wall p50 (s)": ("wall_s", quantile(0.5)),
+        "Wall p95 (s)": ("wall_s", quantile(0.95)),
+        "Wall max (s)": ("wall_s", "max"),
+        "CPU p50 (s)": ("cpu_s", quantile(0.5)),
+    }
+    if "peak_rss_mb" in profile:
+        aggregations["Peak RSS max (MB)"] = ("peak_rss_mb", "max")
+    if "rss_watermark_mb" in profile:
+        aggregations["RSS watermark max (MB)"] = ("rss_watermark_mb", "max")
+    if "iterations" in profile:
+        aggregations["Iterations p50"] = ("iterations", quantile(0.5))
+    if "metric" in profile:
+        aggregations["Metric p50"] = ("metric", quantile(0.5))
+    return profile.groupby("stage", sort=False).agg(**aggregations)
+
+
+def scan_report(profile, stages=None):
+    """
+    Total wall time per scan and its ratio to the median of the successful scans.
+
+    Args:
+        profile (pd.DataFrame): Records of load_profile().
+        stages (list, optional): Stages summed per scan. Defaults to all stages, which
+            counts nested stages (e.g. the optimizer within the registration of the
+            fused pipeline) twice.
+
+    Returns:
+        pd.DataFrame: Scans sorted by decreasing total wall time.
+    """
+    if stages:
+        profile = profile[profile["stage"].isin(stages)]
+    totals = profile.groupby("id").agg(
+        **{
+            "Wall (s)": ("wall_s", "sum"),
+            "CPU (s)": ("cpu_s", "sum"),
+            "Failed": ("status", lambda status: bool((status == "failed").any())),
+        }
+    )
+    # failed scans stop early and would lower the median
+    totals["x Median"] = (
+        totals["Wall (s)"] / totals.loc[~totals["Failed"], "Wall (s)"].median()
+    )
+    return totals.sort_values("Wall (s)", ascending=False)
+
+
+if __name__ == "__main__":
+    profile_df = load_profile(preprocess_profile_cfg.PROFILE_FILE)
+    stages_df = stage_report(profile_df)
+    scans_df = scan_report(profile_df, preprocess_profile_cfg.TOTAL_STAGES)
+    outliers = scans_df[scans_df["x Median"] >= preprocess_profile_cfg.OUTLIER_FACTOR]
+
+    print(f"Preprocessing profile of {profile_df['id'].nunique()} scans:")
+    print(stages_df.to_string(float_format="%.2f"))
+    print(f"Slowest {preprocess_profile_cfg.TOP_SCANS} scans:")
+    print(scans_df.head(preprocess_profile_cfg.TOP_SCANS).to_string(float_format="%.2f"))
+    print(
+        f"\t{len(outliers)} scans took at least {preprocess_profile_cfg.OUTLIER_FACTOR}x"
+        f" the median: {list(outliers.index)}"
+    )
+    stages_df.to_csv(preprocess_profile_cfg.STAGE_REPORT_FILE)
+    scans_df.to_csv(preprocess_profile_cfg.SCAN_REPORT_FILE)
+    print(
+        f"\tSaved reports to {preprocess_profile_cfg.STAGE_REPORT_FILE} and"
+        f" {preprocess_profile_cfg.SCAN_REPORT_FILE}."
+    )
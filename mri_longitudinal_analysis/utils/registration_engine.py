@@ -0,0 +1,496 @@
+"""
+Parallel, resumable registration of MRI scans to a template.
+
+Every scan is a job: N4 bias field correction (optionally the fast mode with saved
+fields, see utils.bias_field), multi-resolution rigid registration
+with Mattes mutual information, then resampling of the image (and its label, if
+any) onto the 1 mm template grid. The template and its pyramid levels are
+prepared once and loaded from an on-disk cache (see utils.template_cache). Jobs
+are spread over a pool of worker processes, each using a fixed number of
+SimpleITK threads so that the pool does not oversubscribe the CPUs. A persistent
+SQLite ledger records status, duration and error per scan, so interrupted runs
+can be resumed and failed scans retried. The stages of every scan are profiled
+and can be appended to a JSON lines file (see utils.preprocess_profile).
+"""
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+
+import SimpleITK as sitk
+from tqdm import tqdm
+
+from utils.bias_field import BiasFieldCorrector
+from utils.preprocess_profile import ScanProfile, append_records
+from utils.template_cache import INTERPOLATORS, TemplateCache, pyramid_level
+
+# state of a worker process, set once by the pool initializer
+_WORKER = {}
+
+
+def scan_id(img_path):
+    """Identifier of a scan, its file name without the .nii.gz extension."""
+    return os.path.basename(img_path).replace(".nii.gz", "")
+
+
+def rigid_registration(fixed_pyramid, moving_img, stats=None):
+    """
+    Multi-resolution rigid registration using Mattes mutual information.
+
+    The levels of the template come from its cached pyramid. At every level the
+    moving image is smoothed with the same sigma and shrunk by the same factor, as
+    SetShrinkFactorsPerLevel does for both images, and the optimization continues
+    from the transform of the previous level, as in a single multi-level run of the
+    SimpleITK registration.
+
+    Args:
+        fixed_pyramid (TemplatePyramid): Prepared template.
+        moving_img (sitk.Image): Scan to register.
+        stats (dict, optional): Receives the optimizer iterations per level and in
+            total, and the final metric value.
+
+    Returns:
+        sitk.Transform: Transform mapping points of the template to the moving image.
+    """
+    transform = sitk.CenteredTransformInitializer(
+        fixed_pyramid.image,
+        moving_img,
+        sitk.Euler3DTransform(),
+        sitk.CenteredTransformInitializerFilter.GEOMETRY,
+    )
+    level_iterations = []
+    for level in fixed_pyramid.levels:
+        registration_method = sitk.ImageRegistrationMethod()
+        registration_method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=50)
+        registration_method.SetMetricSamplingStrategy(registration_method.RANDOM)
+        registration_method.SetMetricSamplingPercentage(0.01)
+        registration_method.SetInterpolator(sitk.sitkLinear)
+        registration_method.SetOptimizerAsGradientDescent(
+            learningRate=1.0,
+            numberOfIterations=100,
+            convergenceMinimumValue=1e-6,
+            convergenceWindowSize=10,
+        )
+        registration_method.SetOptimizerScalesFromPhysicalShift()
+        registration_method.SetInitialTransform(transform)
+        transform = registration_method.Execute(
+            level.image, pyramid_level(moving_img, level.shrink_factor, level.sigma)
+        )
+        level_iterations.append(registration_method.GetOptimizerIteration())
+    if stats is not None:
+        stats["level_iterations"] = level_iterations
+        stats["iterations"] = sum(level_iterations)
+        stats["metric"] = registration_method.GetMetricValue()
+    return transform
+
+
+def register_image(
+    moving_img, fixed_pyramid, bias_corrector=None, id_=None, profile=None
+):
+    """
+    Bias correct and register a scan in memory.
+
+    Args:
+        moving_img (sitk.Image): Scan to register (float32).
+        fixed_pyramid (TemplatePyramid): Prepared template.
+        bias_corrector (BiasFieldCorrector, optional): N4 settings, full N4 by default.
+        id_ (str, optional): Scan identifier, names a saved bias field.
+        profile (ScanProfile, optional): Receives the 'n4', 'optimizer' and 'resample'
+            stages.
+
+    Returns:
+        tuple: (scan resampled onto the template grid, transform).
+    """
+    profile = profile or ScanProfile(id_)
+    with profile.stage("n4"):
+        moving_img = (bias_corrector or BiasFieldCorrector()).correct(moving_img, id_)
+    with profile.stage("optimizer") as record:
+        final_transform = rigid_registration(fixed_pyramid, moving_img, record)
+    with profile.stage("resample"):
+        moving_img_resampled = sitk.Resample(
+            moving_img,
+            fixed_pyramid.image,
+            final_transform,
+            sitk.sitkLinear,
+            0.0,
+            moving_img.GetPixelID(),
+        )
+    return moving_img_resampled, final_transform
+
+
+def resample_label(moving_label, fixed_img, final_transform):
+    """
+    Resample a label onto the template grid with the nearest neighbor.
+    """
+    return sitk.Resample(
+        moving_label,
+        fixed_img,
+        final_transform,
+        sitk.sitkNearestNeighbor,
+        0.0,
+        moving_label.GetPixelID(),
+    )
+
+
+def label_path(img_path):
+    """Path of the label of a scan, '<scan>_label.nii.gz'."""
+    return str(img_path).replace(".nii.gz", "_label.nii.gz")
+
+
+def write_image(image, path):
+    """
+    Write an image through a temporary file, so that a '<id>_0000.nii.gz' of an
+    interrupted write is never taken for a registered scan.
+    """
+    tmp_path = path.replace(".nii.gz", ".tmp.nii.gz")
+    sitk.WriteImage(image, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def register_scan(
+    img_path,
+    fixed_pyramid,
+    output_dir,
+    nnunet_dir,
+    save_tfm=True,
+    bias_corrector=None,
+    profile=None,
+):
+    """
+    Bias correct and register one scan, then write the resampled image, its label
+    (if a '<scan>_label.nii.gz' file exists) and optionally the transform.
+
+    Returns:
+        bool: Whether a label was found and resampled.
+    """
+    id_ = scan_id(img_path)
+    profile = profile or ScanProfile(id_)
+    with profile.stage("read"):
+        moving_img = sitk.ReadImage(img_path, sitk.sitkFloat32)
+    moving_img_resampled, final_transform = register_image(
+        moving_img, fixed_pyramid, bias_corrector, id_, profile
+    )
+    with profile.stage("write"):
+        write_image(moving_img_resampled, os.path.join(output_dir, f"{id_}_0000.nii.gz"))
+        if save_tfm:
+            sitk.WriteTransform(
+                final_transform, os.path.join(output_dir, f"{id_}_T2.tfm")
+            )
+
+    segmentation_loc = label_path(img_path)
+    if not os.path.isfile(segmentation_loc):
+        return False
+    with profile.stage("label"):
+        moving_label = sitk.ReadImage(segmentation_loc, sitk.sitkFloat32)
+        moving_label_resampled = resample_label(
+            moving_label, fixed_pyramid.image, final_transform
+        )
+        os.makedirs(os.path.join(nnunet_dir, "labelsTs"), exist_ok=True)
+        sitk.WriteImage(
+            moving_label_resampled, os.path.join(nnunet_dir, "labelsTs", f"{id_}.nii.gz")
+        )
+    return True
+
+
+def init_worker(cache_dir, cache_key, threads, bias_corrector=None):
+    """
+    Pool initializer: limit the SimpleITK threads, load the prepared template and
+    keep the bias field settings.
+    """
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+    _WORKER["fixed_pyramid"] = TemplateCache(cache_dir).load(cache_key)
+    _WORKER["bias_corrector"] = bias_corrector
+
+
+def run_job(job):
+    """
+    Run a single registration job in a worker.
+
+    Args:
+        job (tuple): (image path, output directory, nnunet directory, save_tfm).
+
+    Returns:
+        dict: Job result with id, status, duration, error, label flag and the stage
+        records of the scan.
+    """
+    img_path, output_dir, nnunet_dir, save_tfm = job
+    start = time.perf_counter()
+    result = {"id": scan_id(img_path), "status": "done", "error": None, "label": False}
+    profile = ScanProfile(result["id"])
+    try:
+        result["label"] = register_scan(
+            img_path,
+            _WORKER["fixed_pyramid"],
+            output_dir,
+            nnunet_dir,
+            save_tfm,
+            _WORKER["bias_corrector"],
+            profile,
+        )
+    except (IOError, RuntimeError) as error:
+        result["status"] = "failed"
+        result["error"] = str(error)
+    result["duration"] = time.perf_counter() - start
+    result["profile"] = profile.records
+    return result
+
+
+class JobLedger:
+    """
+    SQLite backed record of the registration jobs.
+
+    Attributes:
+        db_path (str): Path to the SQLite file.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    duration REAL,
+                    error TEXT,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, img_paths):
+        """
+        Register new scans as pending jobs, known scans keep their status.
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (id, path, status, updated_at)"
+                " VALUES (?, ?, 'pending', ?)",
+                [(scan_id(path), str(path), now) for path in img_paths],
+            )
+
+    def statuses(self):
+        """Mapping scan id -> status of all jobs."""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT id, status FROM jobs"))
+
+    def set_status(self, ids, status):
+        """Set the status of the given jobs."""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                [(status, now, id_) for id_ in ids],
+            )
+
+    def record(self, result):
+        """Store the outcome of a finished job."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, duration = ?,"
+                " error = ?, updated_at = ? WHERE id = ?",
+                (
+                    result["status"],
+                    result["duration"],
+                    result["error"],
+                    datetime.now().isoformat(timespec="seconds"),
+                    result["id"],
+                ),
+            )
+
+    def summary(self):
+        """Number of jobs per status."""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def failures(self):
+        """List of (id, path, error) of the failed jobs."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, path, error FROM jobs WHERE status = 'failed' ORDER BY id"
+            ).fetchall()
+
+
+class RegistrationEngine:
+    """
+    Registers scans to a template in a pool of worker processes.
+
+    Attributes:
+        template_path (str): Path to the template image.
+        output_dir (str): Directory of the registered scans and transforms.
+        nnunet_dir (str): Directory of the nnUNet outputs, labels go to 'labelsTs'.
+        ledger (JobLedger): Persistent record of the jobs.
+        workers (int): Number of worker processes, None for cpu_count() // threads.
+        threads (int): SimpleITK threads per worker.
+        interp_type (str): Interpolator used to resample the template.
+        save_tfm (bool): Whether the transforms are saved.
+        template_cache (TemplateCache): Cache of the prepared template.
+        shrink_factors (tuple): Shrink factors of the pyramid levels.
+        sigmas (tuple): Smoothing sigmas (mm) of the pyramid levels.
+        bias_corrector (BiasFieldCorrector): N4 settings and directory of saved fields.
+        profile_file (str): JSON lines file receiving the stage records of every scan,
+            None to not record them.
+    """
+
+    def __init__(
+        self,
+        template_path,
+        output_dir,
+        nnunet_dir,
+        ledger_file,
+        workers=None,
+        threads=1,
+        interp_type="linear",
+        save_tfm=True,
+        cache_dir=None,
+        shrink_factors=(4, 2, 1),
+        sigmas=(2, 1, 0),
+        bias_corrector=None,
+        profile_file=None,
+    ):
+        if interp_type not in INTERPOLATORS:
+            raise ValueError(
+                f"Unknown interpolator '{interp_type}', expected one of {list(INTERPOLATORS)}."
+            )
+        self.template_path = str(template_path)
+        self.output_dir = str(output_dir)
+        self.nnunet_dir = str(nnunet_dir)
+        self.ledger = JobLedger(ledger_file)
+        self.threads = max(1, threads)
+        self.workers = workers or max(1, cpu_count() // self.threads)
+        self.interp_type = interp_type
+        self.save_tfm = save_tfm
+        self.template_cache = TemplateCache(
+            cache_dir or os.path.join(self.output_dir, "template_cache")
+        )
+        self.shrink_factors = tuple(shrink_factors)
+        self.sigmas = tuple(sigmas)
+        self.bias_corrector = bias_corrector or BiasFieldCorrector()
+        self.profile_file = str(profile_file) if profile_file else None
+
+    def prepare_template(self):
+        """
+        Load the prepared template from the cache, building it on first use.
+
+        Returns:
+            str: Cache key of the prepared template.
+        """
+        key, _ = self.template_cache.get(
+            self.template_path,
+            self.interp_type,
+            shrink_factors=self.shrink_factors,
+            sigmas=self.sigmas,
+        )
+        return key
+
+    def select_jobs(self, input_data, resume=True, retry_failed=False):
+        """
+        Choose the scans to process.
+
+        With resume, finished scans are skipped and failed scans are only run again
+        with retry_failed. Scans registered before the ledger existed are found in the
+        output directory; only scans never attempted (pending) are taken as finished
+        that way, the ledger status of failed and interrupted scans is kept.
+        Without resume every scan is processed.
+        """
+        self.ledger.add(input_data)
+        if not resume:
+            return list(input_data)
+
+        statuses = self.ledger.statuses()
+        finished_on_disk = [
+            id_
+            for id_ in get_processed_files(self.output_dir)
+            if statuses.get(id_) == "pending"
+        ]
+        self.ledger.set_status(finished_on_disk, "done")
+        statuses.update(dict.fromkeys(finished_on_disk, "done"))
+
+        skipped = {"done"} if retry_failed else {"done", "failed"}
+        return [path for path in input_data if statuses[scan_id(path)] not in skipped]
+
+    def run(self, input_data, resume=True, retry_failed=False):
+        """
+        Register the given scans.
+
+        Args:
+            input_data (list): Paths to the MRI scans.
+            resume (bool): Skip scans that are already registered.
+            retry_failed (bool): With resume, also run the scans that failed before.
+
+        Returns:
+            dict: Number of jobs per status in the ledger after the run.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        to_run = sorted(self.select_jobs(input_data, resume, retry_failed))
+        print(
+            f"\tRegistering {len(to_run)} of {len(input_data)} scans with"
+            f" {self.workers} workers x {self.threads} threads."
+        )
+        if to_run:
+            self.ledger.set_status([scan_id(path) for path in to_run], "running")
+            jobs = [
+                (path, self.output_dir, self.nnunet_dir, self.save_tfm) for path in to_run
+            ]
+            # built once here, the workers only read the cache entry
+            init_args = (
+                self.template_cache.cache_dir,
+                self.prepare_template(),
+                self.threads,
+                self.bias_corrector,
+            )
+            workers = min(self.workers, len(jobs))
+            if workers > 1:
+                with Pool(workers, initializer=init_worker, initargs=init_args) as pool:
+                    for result in tqdm(pool.imap_unordered(run_job, jobs), total=len(jobs)):
+                        self.handle_result(result)
+            else:
+                init_worker(*init_args)
+                for job in tqdm(jobs):
+                    self.handle_result(run_job(job))
+
+        summary = self.ledger.summary()
+        print(f"\tRegistration jobs per status: {summary}")
+        return summary
+
+    def handle_result(self, result):
+        """Record a finished job and its profile, and report failures."""
+        self.ledger.record(result)
+        if self.profile_file:
+            append_records(self.profile_file, result["profile"])
+        if result["status"] == "failed":
+            print(f"Error with image {result['id']}: {result['error']}")
+            with open("log_file.txt", "a", encoding="utf-8") as file:
+                file.write(
+                    f"Image is causing trouble: {result['id']}\n Error: {result['error']}\n"
+                )
+        elif not result["label"]:
+            print(f"No corresponding label file for {result['id']}")
+
+
+def get_processed_files(output_dir):
+    """
+    Ids of the scans with a registered image in the output directory.
+    """
+    if not os.path.isdir(output_dir):
+        return set()
+    return {
+        filename.replace("_0000.nii.gz", "")
+        for filename in os.listdir(output_dir)
+        if filename.endswith("_0000.nii.gz")
+    }
@@ -0,0 +1,224 @@
+"""
+Cohort-wide smoothing of volume trajectories.
+
+All patients are packed into flat NumPy arrays (values plus offsets) and the
+smoothing methods of the volume estimation stage (kernel, weighted median,
+moving average and polynomial) are evaluated in batched array operations.
+Patients with the same number of scans are processed together as one dense
+block, which keeps the per-patient results identical to the original loops.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+
+class PackedSeries:
+    """
+    Ragged per-patient scan series stored as flat arrays with offsets.
+
+    Attributes:
+        patient_ids (list): Patient IDs in packing order.
+        records (list): The (age-sorted) scan tuples of each patient.
+        volumes (np.ndarray): Flat array with the volumes of all scans.
+        ages (np.ndarray): Flat array with the ages of all scans as floats.
+        offsets (np.ndarray): Start index of every patient, plus the total length.
+    """
+
+    def __init__(self, patient_ids, records, volumes, ages, offsets):
+        self.patient_ids = patient_ids
+        self.records = records
+        self.volumes = volumes
+        self.ages = ages
+        self.offsets = offsets
+
+    @classmethod
+    def from_scans(cls, scans_by_patient):
+        """
+        Pack a dictionary of scan tuples, i.e. (volume, age) or (date, volume, age).
+
+        The scan lists are sorted by age in place, as the per-patient methods did.
+        """
+        patient_ids = list(scans_by_patient.keys())
+        records = []
+        for patient_id in patient_ids:
+            scans = scans_by_patient[patient_id]
+            scans.sort(key=lambda x: x[-1])  # Sort by age
+            records.append(scans)
+
+        lengths = np.array([len(scans) for scans in records], dtype=np.int64)
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        volumes = np.array(
+            [scan[-2] for scans in records for scan in scans], dtype=np.float64
+        )
+        ages = np.array(
+            [float(scan[-1]) for scans in records for scan in scans], dtype=np.float64
+        )
+        return cls(patient_ids, records, volumes, ages, offsets)
+
+    @property
+    def lengths(self):
+        """Number of scans per patient."""
+        return np.diff(self.offsets)
+
+    def buckets(self):
+        """
+        Group the patients by number of scans.
+
+        Yields:
+            tuple: (number of scans n, indices of the patients, (k, n) matrix with
+            the flat positions of their scans).
+        """
+        lengths = self.lengths
+        for length in np.unique(lengths):
+            patients = np.flatnonzero(lengths == length)
+            rows = self.offsets[patients][:, None] + np.arange(length)
+            yield int(length), patients, rows
+
+    def unpack(self, values, lengths=None):
+        """
+        Rebuild a {patient_id: [scan tuples]} dictionary with the volume replaced.
+
+        Args:
+            values (np.ndarray): Flat array aligned with the packed scans.
+            lengths (np.ndarray, optional): Number of entries to keep per patient.
+
+        Returns:
+            defaultdict(list): Scan tuples with the new values, same layout as the input.
+        """
+        unpacked = defaultdict(list)
+        lengths = self.lengths if lengths is None else lengths
+        for index, patient_id in enumerate(self.patient_ids):
+            start = self.offsets[index]
+            unpacked[patient_id] = [
+                scan[:-2] + (values[start + i], scan[-1])
+                for i, scan in enumerate(self.records[index][: lengths[index]])
+            ]
+        return unpacked
+
+
+def window_positions(length, left_extent, right_extent):
+    """
+    Index matrix of the windows [i - left_extent, i + right_extent] clipped to the series.
+
+    Returns:
+        tuple: ((length, width) positions with invalid entries set to 0,
+        boolean mask of the valid entries).
+    """
+    offsets = np.arange(-left_extent, right_extent + 1)
+    positions = np.arange(length)[:, None] + offsets[None, :]
+    valid = (positions >= 0) & (positions < length)
+    return np.where(valid, positions, 0), valid
+
+
+def resolve_window(window_size, length):
+    """Window size used by the sliding window methods for a series of given length."""
+    return window_size if window_size else max(3, length // 2)
+
+
+def kernel_smoothing(packed, bandwidth_factor=0.1):
+    """
+    Gaussian kernel smoothing of the volumes over age.
+
+    The bandwidth of each patient is max(IQR(volumes) * bandwidth_factor, 1).
+
+    Returns:
+        np.ndarray: Flat array with the smoothed volumes.
+    """
+    smoothed = np.empty_like(packed.volumes)
+    for _, _, rows in packed.buckets():
+        volumes = packed.volumes[rows]
+        ages = packed.ages[rows]
+        q75, q25 = np.percentile(volumes, [75, 25], axis=1)
+        bandwidth = np.maximum((q75 - q25) * bandwidth_factor, 1)
+
+        age_diff = ages[:, None, :] - ages[:, :, None]
+        weights = np.exp(-0.5 * (age_diff / bandwidth[:, None, None]) ** 2)
+        weighted_sum = np.sum(weights * volumes[:, None, :], axis=2)
+        weight_total = np.sum(weights, axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            smoothed[rows] = np.where(
+                weight_total != 0, weighted_sum / weight_total, volumes
+            )
+    return smoothed
+
+
+def weighted_median_smoothing(packed, window_size=None):
+    """
+    Sliding window weighted median with weights 1 / (1 + distance to the center scan).
+
+    Args:
+        window_size (int, optional): Window size, defaults to max(3, n // 2) per patient.
+
+    Returns:
+        np.ndarray: Flat array with the smoothed volumes.
+    """
+    smoothed = np.empty_like(packed.volumes)
+    for length, _, rows in packed.buckets():
+        half = resolve_window(window_size, length) // 2
+        positions, valid = window_positions(length, half, half)
+        distances = np.abs(np.arange(-half, half + 1))
+        weights = np.where(valid, 1 / (1 + distances), 0.0)
+
+        # sequential cumulative weights, as in utils.helper_functions.weighted_median
+        cumulative = np.cumsum(weights, axis=1)
+        midpoint = cumulative[:, -1] / 2
+        median_pos = np.argmax(cumulative >= midpoint[:, None], axis=1)
+        source = positions[np.arange(length), median_pos]
+        smoothed[rows] = packed.volumes[rows][:, source]
+    return smoothed
+
+
+def moving_average(packed, window_size=None):
+    """
+    Centered moving average with min_periods=1, like pandas' rolling(center=True).mean().
+
+    Args:
+        window_size (int, optional): Window size, defaults to max(3, n // 2) per patient.
+
+    Returns:
+        np.ndarray: Flat array with the smoothed volumes.
+    """
+    smoothed = np.empty_like(packed.volumes)
+    for length, _, rows in packed.buckets():
+        window = resolve_window(window_size, length)
+        positions, valid = window_positions(length, window // 2, (window - 1) // 2)
+        windows = packed.volumes[rows][:, positions]
+        total = np.sum(np.where(valid, windows, 0.0), axis=2)
+        smoothed[rows] = total / valid.sum(axis=1)
+    return smoothed
+
+
+def polynomial_smoothing(packed, max_poly_degree=7, num_points=25):
+    """
+    Least squares polynomial fit per patient, evaluated on a regular age grid.
+
+    The degree is min(max(1, n - 1), max_poly_degree). The coefficients are fitted
+    with np.polyfit per patient (its SVD least squares solve of the scaled Vandermonde
+    matrix, so the fits are those of the per-patient implementation), the evaluation
+    on the age grid is batched over all patients with the same number of scans.
+
+    Returns:
+        tuple: (flat array with the fitted volumes on `num_points` equally spaced
+        ages between first and last scan, padded with NaN per patient, number of
+        valid values per patient).
+    """
+    smoothed = np.full_like(packed.volumes, np.nan)
+    for length, _, rows in packed.buckets():
+        degree = min(max(1, length - 1), max_poly_degree)
+        order = degree + 1
+        ages = packed.ages[rows]
+        volumes = packed.volumes[rows]
+        coeffs = np.array(
+            [np.polyfit(age, volume, degree) for age, volume in zip(ages, volumes)]
+        ).reshape(len(rows), order)
+
+        grid = np.linspace(ages[:, 0], ages[:, -1], num_points, axis=1)
+        fitted = np.zeros_like(grid)
+        for power in range(order):
+            fitted = fitted * grid + coeffs[:, power : power + 1]
+        fitted = np.maximum(fitted, 0)
+
+        kept = min(length, num_points)
+        smoothed[rows[:, :kept]] = fitted[:, :kept]
+    return smoothed, np.minimum(packed.lengths, num_points)
@@ -0,0 +1,225 @@
+"""
+Synthetic longitudinal segmentation masks for testing and benchmarking the volume
+estimation without clinical data.
+
+Every patient gets a growth curve (stable, linear, exponential, logistic or
+regression), a baseline volume and a series of scans at increasing ages. Each
+scan is an ellipsoid with the volume of the curve at that age (plus noise),
+written as imageXYZ_patientID_scanID_mask.nii.gz with the age in days as scan
+ID, the file layout of the CBTN data.
+"""
+import os
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+
+from cfg.utils import synthetic_cohort_cfg
+
+
+def growth_factor(curve, years, rate):
+    """
+    Volume relative to the baseline after the given number of years.
+
+    Args:
+        curve (str): 'stable', 'linear', 'exponential', 'logistic' or 'regression'.
+        years (np.ndarray): Time since the first scan in years.
+        rate (float): Speed of the change, relative change per year.
+    """
+    if curve == "stable":
+        return np.ones_like(years)
+    if curve == "linear":
+        return 1 + rate * years
+    if curve == "exponential":
+        return np.exp(rate * years)
+    if curve == "logistic":
+        # grows towards three times the baseline volume
+        return 3 / (1 + 2 * np.exp(-2 * rate * years))
+    if curve == "regression":
+        return np.maximum(np.exp(-rate * years), 0.05)
+    raise ValueError(f"Unknown growth curve '{curve}'.")
+
+
+def ellipsoid_mask(shape, spacing, volume, axes_ratio, center_offset):
+    """
+    Binary ellipsoid with the given volume in mm³, clipped to the array.
+
+    Args:
+        shape (tuple): Array shape (x, y, z) in voxels.
+        spacing (tuple): Voxel spacing (x, y, z) in mm.
+        volume (float): Volume of the ellipsoid in mm³.
+        axes_ratio (tuple): Relative length of the semi-axes, product of 1.
+        center_offset (tuple): Offset of the center from the middle of the array,
+            as fraction of the shape.
+
+    Returns:
+        np.ndarray: Mask in SimpleITK order (z, y, x).
+    """
+    if volume <= 0:
+        return np.zeros(shape[::-1], dtype=np.uint8)
+    radius = (3 * volume / (4 * np.pi)) ** (1 / 3)
+    axes = [radius * ratio for ratio in axes_ratio]
+    grids = [
+        ((np.arange(size) + 0.5 - size * (0.5 + offset)) * step) / axis
+        for size, step, axis, offset in zip(shape, spacing, axes, center_offset)
+    ]
+    x, y, z = grids
+    inside = (
+        x[np.newaxis, np.newaxis, :] ** 2
+        + y[np.newaxis, :, np.newaxis] ** 2
+        + z[:, np.newaxis, np.newaxis] ** 2
+    ) <= 1
+    return inside.astype(np.uint8)
+
+
+def patient_scans(patient_index, rng, settings):
+    """
+    Draw the scans of one patient.
+
+    Returns:
+        list: One dict per scan with patient, age, curve and target volume.
+    """
+    min_scans, max_scans = settings["scans_per_patient"]
+    num_scans = int(rng.integers(min_scans, max_scans + 1))
+    first_age = int(rng.integers(*settings["first_age_days"]))
+    intervals = rng.integers(*settings["scan_interval_days"], size=num_scans - 1)
+    ages = first_age + np.concatenate([[0], np.cumsum(intervals)]).astype(int)
+
+    curves = list(settings["growth_curves"])
+    weights = np.array(list(settings["growth_curves"].values()), dtype=np.float64)
+    curve = curves[rng.choice(len(curves), p=weights / weights.sum())]
+    rate = rng.uniform(0.1, 0.6)
+    baseline = rng.uniform(*settings["baseline_volume"])
+    noise = rng.normal(1, settings["noise_pct"] / 100, size=num_scans)
+    volumes = baseline * growth_factor(curve, (ages - first_age) / 365.25, rate) * noise
+    volumes = np.clip(volumes, 0.0, settings["max_volume"])
+    zero_volume = rng.uniform(size=num_scans) < settings["zero_volume_pct"] / 100
+
+    axes_ratio = rng.uniform(0.8, 1.25, size=3)
+    axes_ratio /= np.prod(axes_ratio) ** (1 / 3)
+    center_offset = rng.uniform(-0.1, 0.1, size=3)
+    patient_id = f"SYN{patient_index:05d}"
+    return [
+        {
+            "file_name": f"image{patient_index:05d}{scan_index:02d}_{patient_id}_{age}_mask.nii.gz",
+            "Patient_ID": patient_id,
+            "Age": int(age),
+            "Growth Curve": curve,
+            "Target Volume": 0.0 if zero else float(volume),
+            "axes_ratio": tuple(axes_ratio),
+            "center_offset": tuple(center_offset),
+        }
+        for scan_index, (age, volume, zero) in enumerate(zip(ages, volumes, zero_volume))
+    ]
+
+
+def write_scan(scan, output_dir, shape, spacing):
+    """
+    Write the mask of one scan and return its volume in mm³ after voxelization.
+    """
+    array = ellipsoid_mask(
+        shape, spacing, scan["Target Volume"], scan["axes_ratio"], scan["center_offset"]
+    )
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(tuple(float(s) for s in spacing))
+    sitk.WriteImage(image, os.path.join(output_dir, scan["file_name"]), True)
+    return float(np.count_nonzero(array) * np.prod(spacing))
+
+
+def generate_cohort(
+    output_dir,
+    num_patients=100,
+    scans_per_patient=(3, 8),
+    first_age_days=(365, 5475),
+    scan_interval_days=(90, 540),
+    shape=(64, 64, 64),
+    spacing=(1.0, 1.0, 1.0),
+    baseline_volume=(500, 15000),
+    noise_pct=5,
+    zero_volume_pct=1,
+    growth_curves=None,
+    seed=42,
+    workers=0,
+):
+    """
+    Write a synthetic cohort of longitudinal masks.
+
+    Args:
+        output_dir (str): Directory of the masks, created if needed.
+        num_patients (int): Number of patients.
+        scans_per_patient (tuple): Inclusive range of the number of scans per patient.
+        first_age_days (tuple): Range of the age at the first scan in days.
+        scan_interval_days (tuple): Range of the time between two scans in days.
+        shape (tuple): Array shape (x, y, z) of the masks.
+        spacing (tuple): Voxel spacing (x, y, z) in mm.
+        baseline_volume (tuple): Range of the volume at the first scan in mm³.
+        noise_pct (float): Standard deviation of the multiplicative volume noise in %.
+        zero_volume_pct (float): Percentage of empty masks.
+        growth_curves (dict, optional): Mapping curve -> share of the patients.
+            Defaults to an equal share of all curves.
+        seed (int): Seed of the random generator, the cohort only depends on it and
+            the other arguments.
+        workers (int): Number of processes writing the files, 0 or 1 writes in this
+            process.
+
+    Returns:
+        pd.DataFrame: One row per scan with file name, patient, age, growth curve,
+        target volume and the volume of the written mask.
+    """
+    settings = {
+        "scans_per_patient": scans_per_patient,
+        "first_age_days": first_age_days,
+        "scan_interval_days": scan_interval_days,
+        "baseline_volume": baseline_volume,
+        "noise_pct": noise_pct,
+        "zero_volume_pct": zero_volume_pct,
+        "growth_curves": growth_curves
+        or {curve: 1 for curve in ["stable", "linear", "exponential", "logistic", "regression"]},
+        # keep the largest ellipsoids well inside the array
+        "max_volume": 0.25 * np.prod(shape) * np.prod(spacing),
+    }
+    rng = np.random.default_rng(seed)
+    scans = [
+        scan
+        for patient_index in range(num_patients)
+        for scan in patient_scans(patient_index, rng, settings)
+    ]
+
+    os.makedirs(output_dir, exist_ok=True)
+    write = partial(write_scan, output_dir=str(output_dir), shape=shape, spacing=spacing)
+    workers = min(workers or 0, cpu_count(), len(scans))
+    if workers > 1:
+        with Pool(workers) as pool:
+            volumes = pool.map(write, scans, chunksize=max(1, len(scans) // (workers * 4)))
+    else:
+        volumes = [write(scan) for scan in scans]
+
+    cohort = pd.DataFrame(scans).drop(columns=["axes_ratio", "center_offset"])
+    cohort["Volume"] = volumes
+    return cohort
+
+
+if __name__ == "__main__":
+    print("Generating synthetic cohort:")
+    cohort_df = generate_cohort(
+        synthetic_cohort_cfg.OUTPUT_DIR,
+        num_patients=synthetic_cohort_cfg.NUM_PATIENTS,
+        scans_per_patient=synthetic_cohort_cfg.SCANS_PER_PATIENT,
+        first_age_days=synthetic_cohort_cfg.FIRST_AGE_DAYS,
+        scan_interval_days=synthetic_cohort_cfg.SCAN_INTERVAL_DAYS,
+        shape=synthetic_cohort_cfg.SHAPE,
+        spacing=synthetic_cohort_cfg.SPACING,
+        baseline_volume=synthetic_cohort_cfg.BASELINE_VOLUME_MM3,
+        noise_pct=synthetic_cohort_cfg.NOISE_PCT,
+        zero_volume_pct=synthetic_cohort_cfg.ZERO_VOLUME_PCT,
+        growth_curves=synthetic_cohort_cfg.GROWTH_CURVES,
+        seed=synthetic_cohort_cfg.SEED,
+        workers=synthetic_cohort_cfg.WORKERS,
+    )
+    cohort_df.to_csv(synthetic_cohort_cfg.COHORT_FILE, index=False)
+    print(
+        f"\tWrote {len(cohort_df)} masks of {cohort_df['Patient_ID'].nunique()} patients"
+        f" to {synthetic_cohort_cfg.OUTPUT_DIR}."
+    )
@@ -0,0 +1,211 @@
+"""
+On-disk cache of the prepared registration template.
+
+The template is resampled to the isotropic registration grid and its
+multi-resolution pyramid (smoothing with the per-level sigma, then shrinking) is
+computed once. Both are stored under a key derived from the content of the
+template file and the preparation parameters, so every registration, in every
+worker process and in later runs, reuses them instead of repeating the
+full-volume resampling for each scan.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+import SimpleITK as sitk
+
+PyramidLevel = namedtuple("PyramidLevel", ["image", "shrink_factor", "sigma"])
+TemplatePyramid = namedtuple("TemplatePyramid", ["image", "levels"])
+
+INTERPOLATORS = {
+    "linear": sitk.sitkLinear,
+    "bspline": sitk.sitkBSpline,
+    "nearest_neighbor": sitk.sitkNearestNeighbor,
+}
+
+
+def resample_template(fixed_img, interp_type="linear", new_spacing=(1, 1, 1)):
+    """
+    Resample the template to an isotropic grid with the given spacing.
+
+    Args:
+        fixed_img (sitk.Image): Template image (float32).
+        interp_type (str): 'linear', 'bspline' or 'nearest_neighbor'.
+        new_spacing (tuple): Output spacing in mm.
+
+    Returns:
+        sitk.Image: Resampled template.
+    """
+    old_size = fixed_img.GetSize()
+    old_spacing = fixed_img.GetSpacing()
+    new_size = [
+        int(round((old_size[i] * old_spacing[i]) / float(new_spacing[i])))
+        for i in range(3)
+    ]
+    resample = sitk.ResampleImageFilter()
+    resample.SetOutputSpacing(new_spacing)
+    resample.SetSize(new_size)
+    resample.SetOutputOrigin(fixed_img.GetOrigin())
+    resample.SetOutputDirection(fixed_img.GetDirection())
+    resample.SetInterpolator(INTERPOLATORS[interp_type])
+    resample.SetDefaultPixelValue(fixed_img.GetPixelIDValue())
+    resample.SetOutputPixelType(sitk.sitkFloat32)
+    return resample.Execute(fixed_img)
+
+
+def smooth(image, sigma):
+    """
+    Gaussian smoothing with a sigma in physical units, as done by the SimpleITK
+    registration for every pyramid level.
+    """
+    if sigma <= 0:
+        return image
+    return sitk.DiscreteGaussian(
+        image,
+        variance=float(sigma) ** 2,
+        maximumKernelWidth=32,
+        maximumError=0.01,
+        useImageSpacing=True,
+    )
+
+
+def pyramid_level(image, shrink_factor, sigma):
+    """
+    Smooth the image with sigma (mm) and shrink it by the given factor.
+    """
+    level = smooth(image, sigma)
+    if shrink_factor > 1:
+        level = sitk.Shrink(level, [int(shrink_factor)] * level.GetDimension())
+    return level
+
+
+def build_template_pyramid(
+    fixed_img, interp_type="linear", spacing=(1, 1, 1), shrink_factors=(4, 2, 1), sigmas=(2, 1, 0)
+):
+    """
+    Resample the template and compute its pyramid levels.
+
+    Returns:
+        TemplatePyramid: Resampled template and one PyramidLevel per shrink factor.
+    """
+    image = resample_template(fixed_img, interp_type, spacing)
+    levels = [
+        PyramidLevel(pyramid_level(image, factor, sigma), factor, sigma)
+        for factor, sigma in zip(shrink_factors, sigmas)
+    ]
+    return TemplatePyramid(image, levels)
+
+
+def template_cache_key(template_path, interp_type, spacing, shrink_factors, sigmas):
+    """
+    Key of a prepared template, from the template content and the parameters.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(template_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    digest.update(
+        json.dumps(
+            {
+                "interp_type": interp_type,
+                "spacing": [float(s) for s in spacing],
+                "shrink_factors": [int(f) for f in shrink_factors],
+                "sigmas": [float(s) for s in sigmas],
+            },
+            sort_keys=True,
+        ).encode()
+    )
+    return digest.hexdigest()
+
+
+class TemplateCache:
+    """
+    Directory of prepared templates, one sub-directory per cache key.
+
+    Attributes:
+        cache_dir (str): Root directory of the cache.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = str(cache_dir)
+
+    def entry_dir(self, key):
+        """Directory of a cache entry."""
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        Load a prepared template, None if it is not cached.
+        """
+        entry_dir = self.entry_dir(key)
+        meta_file = os.path.join(entry_dir, "meta.json")
+        if not os.path.isfile(meta_file):
+            return None
+        with open(meta_file, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        image = sitk.ReadImage(os.path.join(entry_dir, "template.nii"), sitk.sitkFloat32)
+        levels = [
+            PyramidLevel(
+                sitk.ReadImage(os.path.join(entry_dir, level["file"]), sitk.sitkFloat32),
+                level["shrink_factor"],
+                level["sigma"],
+            )
+            for level in meta["levels"]
+        ]
+        return TemplatePyramid(image, levels)
+
+    def save(self, key, pyramid):
+        """
+        Store a prepared template. The entry is written to a temporary directory and
+        renamed, so concurrent readers never see a partial entry.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=f".{key}.")
+        # uncompressed NIfTI, the entries are read by every worker
+        sitk.WriteImage(pyramid.image, os.path.join(temporary_dir, "template.nii"))
+        meta = {"levels": []}
+        for index, level in enumerate(pyramid.levels):
+            file_name = f"level_{index}.nii"
+            sitk.WriteImage(level.image, os.path.join(temporary_dir, file_name))
+            meta["levels"].append(
+                {
+                    "file": file_name,
+                    "shrink_factor": int(level.shrink_factor),
+                    "sigma": float(level.sigma),
+                }
+            )
+        with open(os.path.join(temporary_dir, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        try:
+            os.rename(temporary_dir, self.entry_dir(key))
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+
+    def get(
+        self,
+        template_path,
+        interp_type="linear",
+        spacing=(1, 1, 1),
+        shrink_factors=(4, 2, 1),
+        sigmas=(2, 1, 0),
+    ):
+        """
+        Load the prepared template for the given parameters, building and storing it
+        first if needed.
+
+        Returns:
+            tuple: (cache key, TemplatePyramid).
+        """
+        key = template_cache_key(template_path, interp_type, spacing, shrink_factors, sigmas)
+        pyramid = self.load(key)
+        if pyramid is None:
+            fixed_img = sitk.ReadImage(str(template_path), sitk.sitkFloat32)
+            pyramid = build_template_pyramid(
+                fixed_img, interp_type, spacing, shrink_factors, sigmas
+            )
+            self.save(key, pyramid)
+        return key, pyramid
@@ -0,0 +1,208 @@
+"""
+Sensitivity of the volumetric endpoints to the progression, regression and volume
+change thresholds.
+
+A sweep evaluates a grid of thresholds in one pass over the volumes sorted by
+patient and age, with the endpoint definition of calculate_progression_data: a
+patient progresses at the first scan whose volume reaches the progression
+threshold times the baseline volume, regresses at the first scan at or below the
+regression threshold times the baseline, and the first scan at or above the
+change threshold starts the time gap before the progression. The running maximum
+(minimum) of the volume is monotone within a patient, so the first crossing of
+every threshold is found for all patients and thresholds at once by a binary
+search over the running values, instead of one classification run per threshold
+combination. The volumes are compared with the same products baseline volume *
+threshold as in calculate_progression_data, so both agree on ties; check_sweep()
+verifies it on the data.
+"""
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from utils.helper_functions import calculate_progression_data
+
+CLASSES = ["Progressor", "Stable", "Regressor"]
+
+
+def threshold_grid(progression_thresholds, regression_thresholds, change_thresholds):
+    """
+    All combinations of the thresholds.
+
+    Returns:
+        pd.DataFrame: Columns 'Progression Threshold', 'Regression Threshold' and
+        'Change Threshold', one row per combination.
+    """
+    return pd.DataFrame(
+        list(product(progression_thresholds, regression_thresholds, change_thresholds)),
+        columns=["Progression Threshold", "Regression Threshold", "Change Threshold"],
+    )
+
+
+def segment_running_max(values, starts, lengths):
+    """Running maximum of every segment of values, NaN treated as -inf."""
+    values = np.where(np.isnan(values), -np.inf, values)
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    return pd.Series(values).groupby(segment).cummax().to_numpy()
+
+
+def first_crossings(running_max, starts, lengths, limits):
+    """
+    Position of the first running maximum reaching its limit, per segment.
+
+    The running maximum is non-decreasing within a segment and the segments are
+    contiguous, so (segment, rank of the value) is sorted over the whole array and
+    one searchsorted finds, for all segments and limits, how many values of the
+    segment stay below the limit. Ranks of the values and limits in their union
+    keep the comparisons exact.
+
+    Args:
+        running_max (np.ndarray): Running maximum of the segments, without NaN.
+        starts, lengths (np.ndarray): Start and length of every segment.
+        limits (np.ndarray): Limit of every threshold and segment, shape
+            (thresholds, segments). NaN limits are never reached.
+
+    Returns:
+        tuple: (positions and whether the limit is reached, both of shape
+        (thresholds, segments)). Positions of unreached limits are the segment
+        start.
+    """
+    missing = np.isnan(limits)
+    limits = np.where(missing, np.inf, limits)
+    _, ranks = np.unique(np.concatenate([running_max, limits.ravel()]), return_inverse=True)
+    n_ranks = ranks.max() + 1
+    value_ranks = ranks[: len(running_max)]
+    limit_ranks = ranks[len(running_max) :].reshape(limits.shape)
+
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    keys = segment * n_ranks + value_ranks
+    queries = np.arange(len(starts))[None, :] * n_ranks + limit_ranks
+    below = np.searchsorted(keys, queries, side="left") - starts[None, :]
+    reached = (below < lengths[None, :]) & ~missing
+    return np.where(reached, starts[None, :] + below, starts[None, :]), reached
+
+
+def sweep_thresholds(data, grid):
+    """
+    Volumetric endpoints of all patients for every threshold combination.
+
+    Args:
+        data (pd.DataFrame): Cohort data with 'Patient_ID', 'Age', 'Volume' and
+            'Baseline Volume', sorted by patient and age.
+        grid (pd.DataFrame): Threshold combinations of threshold_grid().
+
+    Returns:
+        pd.DataFrame: One row per combination and patient with the thresholds,
+        'Patient_ID', 'Age at First Progression', 'Age at First Regression',
+        'Age at Volume Change', 'Time Gap' and 'Classification Volumetric'.
+    """
+    patient_ids = data["Patient_ID"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, patient_ids[1:] != patient_ids[:-1]])
+    lengths = np.diff(np.r_[starts, len(data)])
+    age = data["Age"].to_numpy(dtype=float)
+    volume = data["Volume"].to_numpy(dtype=float)
+    baseline_volume = data["Baseline Volume"].to_numpy(dtype=float)[starts]
+    running_growth = segment_running_max(volume, starts, lengths)
+    # volume <= baseline * threshold as -volume >= -(baseline * threshold)
+    running_shrinkage = segment_running_max(-volume, starts, lengths)
+
+    def crossing_ages(running_max, thresholds, sign=1):
+        # first crossing age per unique threshold, rows of the grid index them
+        unique_thresholds, inverse = np.unique(thresholds, return_inverse=True)
+        limits = sign * (baseline_volume[None, :] * unique_thresholds[:, None])
+        positions, reached = first_crossings(running_max, starts, lengths, limits)
+        return np.where(reached, age[positions], np.nan)[inverse], reached[inverse]
+
+    progression_ages, progressed = crossing_ages(
+        running_growth, grid["Progression Threshold"].to_numpy(dtype=float)
+    )
+    regression_ages, regressed = crossing_ages(
+        running_shrinkage, grid["Regression Threshold"].to_numpy(dtype=float), sign=-1
+    )
+    change_ages, changed = crossing_ages(
+        running_growth, grid["Change Threshold"].to_numpy(dtype=float)
+    )
+    change_ages = np.where(progressed, change_ages, np.nan)
+    time_gap = np.where(
+        progressed,
+        np.where(changed & (progression_ages > change_ages), progression_ages - change_ages, 0),
+        np.nan,
+    )
+    # codes of CLASSES
+    classification = np.where(progressed, 0, np.where(regressed, 2, 1))
+
+    results = grid.loc[grid.index.repeat(len(starts))].reset_index(drop=True)
+    results["Patient_ID"] = np.tile(patient_ids[starts], len(grid))
+    results["Age at First Progression"] = progression_ages.ravel()
+    results["Age at First Regression"] = regression_ages.ravel()
+    results["Age at Volume Change"] = change_ages.ravel()
+    results["Time Gap"] = time_gap.ravel()
+    results["Classification Volumetric"] = pd.Categorical.from_codes(
+        classification.ravel(), categories=CLASSES
+    )
+    return results
+
+
+def sweep_summary(results):
+    """
+    Number of progressors, stable patients and regressors, the median time gap of
+    the progressors and the share of progressors per threshold combination.
+    """
+    thresholds = ["Progression Threshold", "Regression Threshold", "Change Threshold"]
+    grouped = results.groupby(thresholds, sort=False)
+    counts = (
+        grouped["Classification Volumetric"]
+        .value_counts(sort=False)
+        .unstack()
+        .reindex(columns=CLASSES, fill_value=0)
+    )
+    counts.columns = list(CLASSES)
+    counts["Progressor Pct"] = 100 * counts["Progressor"] / counts[CLASSES].sum(axis=1)
+    counts["Median Time Gap"] = grouped["Time Gap"].median()
+    return counts.reset_index()
+
+
+def check_sweep(
+    data, progression_threshold, regression_threshold, change_threshold, time_period_mapping
+):
+    """
+    Compare the sweep at one threshold combination with calculate_progression_data.
+
+    Args:
+        data (pd.DataFrame): Cohort data of calculate_progression_data, sorted by
+            patient and age.
+        progression_threshold, regression_threshold, change_threshold (float): Factors
+            of the baseline volume, e.g. the configured ones.
+        time_period_mapping (dict): Numeric value of every time period.
+
+    Raises:
+        ValueError: If an endpoint of a patient differs.
+    """
+    grid = threshold_grid([progression_threshold], [regression_threshold], [change_threshold])
+    sweep = sweep_thresholds(data, grid).set_index("Patient_ID")
+    expected = calculate_progression_data(
+        data, progression_threshold, regression_threshold, change_threshold, time_period_mapping
+    )
+    columns = [
+        "Age at First Progression",
+        "Age at First Regression",
+        "Age at Volume Change",
+        "Time Gap",
+    ]
+    mismatches = set()
+    for column in columns:
+        swept, calculated = sweep[column].to_numpy(), expected[column].to_numpy()
+        same = (swept == calculated) | (np.isnan(swept) & np.isnan(calculated))
+        mismatches.update(expected.index[~same])
+    classification = np.where(
+        expected["Age at First Progression"].notna(),
+        "Progressor",
+        np.where(expected["Age at First Regression"].notna(), "Regressor", "Stable"),
+    )
+    different = sweep["Classification Volumetric"].astype(object).to_numpy() != classification
+    mismatches.update(expected.index[different])
+    if mismatches:
+        raise ValueError(
+            f"Threshold sweep differs from calculate_progression_data for {len(mismatches)}"
+            f" patients, e.g. {sorted(mismatches, key=str)[:5]}."
+        )
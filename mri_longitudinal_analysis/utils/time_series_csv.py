@@ -0,0 +1,140 @@
+"""
+Bulk loading of the per-patient time series CSV files of the volume estimation.
+
+The '<patient>_<method>.csv' files of a directory are read concurrently in a
+thread pool, which keeps the disk busy, and grouped by their header line. The
+bodies of all files with the same columns are joined and parsed by a single
+pd.read_csv call with the column types of the files written by generate_csv,
+instead of paying the fixed cost of the parser for every small file. The
+patient of every row is taken from the file name and the rows keep the order of
+the files.
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Columns with a fixed type in the files of the volume estimation. Scan_ID, Age,
+# Date, change point and lesion columns depend on the data set and are inferred.
+FLOAT_COLUMNS = [
+    "Days Between Scans",
+    "Volume",
+    "Volume Median",
+    "Volume Avg",
+    "Volume Std",
+    "Normalized Volume",
+    "Normalized Volume Median",
+    "Normalized Volume Avg",
+    "Normalized Volume Std",
+    "Baseline Volume",
+    "Volume Change",
+    "Volume Change Median",
+    "Volume Change Avg",
+    "Volume Change Std",
+    "Volume Change Pct",
+    "Volume Change Pct Median",
+    "Volume Change Pct Avg",
+    "Volume Change Pct Std",
+    "Volume Change Rate",
+    "Volume Change Rate Median",
+    "Volume Change Rate Avg",
+    "Volume Change Rate Std",
+    "Volume Change Rate Pct",
+    "Volume Change Rate Pct Median",
+    "Volume Change Rate Pct Avg",
+    "Volume Change Rate Pct Std",
+    "Relative Volume Change Pct",
+    "Cumulative Volume Change Pct",
+    "AUC",
+    "Coefficient of Variation",
+    "Rolling Volume Change Average",
+]
+STRING_COLUMNS = ["Change Speed", "Change Type", "Change Trend", "Change Acceleration"]
+VOLUME_CSV_DTYPES = {
+    **{column: "float64" for column in FLOAT_COLUMNS},
+    **{column: str for column in STRING_COLUMNS},
+}
+
+
+def list_volume_csvs(directory):
+    """Paths of the CSV files in a directory, in directory order."""
+    return [
+        os.path.join(directory, file)
+        for file in os.listdir(directory)
+        if file.endswith(".csv")
+    ]
+
+
+def read_bytes(path):
+    """Content of a file."""
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def parse_csv(content):
+    """Parse CSV content with the fixed column types."""
+    return pd.read_csv(io.BytesIO(content), dtype=VOLUME_CSV_DTYPES)
+
+
+def parse_group(header, bodies):
+    """
+    Parse the bodies of files sharing a header in one call.
+
+    Returns:
+        tuple: (DataFrame of all rows, number of rows per file).
+    """
+    data = parse_csv(header + b"\n" + b"".join(bodies))
+    rows = [body.count(b"\n") for body in bodies]
+    if sum(rows) != len(data):
+        # blank lines or quoted line breaks, parse the files one by one
+        frames = [parse_csv(header + b"\n" + body) for body in bodies]
+        data = pd.concat(frames, ignore_index=True, sort=False)
+        rows = [len(frame) for frame in frames]
+    return data, rows
+
+
+def read_volume_csvs(paths, workers=8):
+    """
+    Read time series files concurrently and parse them grouped by their columns.
+
+    Args:
+        paths (list): Paths of '<patient>_<method>.csv' files.
+        workers (int): Number of reading threads, 0 or 1 reads in this thread.
+
+    Returns:
+        pd.DataFrame: Rows of all files in the order of the paths, with a 'Patient_ID'
+        column from the file names. Columns missing in a file are NaN.
+    """
+    if not paths:
+        return pd.DataFrame(columns=["Patient_ID"])
+    workers = min(workers or 0, len(paths))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            contents = list(executor.map(read_bytes, paths))
+    else:
+        contents = [read_bytes(path) for path in paths]
+
+    groups = {}
+    for index, content in enumerate(contents):
+        header, _, body = content.partition(b"\n")
+        if body and not body.endswith(b"\n"):
+            body += b"\n"
+        indices, bodies = groups.setdefault(header.rstrip(b"\r"), ([], []))
+        indices.append(index)
+        bodies.append(body)
+
+    frames = []
+    for header, (indices, bodies) in groups.items():
+        data, rows = parse_group(header, bodies)
+        frames.append(data.assign(_file=np.repeat(indices, rows)))
+    data = pd.concat(frames, ignore_index=True, sort=False)
+    if len(groups) > 1:
+        data = data.sort_values("_file", kind="stable", ignore_index=True)
+
+    patient_ids = np.array(
+        [os.path.basename(path).split("_")[0] for path in paths], dtype=object
+    )
+    data["Patient_ID"] = patient_ids[data.pop("_file").to_numpy()]
+    return data
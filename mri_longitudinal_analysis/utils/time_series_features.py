@@ -0,0 +1,269 @@
+"""
+Cohort-wide derivation of the time series features written by the volume estimation.
+
+The scans of all patients (and smoothing methods) are stacked into one long
+DataFrame in which the rows of every series are contiguous. Summary statistics
+are computed with grouped pandas transforms, the volume change rates are
+attached with a keyed join and the per-series regressions (linear fit, quadratic
+fit, area under the curve) are evaluated in closed form with segment sums, so
+that the cost grows linearly with the total number of scans.
+"""
+import numpy as np
+import pandas as pd
+
+SUMMARY_STATS = {"Median": "median", "Avg": "mean", "Std": "std"}
+SERIES_KEY = "Series"
+
+
+def series_bounds(codes):
+    """
+    Start index and length of every contiguous series in the array of series codes.
+    """
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    lengths = np.diff(np.r_[starts, len(codes)])
+    return starts, lengths
+
+
+def segment_sum(codes, values, num_series):
+    """Sum of the values per series code."""
+    return np.bincount(codes, weights=values, minlength=num_series)
+
+
+def add_summary_stats(data, column):
+    """Add the '<column> Median', '<column> Avg' and '<column> Std' columns."""
+    grouped = data.groupby(SERIES_KEY, sort=False)[column]
+    for suffix, func in SUMMARY_STATS.items():
+        data[f"{column} {suffix}"] = grouped.transform(func)
+
+
+def grouped_pct_change(data, column):
+    """
+    Percentage change within each series, with the forward filling of pandas'
+    default pct_change.
+    """
+    filled = data.groupby(SERIES_KEY, sort=False)[column].ffill()
+    previous = filled.groupby(data[SERIES_KEY], sort=False).shift(1)
+    return (filled / previous - 1) * 100
+
+
+def centered_moments(codes, x, y, valid, num_series):
+    """
+    Per series count, means and centered values of x and y over the valid rows.
+    """
+    weights = valid.astype(np.float64)
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    count = segment_sum(codes, weights, num_series)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = segment_sum(codes, x, num_series) / count
+        mean_y = segment_sum(codes, y, num_series) / count
+    x_c = np.where(valid, x - mean_x[codes], 0.0)
+    y_c = np.where(valid, y - mean_y[codes], 0.0)
+    return count, x_c, y_c
+
+
+def change_type(codes, ages, volumes, num_series, r_squared_threshold=0.8):
+    """
+    'Linear' if the squared Pearson correlation between age and volume of a series
+    reaches the threshold, 'Non-linear' otherwise (same r as scipy's linregress).
+
+    Returns:
+        np.ndarray: Change type per series.
+    """
+    valid = ~(np.isnan(ages) | np.isnan(volumes))
+    _, x_c, y_c = centered_moments(codes, ages, volumes, valid, num_series)
+    s_xy = segment_sum(codes, x_c * y_c, num_series)
+    s_xx = segment_sum(codes, x_c * x_c, num_series)
+    s_yy = segment_sum(codes, y_c * y_c, num_series)
+    denominator = np.sqrt(s_xx * s_yy)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_value = np.where(denominator != 0, s_xy / denominator, 0.0)
+    r_value = np.clip(r_value, -1.0, 1.0)
+    return np.where(r_value**2 >= r_squared_threshold, "Linear", "Non-linear")
+
+
+def quadratic_coefficient(codes, ages, volumes, num_series):
+    """
+    Quadratic coefficient of the least squares fit volume ~ 1 + age + age² per series.
+
+    Full rank fits are solved in the better conditioned basis (age - mean,
+    (age - mean)²), which has the same quadratic coefficient. Rank deficient fits
+    (fewer than three distinct ages) return the minimum norm solution in the
+    original basis, like sklearn's LinearRegression.
+    """
+    valid = ~(np.isnan(ages) | np.isnan(volumes))
+    count, x_c, y_c = centered_moments(codes, ages, volumes, valid, num_series)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        square = np.where(valid, x_c * x_c, 0.0)
+        q_c = np.where(valid, square - (segment_sum(codes, square, num_series) / count)[codes], 0.0)
+        g_xx = segment_sum(codes, x_c * x_c, num_series)
+        g_xq = segment_sum(codes, x_c * q_c, num_series)
+        g_qq = segment_sum(codes, q_c * q_c, num_series)
+        b_x = segment_sum(codes, x_c * y_c, num_series)
+        b_q = segment_sum(codes, q_c * y_c, num_series)
+        determinant = g_xx * g_qq - g_xq * g_xq
+        full_rank = determinant > 1e-12 * g_xx * g_qq
+        coefficient_full = (g_xx * b_q - g_xq * b_x) / determinant
+
+        raw_square = np.where(valid, ages * ages, 0.0)
+        w_c = np.where(
+            valid, raw_square - (segment_sum(codes, raw_square, num_series) / count)[codes], 0.0
+        )
+        g_xw = segment_sum(codes, x_c * w_c, num_series)
+        g_ww = segment_sum(codes, w_c * w_c, num_series)
+        b_w = segment_sum(codes, w_c * y_c, num_series)
+        coefficient_rank1 = (g_xw * b_x + g_ww * b_w) / (g_xx + g_ww) ** 2
+
+    coefficient = np.where(full_rank, coefficient_full, coefficient_rank1)
+    return np.nan_to_num(coefficient, nan=0.0)
+
+
+def area_under_curve(codes, ages, values, num_series):
+    """
+    Trapezoidal area under the values over age per series, with the direction
+    handling of sklearn.metrics.auc (decreasing ages give a positive area).
+
+    Raises:
+        ValueError: If the ages of a series are neither increasing nor decreasing.
+    """
+    valid = ~(np.isnan(ages) | np.isnan(values))
+    codes, ages, values = codes[valid], ages[valid], values[valid]
+    same_series = codes[1:] == codes[:-1]
+    segment_codes = codes[1:][same_series]
+    d_x = (ages[1:] - ages[:-1])[same_series]
+    areas = d_x * (values[1:] + values[:-1])[same_series] / 2.0
+
+    decreasing = np.bincount(segment_codes, weights=d_x < 0, minlength=num_series) > 0
+    increasing = np.bincount(segment_codes, weights=d_x > 0, minlength=num_series) > 0
+    if np.any(decreasing & increasing):
+        raise ValueError(
+            "x is neither increasing nor decreasing for series "
+            f"{np.flatnonzero(decreasing & increasing).tolist()}."
+        )
+    direction = np.where(decreasing, -1.0, 1.0)
+    return direction * segment_sum(segment_codes, areas, num_series)
+
+
+def derive_features(data, change_rates):
+    """
+    Derive the volume, change and trend features for all series at once.
+
+    Args:
+        data (pd.DataFrame): Stacked scans with the columns 'Series' (integer code,
+            rows of a series must be contiguous), 'Patient_ID', 'Age' and 'Volume'.
+        change_rates (pd.DataFrame): Columns 'Patient_ID', 'Age' and
+            'Volume Change Rate'; the first rate of a (patient, age) pair is used.
+
+    Returns:
+        pd.DataFrame: The input with all feature columns added, in input row order.
+    """
+    data = data.reset_index(drop=True)
+    codes = data[SERIES_KEY].to_numpy()
+    starts, lengths = series_bounds(codes)
+    num_series = len(starts)
+    # relabel to 0..num_series-1 so the codes can be used for segment sums
+    codes = np.repeat(np.arange(num_series), lengths)
+    data[SERIES_KEY] = codes
+    grouped = data.groupby(SERIES_KEY, sort=False)
+
+    volumes = data["Volume"].to_numpy(dtype=np.float64)
+    ages = data["Age"].to_numpy(dtype=np.float64)
+
+    baseline = np.repeat(volumes[starts], lengths)
+    data["Baseline Volume"] = baseline
+
+    add_summary_stats(data, "Age")
+    add_summary_stats(data, "Volume")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        data["Normalized Volume"] = np.where(baseline != 0, volumes / baseline, 0.0)
+    add_summary_stats(data, "Normalized Volume")
+
+    data["Volume Change"] = grouped["Volume"].diff()
+    add_summary_stats(data, "Volume Change")
+    data["Volume Change Pct"] = grouped_pct_change(data, "Volume")
+    add_summary_stats(data, "Volume Change Pct")
+
+    # keyed join instead of a linear search per scan
+    rates = change_rates.assign(_age_key=change_rates["Age"].astype(np.float64))
+    rates = rates.drop_duplicates(["Patient_ID", "_age_key"], keep="first")
+    data["_age_key"] = ages
+    data = data.merge(
+        rates[["Patient_ID", "_age_key", "Volume Change Rate"]],
+        on=["Patient_ID", "_age_key"],
+        how="left",
+    ).drop(columns="_age_key")
+    data["Volume Change Rate"] = data["Volume Change Rate"].astype(np.float64)
+    add_summary_stats(data, "Volume Change Rate")
+    data["Volume Change Rate Pct"] = grouped_pct_change(data, "Volume Change Rate")
+    add_summary_stats(data, "Volume Change Rate Pct")
+
+    # Change speed: np.percentile of a series containing NaN is NaN, i.e. 'rapid'
+    rate_pct = data["Volume Change Rate Pct"]
+    grouped_rate_pct = rate_pct.groupby(data[SERIES_KEY], sort=False)
+    has_nan = rate_pct.isna().groupby(data[SERIES_KEY], sort=False).transform("any")
+    q25 = grouped_rate_pct.transform("quantile", 0.25).where(~has_nan)
+    q75 = grouped_rate_pct.transform("quantile", 0.75).where(~has_nan)
+    avg_rate_pct = data["Volume Change Rate Pct Avg"]
+    data["Change Speed"] = np.select(
+        [avg_rate_pct < q25, avg_rate_pct < q75], ["slow", "moderate"], "rapid"
+    )
+
+    data["Change Type"] = change_type(codes, ages, volumes, num_series)[codes]
+
+    trend = np.sign(data["Volume Change Rate Avg"].to_numpy())
+    data["Change Trend"] = np.select(
+        [trend > 0, trend < 0], ["Increasing", "Decreasing"], "Stable"
+    )
+
+    quadratic = quadratic_coefficient(codes, ages, volumes, num_series)
+    data["Change Acceleration"] = np.where(quadratic > 0, "Increasing", "Decreasing")[codes]
+
+    relative_change = (data["Volume"] - data["Baseline Volume"]) / data["Baseline Volume"] * 100
+    data["Relative Volume Change Pct"] = relative_change
+    data["Cumulative Volume Change Pct"] = relative_change.groupby(
+        data[SERIES_KEY], sort=False
+    ).cumsum()
+    data["AUC"] = area_under_curve(
+        codes, ages, data["Normalized Volume"].to_numpy(dtype=np.float64), num_series
+    )[codes]
+    data["Coefficient of Variation"] = data["Volume Std"] / data["Volume Avg"]
+    data["Rolling Volume Change Average"] = (
+        data.groupby(SERIES_KEY, sort=False)["Volume Change"]
+        .rolling(window=3)
+        .mean()
+        .reset_index(level=0, drop=True)
+    )
+    return data
+
+
+def stack_series(series_by_method, columns):
+    """
+    Stack the scan tuples of all methods and patients into one long DataFrame.
+
+    Args:
+        series_by_method (dict): Mapping method -> {patient_id: [scan tuples]}.
+        columns (list): Column names of the scan tuples, e.g. ['Volume', 'Age'].
+
+    Returns:
+        pd.DataFrame: Scans with the additional columns 'method', 'Patient_ID' and
+        'Series' (one code per method and patient, rows kept in input order).
+    """
+    records = []
+    methods = []
+    patient_ids = []
+    lengths = []
+    for method, series in series_by_method.items():
+        for patient_id, scans in series.items():
+            records.extend(scans)
+            methods.append(method)
+            patient_ids.append(patient_id)
+            lengths.append(len(scans))
+
+    data = pd.DataFrame(records, columns=columns)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    data["method"] = np.repeat(np.asarray(methods, dtype=object), lengths)
+    data["Patient_ID"] = np.repeat(np.asarray(patient_ids, dtype=object), lengths)
+    data[SERIES_KEY] = np.repeat(np.arange(len(lengths)), lengths)
+    return data
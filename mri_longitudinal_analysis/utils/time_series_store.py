@@ -0,0 +1,187 @@
+"""
+Columnar storage for the per-patient time series produced by the volume estimation.
+
+All patients and smoothing methods are kept in one Parquet dataset that is
+partitioned by `method` (hive layout, e.g. `method=kernel/part-0.parquet`). Every
+partition is sorted by `Patient_ID` with one row group per patient, so readers can
+select columns and push filters on method and patient down to the file level
+instead of opening thousands of small CSV files.
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARTITION_KEY = "method"
+CATEGORICAL_COLUMNS = ["Change Speed", "Change Type", "Change Trend", "Change Acceleration"]
+
+
+def is_time_series_store(path):
+    """
+    Check whether the given path points to a time series Parquet dataset.
+    """
+    path = str(path)
+    if not os.path.isdir(path):
+        return False
+    if path.rstrip(os.sep).endswith(".parquet"):
+        return True
+    return any(entry.startswith(f"{PARTITION_KEY}=") for entry in os.listdir(path))
+
+
+def to_arrow_table(data):
+    """
+    Convert a time series DataFrame to an Arrow table with explicit column types.
+    """
+    data = data.copy()
+    data["Patient_ID"] = data["Patient_ID"].astype(str)
+    for column in CATEGORICAL_COLUMNS:
+        if column in data.columns:
+            data[column] = data[column].astype(str).astype("category")
+    for column in ["Date", "Scan_ID"]:
+        if column in data.columns:
+            data[column] = data[column].astype(str)
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+def write_method_partition(data, store_dir, method):
+    """
+    Write (or replace) the partition of one smoothing method.
+
+    Args:
+        data (pd.DataFrame): Time series of all patients, with a 'Patient_ID' column.
+        store_dir (str): Root directory of the dataset.
+        method (str): Smoothing method, e.g. 'kernel' or 'moving_average'.
+    """
+    partition_dir = os.path.join(str(store_dir), f"{PARTITION_KEY}={method}")
+    if os.path.isdir(partition_dir):
+        shutil.rmtree(partition_dir)
+    os.makedirs(partition_dir, exist_ok=True)
+    if data.empty:
+        return
+
+    data = data.drop(columns=[PARTITION_KEY], errors="ignore")
+    data = data.sort_values("Patient_ID", kind="stable").reset_index(drop=True)
+    table = to_arrow_table(data)
+
+    # one row group per patient, so that patient filters only touch their own rows
+    patient_ids = data["Patient_ID"].astype(str).to_numpy()
+    boundaries = np.flatnonzero(patient_ids[1:] != patient_ids[:-1]) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(data)]])
+    with pq.ParquetWriter(
+        os.path.join(partition_dir, "part-0.parquet"), table.schema
+    ) as writer:
+        for start, end in zip(starts, ends):
+            writer.write_table(table.slice(start, end - start))
+
+
+def write_time_series_store(data_by_method, store_dir):
+    """
+    Write the time series of several smoothing methods into the dataset.
+
+    Args:
+        data_by_method (dict): Mapping method -> DataFrame with all patients.
+        store_dir (str): Root directory of the dataset.
+    """
+    os.makedirs(str(store_dir), exist_ok=True)
+    for method, data in data_by_method.items():
+        write_method_partition(data, store_dir, method)
+
+
+def build_filter(method=None, patient_ids=None):
+    """
+    Build a pyarrow filter expression on method and patient ids.
+    """
+    expression = None
+    if method is not None:
+        methods = [method] if isinstance(method, str) else list(method)
+        expression = ds.field(PARTITION_KEY).isin(methods)
+    if patient_ids is not None:
+        patient_filter = ds.field("Patient_ID").isin([str(p) for p in patient_ids])
+        expression = (
+            patient_filter if expression is None else expression & patient_filter
+        )
+    return expression
+
+
+def open_time_series_store(store_dir):
+    """
+    Open the dataset with its hive partitioning on the method.
+    """
+    return ds.dataset(str(store_dir), format="parquet", partitioning="hive")
+
+
+def list_store_patients(store_dir, method=None):
+    """
+    Sorted list of the patient ids present in the dataset (reads only 'Patient_ID').
+    """
+    dataset = open_time_series_store(store_dir)
+    table = dataset.to_table(columns=["Patient_ID"], filter=build_filter(method))
+    return sorted(set(table.column("Patient_ID").to_pylist()))
+
+
+def read_time_series_store(store_dir, method=None, columns=None, patient_ids=None):
+    """
+    Load time series from the dataset as one DataFrame.
+
+    Args:
+        store_dir (str): Root directory of the dataset.
+        method (str or list, optional): Smoothing method(s) to load. Defaults to all.
+        columns (list, optional): Columns to load ('Patient_ID' and 'method' are
+            always included). Columns missing from the dataset are ignored.
+        patient_ids (iterable, optional): Only load these patients.
+
+    Returns:
+        pd.DataFrame: Time series sorted by method and patient, in file order.
+    """
+    dataset = open_time_series_store(store_dir)
+    if columns is not None:
+        available = set(dataset.schema.names)
+        columns = ["Patient_ID", PARTITION_KEY] + [
+            column
+            for column in columns
+            if column in available and column not in ("Patient_ID", PARTITION_KEY)
+        ]
+    table = dataset.to_table(
+        columns=columns, filter=build_filter(method, patient_ids)
+    )
+    data = table.to_pandas()
+    data["Patient_ID"] = data["Patient_ID"].astype("string")
+    data[PARTITION_KEY] = data[PARTITION_KEY].astype(str).astype("category")
+    return data
+
+
+def update_time_series_store(data_by_method, store_dir, replaced_patients):
+    """
+    Replace the rows of some patients in the dataset and keep all other patients.
+
+    Args:
+        data_by_method (dict): Mapping method -> DataFrame with the new rows.
+        store_dir (str): Root directory of the dataset.
+        replaced_patients (iterable): Patients whose previous rows are dropped in
+            every partition (updated and removed patients).
+    """
+    replaced = [str(patient_id) for patient_id in replaced_patients]
+    methods = set(data_by_method)
+    if os.path.isdir(str(store_dir)):
+        methods.update(
+            entry.split("=", 1)[1]
+            for entry in os.listdir(str(store_dir))
+            if entry.startswith(f"{PARTITION_KEY}=")
+        )
+
+    for method in sorted(methods):
+        partition_dir = os.path.join(str(store_dir), f"{PARTITION_KEY}={method}")
+        frames = []
+        if os.path.isdir(partition_dir) and os.listdir(partition_dir):
+            existing = read_time_series_store(store_dir, method=method)
+            existing = existing[~existing["Patient_ID"].isin(replaced)]
+            frames.append(existing.drop(columns=[PARTITION_KEY]))
+        if method in data_by_method:
+            frames.append(data_by_method[method])
+        data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        write_method_partition(data, store_dir, method)
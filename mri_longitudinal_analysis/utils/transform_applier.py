@@ -0,0 +1,221 @@
+"""
+Apply saved registration transforms to images and labels without registering again.
+
+The registration (see utils.registration_engine) writes the rigid transform of
+every scan to '<id>_T2.tfm'. Here these transforms are read back and any image
+of the scan (the scan itself, its label or another sequence named '<id>_*') is
+resampled onto the cached template grid, in a pool of worker processes. Labels
+are resampled with the nearest neighbor interpolator, images with the
+configured one, so outputs can be exported again with another interpolator
+without running N4 and the optimizer.
+"""
+import os
+import time
+from multiprocessing import Pool, cpu_count
+
+import SimpleITK as sitk
+from tqdm import tqdm
+
+from utils.registration_engine import scan_id
+from utils.template_cache import INTERPOLATORS, TemplateCache
+
+# state of a worker process, set once by the pool initializer
+_WORKER = {}
+
+
+def is_label(img_path):
+    """Whether a file is a label, the convention of the registration inputs."""
+    return "label" in os.path.basename(img_path)
+
+
+def match_transform(img_path, transform_ids):
+    """
+    Transform id of an image: its own id or the longest id that is a '_' separated
+    prefix of it, e.g. 'scan_label' and 'scan_T1' both use the transform of 'scan'.
+
+    Returns:
+        str: Matching id, None if no transform belongs to the image.
+    """
+    parts = scan_id(img_path).split("_")
+    for end in range(len(parts), 0, -1):
+        candidate = "_".join(parts[:end])
+        if candidate in transform_ids:
+            return candidate
+    return None
+
+
+def get_transform_ids(transform_dir):
+    """Ids of the scans with a saved transform in the directory."""
+    if not os.path.isdir(transform_dir):
+        return set()
+    return {
+        filename[: -len("_T2.tfm")]
+        for filename in os.listdir(transform_dir)
+        if filename.endswith("_T2.tfm")
+    }
+
+
+def resample_with_transform(img_path, tfm_path, fixed_img, interpolator):
+    """
+    Resample an image onto the template grid with a saved transform.
+
+    Images are resampled as float32, labels keep their pixel type.
+    """
+    if is_label(img_path):
+        moving_img = sitk.ReadImage(img_path)
+    else:
+        moving_img = sitk.ReadImage(img_path, sitk.sitkFloat32)
+    transform = sitk.ReadTransform(tfm_path)
+    return sitk.Resample(
+        moving_img, fixed_img, transform, interpolator, 0.0, moving_img.GetPixelID()
+    )
+
+
+def init_worker(cache_dir, cache_key, threads):
+    """
+    Pool initializer: limit the SimpleITK threads and load the template grid.
+    """
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+    _WORKER["fixed_img"] = TemplateCache(cache_dir).load(cache_key).image
+
+
+def run_job(job):
+    """
+    Resample a single image in a worker.
+
+    Args:
+        job (tuple): (image path, transform path, output path, interpolator).
+
+    Returns:
+        dict: Job result with id, status, duration and error.
+    """
+    img_path, tfm_path, output_path, interpolator = job
+    start = time.perf_counter()
+    result = {"id": scan_id(img_path), "status": "done", "error": None}
+    try:
+        resampled = resample_with_transform(
+            img_path, tfm_path, _WORKER["fixed_img"], interpolator
+        )
+        sitk.WriteImage(resampled, output_path)
+    except (IOError, RuntimeError) as error:
+        result["status"] = "failed"
+        result["error"] = str(error)
+    result["duration"] = time.perf_counter() - start
+    return result
+
+
+class TransformApplier:
+    """
+    Resamples images onto the template grid with the saved transforms, in a pool of
+    worker processes.
+
+    Attributes:
+        template_path (str): Path to the template image.
+        transform_dir (str): Directory of the saved '<id>_T2.tfm' transforms.
+        output_dir (str): Directory of the resampled images, named as their inputs.
+        interp_type (str): Interpolator of the images.
+        label_interp_type (str): Interpolator of the labels.
+        template_cache (TemplateCache): Cache of the prepared template.
+        template_interp_type (str): Interpolator the template was resampled with at
+            registration, selects the cached template grid.
+        workers (int): Number of worker processes.
+        threads (int): SimpleITK threads per worker.
+    """
+
+    def __init__(
+        self,
+        template_path,
+        transform_dir,
+        output_dir,
+        interp_type="linear",
+        label_interp_type="nearest_neighbor",
+        cache_dir=None,
+        template_interp_type="linear",
+        workers=None,
+        threads=1,
+    ):
+        for interp in (interp_type, label_interp_type, template_interp_type):
+            if interp not in INTERPOLATORS:
+                raise ValueError(
+                    f"Unknown interpolator '{interp}', expected one of {list(INTERPOLATORS)}."
+                )
+        self.template_path = str(template_path)
+        self.transform_dir = str(transform_dir)
+        self.output_dir = str(output_dir)
+        self.interp_type = interp_type
+        self.label_interp_type = label_interp_type
+        self.template_cache = TemplateCache(
+            cache_dir or os.path.join(self.transform_dir, "template_cache")
+        )
+        self.template_interp_type = template_interp_type
+        self.threads = max(1, threads)
+        self.workers = workers or max(1, cpu_count() // self.threads)
+
+    def build_jobs(self, input_data):
+        """
+        Pair the images with their transforms.
+
+        Returns:
+            tuple: (list of jobs, list of images without a saved transform).
+        """
+        transform_ids = get_transform_ids(self.transform_dir)
+        jobs, missing = [], []
+        for img_path in sorted(input_data):
+            id_ = match_transform(img_path, transform_ids)
+            if id_ is None:
+                missing.append(img_path)
+                continue
+            interp_type = self.label_interp_type if is_label(img_path) else self.interp_type
+            jobs.append(
+                (
+                    str(img_path),
+                    os.path.join(self.transform_dir, f"{id_}_T2.tfm"),
+                    os.path.join(self.output_dir, os.path.basename(img_path)),
+                    INTERPOLATORS[interp_type],
+                )
+            )
+        return jobs, missing
+
+    def run(self, input_data):
+        """
+        Resample the given images and labels.
+
+        Args:
+            input_data (list): Paths to the images and labels.
+
+        Returns:
+            dict: Number of images per status, 'missing' counts the images without a
+            saved transform.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        jobs, missing = self.build_jobs(input_data)
+        for img_path in missing:
+            print(f"No saved transform for {scan_id(img_path)}")
+        print(
+            f"\tApplying transforms to {len(jobs)} of {len(input_data)} images with"
+            f" {self.workers} workers x {self.threads} threads."
+        )
+        summary = {"done": 0, "failed": 0, "missing": len(missing)}
+        if not jobs:
+            return summary
+
+        key, _ = self.template_cache.get(self.template_path, self.template_interp_type)
+        init_args = (self.template_cache.cache_dir, key, self.threads)
+        workers = min(self.workers, len(jobs))
+        if workers > 1:
+            with Pool(workers, initializer=init_worker, initargs=init_args) as pool:
+                results = list(
+                    tqdm(
+                        pool.imap_unordered(run_job, jobs, chunksize=4), total=len(jobs)
+                    )
+                )
+        else:
+            init_worker(*init_args)
+            results = [run_job(job) for job in tqdm(jobs)]
+
+        for result in results:
+            summary[result["status"]] += 1
+            if result["status"] == "failed":
+                print(f"Error with image {result['id']}: {result['error']}")
+        print(f"\tApplied transforms per status: {summary}")
+        return summary
@@ -0,0 +1,121 @@
+"""
+Vectorized derivation of the treatment information of the clinical data.
+
+Shared by the cohort creation (CohortCreation) and the correlation analysis
+(TumorAnalysis): the treatment type is looked up from the three yes/no treatment
+columns, and the CBTN ages are derived with column algebra after a single join of
+the first scan age of every patient, instead of walking the rows.
+"""
+import numpy as np
+import pandas as pd
+
+# Treatment type per (surgery, chemotherapy, radiation), indexed by
+# 4 * surgery + 2 * chemotherapy + radiation
+TREATMENT_TYPES = np.array(
+    [
+        "No Treatment",
+        "Radiation",
+        "Chemotherapy",
+        "Chemotherapy, Radiation",
+        "Surgery",
+        "Surgery, Radiation",
+        "Surgery, Chemotherapy",
+        "All Treatments",
+    ],
+    dtype=object,
+)
+
+
+def treatment_types(surgery, chemotherapy, radiation):
+    """
+    Treatment type of every row from the three treatment columns.
+
+    Args:
+        surgery (pd.Series): 'Yes' if the patient had a surgery.
+        chemotherapy (pd.Series): 'Yes' if the patient had a chemotherapy.
+        radiation (pd.Series): 'Yes' if the patient had a radiation.
+
+    Returns:
+        pd.Series: 'No Treatment', 'All Treatments' or the received treatments joined by
+        ', ' in the order surgery, chemotherapy, radiation.
+    """
+    codes = (
+        4 * (surgery == "Yes").to_numpy(dtype=np.int64)
+        + 2 * (chemotherapy == "Yes").to_numpy(dtype=np.int64)
+        + (radiation == "Yes").to_numpy(dtype=np.int64)
+    )
+    return pd.Series(TREATMENT_TYPES[codes], index=surgery.index, dtype=object)
+
+
+def bch_treatment_types(clinical_data):
+    """
+    Treatment type of the BCH clinical data, from the surgical resection, the systemic
+    therapy before radiation and the radiation as part of the initial treatment.
+    """
+    return treatment_types(
+        clinical_data["Surgical Resection"],
+        clinical_data["Systemic therapy before radiation"],
+        clinical_data["Radiation as part of initial treatment"],
+    )
+
+
+def cbtn_treatment_info(clinical_data, volumes_data):
+    """
+    Treatment information of the CBTN clinical data.
+
+    Only patients with volume data are derived, the others have missing values, except
+    for the age at first treatment which falls back to the age at the last clinical
+    follow-up for every patient without a treatment age.
+
+    Args:
+        clinical_data (pd.DataFrame): CBTN clinical data with 'CBTN Subject ID',
+            'Surgery', 'Chemotherapy', 'Radiation', 'Age at Treatment', 'Age at Diagnosis'
+            and 'Age at Last Clinical Follow-Up'.
+        volumes_data (pd.DataFrame): Volume time series with 'Patient_ID' and 'Age'.
+
+    Returns:
+        pd.DataFrame: With the index of clinical_data and the columns 'Age at First
+        Diagnosis' (the diagnosis age, or the truncated age at the first scan if it is
+        missing or later), 'Treatment Type', 'Received Treatment', 'Age at First
+        Treatment' and 'Age at Last Clinical Follow-Up' (at most the age at first
+        treatment).
+    """
+    # first age recorded in the volume data, joined once to the clinical rows
+    first_ages = volumes_data.groupby("Patient_ID")["Age"].min()
+    patient_ids = clinical_data["CBTN Subject ID"].astype(str)
+    has_volumes = patient_ids.isin(first_ages.index)
+    first_age = patient_ids.map(first_ages)
+
+    age_at_diagnosis = clinical_data["Age at Diagnosis"]
+    use_first_age = age_at_diagnosis.isna() | (age_at_diagnosis > first_age)
+    age_at_first_diagnosis = age_at_diagnosis.where(~use_first_age, np.trunc(first_age))
+
+    types = treatment_types(
+        clinical_data["Surgery"], clinical_data["Chemotherapy"], clinical_data["Radiation"]
+    )
+    received = np.where(types == "No Treatment", "No", "Yes")
+
+    last_follow_up = pd.to_numeric(
+        clinical_data["Age at Last Clinical Follow-Up"], errors="coerce"
+    )
+    age_at_first_treatment = pd.to_numeric(
+        clinical_data["Age at Treatment"].where(has_volumes), errors="coerce"
+    )
+    age_at_first_treatment = age_at_first_treatment.fillna(last_follow_up)
+
+    return pd.DataFrame(
+        {
+            "Age at First Diagnosis": pd.to_numeric(
+                age_at_first_diagnosis.where(has_volumes), errors="coerce"
+            ),
+            "Treatment Type": types.where(has_volumes),
+            "Received Treatment": pd.Series(received, index=clinical_data.index).where(
+                has_volumes
+            ),
+            "Age at First Treatment": age_at_first_treatment,
+            "Age at Last Clinical Follow-Up": np.minimum(
+                last_follow_up, age_at_first_treatment
+            ),
+        },
+        index=clinical_data.index,
+    )
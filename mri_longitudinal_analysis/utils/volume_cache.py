@@ -0,0 +1,202 @@
+"""
+Persistent cache for the mask volumes computed in the volume estimation stage.
+
+Every entry is keyed by the absolute path of the mask and validated with the file
+size and modification time (optionally with a content hash), so that re-runs of
+the pipeline only recompute the volumes of new or modified segmentations. The
+lesion statistics of a mask are stored alongside as JSON.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_content_hash(file_path, chunk_bytes=HASH_CHUNK_BYTES):
+    """
+    Hash the raw (compressed) bytes of a file with BLAKE2b.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_bytes), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VolumeCache:
+    """
+    SQLite backed store of mask volumes, spacing and foreground voxel counts.
+
+    Attributes:
+        db_path (str): Path to the SQLite file.
+        use_content_hash (bool): If True, entries whose modification time changed
+            but whose content hash is unchanged are still considered valid.
+    """
+
+    def __init__(self, db_path, use_content_hash=False):
+        self.db_path = str(db_path)
+        self.use_content_hash = use_content_hash
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS volumes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    content_hash TEXT,
+                    volume REAL NOT NULL,
+                    num_voxels INTEGER NOT NULL,
+                    spacing_x REAL NOT NULL,
+                    spacing_y REAL NOT NULL,
+                    spacing_z REAL NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    statistics TEXT
+                )
+                """
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(volumes)")]
+            if "statistics" not in columns:
+                conn.execute("ALTER TABLE volumes ADD COLUMN statistics TEXT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def file_signature(file_path):
+        """
+        Return the (size, mtime_ns) pair used to detect modified files.
+        """
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, file_paths, statistics_signature=None):
+        """
+        Split the given files into cached entries and files that need to be (re)computed.
+
+        Args:
+            file_paths (list): Paths to the mask files.
+            statistics_signature (str, optional): If given, entries are only valid if
+                their lesion statistics were computed with this configuration.
+
+        Returns:
+            tuple: (dict mapping path -> (volume, num_voxels, spacing) for valid
+            entries, with the statistics dict as fourth element if a signature is
+            given, dict mapping the paths that are new or stale -> their file
+            signature (size, mtime_ns, content_hash) taken before they are measured,
+            to be passed on to update()).
+        """
+        hits = {}
+        misses = {}
+        refreshed = []
+        with self._connect() as conn:
+            for file_path in file_paths:
+                key = os.path.abspath(file_path)
+                size, mtime_ns = self.file_signature(file_path)
+                row = conn.execute(
+                    "SELECT size, mtime_ns, content_hash, volume, num_voxels,"
+                    " spacing_x, spacing_y, spacing_z, statistics FROM volumes"
+                    " WHERE path = ?",
+                    (key,),
+                ).fetchone()
+                signature = (size, mtime_ns, None)
+                if row is None or row[0] != size:
+                    misses[file_path] = signature
+                    continue
+                statistics = json.loads(row[8]) if row[8] else {}
+                if (
+                    statistics_signature is not None
+                    and statistics.get("signature") != statistics_signature
+                ):
+                    misses[file_path] = signature
+                    continue
+                if row[1] != mtime_ns:
+                    content_hash = (
+                        file_content_hash(file_path) if self.use_content_hash else None
+                    )
+                    if not (row[2] is not None and row[2] == content_hash):
+                        misses[file_path] = (size, mtime_ns, content_hash)
+                        continue
+                    refreshed.append((mtime_ns, key))
+                hits[file_path] = (row[3], row[4], (row[5], row[6], row[7]))
+                if statistics_signature is not None:
+                    hits[file_path] += (statistics["values"],)
+
+            if refreshed:
+                conn.executemany(
+                    "UPDATE volumes SET mtime_ns = ? WHERE path = ?", refreshed
+                )
+        if self.use_content_hash:
+            for file_path, (size, mtime_ns, content_hash) in misses.items():
+                if content_hash is None:
+                    misses[file_path] = (size, mtime_ns, file_content_hash(file_path))
+        return hits, misses
+
+    def update(self, results, statistics_signature=None, signatures=None):
+        """
+        Insert or replace the cache entries for freshly computed volumes.
+
+        Args:
+            results (dict): Mapping path -> (volume, num_voxels, spacing), with the
+                lesion statistics dict as optional fourth element.
+            statistics_signature (str, optional): Configuration the statistics
+                were computed with.
+            signatures (dict, optional): File signatures of the misses of lookup(),
+                taken before the files were read. A file modified while it was
+                measured then no longer matches its entry and is measured again.
+                Files without one are signed now.
+        """
+        signatures = signatures or {}
+        rows = []
+        now = datetime.now().isoformat(timespec="seconds")
+        for file_path, (volume, num_voxels, spacing, *statistics) in results.items():
+            size, mtime_ns, content_hash = signatures.get(file_path, (None, None, None))
+            if size is None:
+                size, mtime_ns = self.file_signature(file_path)
+            if content_hash is None and self.use_content_hash:
+                content_hash = file_content_hash(file_path)
+            rows.append(
+                (
+                    os.path.abspath(file_path),
+                    size,
+                    mtime_ns,
+                    content_hash,
+                    float(volume),
+                    int(num_voxels),
+                    float(spacing[0]),
+                    float(spacing[1]),
+                    float(spacing[2]),
+                    now,
+                    json.dumps(
+                        {"signature": statistics_signature, "values": statistics[0]}
+                    )
+                    if statistics
+                    else None,
+                )
+            )
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO volumes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def prune(self, file_paths):
+        """
+        Remove the entries of masks that are no longer part of the given file list.
+        """
+        keep = {os.path.abspath(file_path) for file_path in file_paths}
+        with self._connect() as conn:
+            stored = [row[0] for row in conn.execute("SELECT path FROM volumes")]
+            removed = [(path,) for path in stored if path not in keep]
+            conn.executemany("DELETE FROM volumes WHERE path = ?", removed)
+        return len(removed)